@@ -6,6 +6,7 @@ from node.ext.ldap.scope import SUBTREE
 from node.ext.ldap.base import LDAPCommunicator
 from node.ext.ldap.base import LDAPConnector
 from node.ext.ldap.base import testLDAPConnectivity
+from node.ext.ldap.session import AsyncLDAPSession
 from node.ext.ldap.session import LDAPSession
 from node.ext.ldap._node import LDAPNode
 from node.ext.ldap._node import LDAPNodeAttributes
@@ -18,15 +18,18 @@ from node.ext.ldap import BASE
 from node.ext.ldap import LDAPSession
 from node.ext.ldap import ONELEVEL
 from node.ext.ldap.base import ensure_text
+from node.ext.ldap.base import sort_entries
 from node.ext.ldap.events import LDAPNodeAddedEvent
 from node.ext.ldap.events import LDAPNodeCreatedEvent
 from node.ext.ldap.events import LDAPNodeDetachedEvent
 from node.ext.ldap.events import LDAPNodeModifiedEvent
 from node.ext.ldap.events import LDAPNodeRemovedEvent
+from node.ext.ldap.filter import chunked_or_filters
 from node.ext.ldap.filter import LDAPDictFilter
 from node.ext.ldap.filter import LDAPFilter
 from node.ext.ldap.filter import LDAPRelationFilter
 from node.ext.ldap.interfaces import ILDAPStorage
+from node.ext.ldap.paging import iter_pages
 from node.ext.ldap.schema import LDAPSchemaInfo
 from node.interfaces import IInvalidate
 from node.utils import CHARACTER_ENCODING
@@ -36,6 +39,7 @@ from node.utils import encode
 from plumber import Behavior
 from plumber import default
 from plumber import finalize
+from plumber import override
 from plumber import plumb
 from plumber import plumbing
 from zope.deprecation import deprecated
@@ -56,8 +60,30 @@ class LDAPAttributesBehavior(Behavior):
     @plumb
     def __init__(_next, self, name=None, parent=None):
         _next(self, name=name, parent=parent)
+        # lowercase names of loaded attributes if only a part of the
+        # attributes is loaded, None if all attributes are loaded
+        self._loaded = None
         self.load()
 
+    @plumb
+    def __getitem__(_next, self, key):
+        try:
+            return _next(self, key)
+        except KeyError:
+            loaded = self._loaded
+            if loaded is None or ensure_text(key).lower() in loaded:
+                raise
+        # load attribute lazily
+        self.load_attrs([ensure_text(key)])
+        return _next(self, key)
+
+    @plumb
+    def __iter__(_next, self):
+        # load remaining attributes before iteration
+        if self._loaded is not None:
+            self.load_attrs()
+        return _next(self)
+
     @default
     def load(self):
         ldap_node = self.parent
@@ -67,9 +93,16 @@ class LDAPAttributesBehavior(Behavior):
                 or ldap_node._action == ACTION_ADD:
             return
         # clear in case reload
+        self._loaded = None
         self.clear()
-        # query all attributes
+        # query eager attributes if configured, remaining attributes get
+        # loaded lazily. query all attributes otherwise
+        loaded = None
         attrlist = ['*']
+        eager = ldap_node.root._eager_attributes
+        if eager:
+            attrlist = list(eager)
+            loaded = set([attr.lower() for attr in eager])
 
         # XXX: operational attributes
         # if self.session._props.operationalAttributes:
@@ -79,26 +112,36 @@ class LDAPAttributesBehavior(Behavior):
         # if self.session._props.memberOfSupport:
         #    attrlist.append('memberOf')
 
-        # fetch attributes for ldap_node
-        entry = ldap_node.ldap_session.search(
-            scope=BASE,
-            baseDN=ldap_node.DN,
-            force_reload=ldap_node._reload,
-            attrlist=attrlist
-        )
-        # result length must be 1
-        if len(entry) != 1:  # pragma: no cover
-            raise RuntimeError(
-                "Fatal. Expected entry does not exist "
-                "or more than one entry found"
+        # use attributes prefetched by parent. they are only used once,
+        # subsequent loads fetch attributes from LDAP
+        attrs = ldap_node._prefetched
+        if attrs is not None:
+            ldap_node._prefetched = None
+            loaded = ldap_node._partial_attrlist
+            ldap_node._partial_attrlist = None
+        else:
+            # fetch attributes for ldap_node
+            entry = ldap_node.ldap_session.search(
+                scope=BASE,
+                baseDN=ldap_node.DN,
+                force_reload=ldap_node._reload,
+                attrlist=attrlist
             )
+            # result length must be 1
+            if len(entry) != 1:  # pragma: no cover
+                raise RuntimeError(
+                    "Fatal. Expected entry does not exist "
+                    "or more than one entry found"
+                )
+            attrs = entry[0][1]
         # read attributes from result and set to self
-        attrs = entry[0][1]
         for key, item in attrs.items():
             if len(item) == 1 and not self.is_multivalued(key):
                 self[key] = item[0]
             else:
                 self[key] = item
+        if loaded is not None:
+            self._loaded = set(loaded)
         # __setitem__ has set our changed flag. We just loaded from LDAP, so
         # unset it
         self.changed = False
@@ -113,6 +156,44 @@ class LDAPAttributesBehavior(Behavior):
             ldap_node._action = None
             ldap_node.changed = False
 
+    @default
+    def load_attrs(self, attrlist=None):
+        """Load attributes not loaded yet.
+
+        Loaded attributes are merged into already loaded ones, modified or
+        deleted attributes are kept.
+
+        :param attrlist: Names of attributes to load. Loads all remaining
+            attributes if None.
+        """
+        loaded = self._loaded
+        if loaded is None:
+            return
+        if attrlist is not None:
+            attrlist = [attr for attr in attrlist if attr.lower() not in loaded]
+            if not attrlist:
+                return
+        ldap_node = self.parent
+        entry = ldap_node.ldap_session.search(
+            scope=BASE,
+            baseDN=ldap_node.DN,
+            force_reload=ldap_node._reload,
+            attrlist=attrlist or ['*']
+        )
+        for key, item in entry[0][1].items():
+            if key.lower() in loaded:
+                continue
+            if len(item) == 1 and not self.is_multivalued(key):
+                item = item[0]
+            if not self.is_binary(key):
+                item = decode(item)
+            # write to storage directly, loading does not modify the node
+            self.storage[ensure_text(key)] = item
+        if attrlist is None:
+            self._loaded = None
+        else:
+            loaded.update([attr.lower() for attr in attrlist])
+
     @plumb
     def __setitem__(_next, self, key, val):
         if not val and not isinstance(val, (list, tuple)):
@@ -122,11 +203,17 @@ class LDAPAttributesBehavior(Behavior):
         if not self.is_binary(key):
             val = decode(val)
         key = ensure_text(key)
+        # set attribute must not be overwritten by lazy loading
+        if self._loaded is not None:
+            self._loaded.add(key.lower())
         _next(self, key, val)
         self._set_attrs_modified()
 
     @plumb
     def __delitem__(_next, self, key):
+        key = ensure_text(key)
+        if self._loaded is not None:
+            self.load_attrs([key])
         _next(self, key)
         self._set_attrs_modified()
 
@@ -191,9 +278,13 @@ class LDAPStorage(OdictStorage):
         self._modified_children = set()
         self._deleted_children = set()
         self._reload = False
+        self._prefetched = None
+        self._partial_attrlist = None
         self._multivalued_attributes = set()
         self._binary_attributes = set()
+        self._eager_attributes = None
         self._page_size = 1000
+        self._page_read_ahead = 0
         if props:
             # only at root node
             self._ldap_session = LDAPSession(props)
@@ -201,7 +292,9 @@ class LDAPStorage(OdictStorage):
             self._ldap_schema_info = LDAPSchemaInfo(props)
             self._multivalued_attributes = props.multivalued_attributes
             self._binary_attributes = props.binary_attributes
+            self._eager_attributes = getattr(props, 'eager_attributes', None)
             self._page_size = props.page_size
+            self._page_read_ahead = getattr(props, 'page_read_ahead', 0)
         # search related defaults
         self.search_scope = ONELEVEL
         self.search_filter = None
@@ -210,6 +303,8 @@ class LDAPStorage(OdictStorage):
         # creation related default
         self.child_factory = LDAPNode
         self.child_defaults = None
+        # flag whether to prefetch attributes of children on iteration
+        self.prefetch = False
 
     @finalize
     def __getitem__(self, key):
@@ -218,22 +313,16 @@ class LDAPStorage(OdictStorage):
         try:
             return self.storage[key]
         except KeyError:
-            val = self.child_factory()
-            val.__name__ = key
-            val.__parent__ = self
             try:
                 res = self.ldap_session.search(
                     scope=BASE,
-                    baseDN=val.DN,
+                    baseDN=self.child_dn(key),
                     attrlist=['']  # no need for attrs
                 )
-                # remember DN
-                val._dn = res[0][0]
-                val._ldap_session = self.ldap_session
-                self.storage[key] = val
-                return val
             except (NO_SUCH_OBJECT, INVALID_DN_SYNTAX):
                 raise KeyError(key)
+            # remember DN
+            return self._attach_child(key, res[0][0])
 
     @finalize
     def __setitem__(self, key, val):
@@ -292,10 +381,14 @@ class LDAPStorage(OdictStorage):
     def __iter__(self):
         if self.name is None:
             return
-        cookie = ''
-        while True:
+        if self.prefetch:
+            for key, _ in self._hydrated_children():
+                yield key
+            return
+
+        def search_page(cookie):
             try:
-                res = self.ldap_session.search(
+                return self.ldap_session.search(
                     scope=ONELEVEL,
                     baseDN=self.DN,
                     attrlist=[''],
@@ -304,20 +397,42 @@ class LDAPStorage(OdictStorage):
                 )
             except NO_SUCH_OBJECT:
                 # happens if not persisted yet
-                res = list()
-            if isinstance(res, tuple):
-                res, cookie = res
+                return list()
+
+        pages = iter_pages(
+            search_page,
+            self.root._page_read_ahead,
+            release=self.ldap_session.release_paged
+        )
+        for res in pages:
             for dn, _ in res:
                 key = ensure_text(explode_dn(dn)[0])
                 # do not yield if node is supposed to be deleted
                 if key not in self._deleted_children:
                     yield key
-            if not cookie:
-                break
         # also yield keys of children not persisted yet.
         for key in self._added_children:
             yield key
 
+    @override
+    def __len__(self):
+        # count persisted children in directory instead of iterating them.
+        # the sort key enables counting via virtual list view. entries lacking
+        # the sort attribute are counted as well, thus the RDN attribute of
+        # this node is used
+        if self.name is None:
+            return 0
+        try:
+            count = self.ldap_session.count(
+                scope=ONELEVEL,
+                baseDN=self.DN,
+                sort_key=self.rdn_attr
+            )
+        except NO_SUCH_OBJECT:
+            # happens if not persisted yet
+            count = 0
+        return count - len(self._deleted_children) + len(self._added_children)
+
     @finalize
     def __call__(self):
         if self.changed and self._action is not None:
@@ -475,15 +590,140 @@ class LDAPStorage(OdictStorage):
                 return None
         return node
 
+    @default
+    def _node_by_search_dn(self, dn, attrs=None, attrlist=None):
+        # return node for DN contained in a search result. The entry and all
+        # its parents are known to exist, thus nodes not contained in storage
+        # yet get created without checking existence in the directory.
+        root = node = self.root
+        base_dn = root.name
+        if not dn.lower().endswith(base_dn.lower()):
+            raise ValueError(
+                u'Invalid DN "{0}" for given base DN "{1}"'.format(dn, base_dn))
+        rdns = explode_dn(dn[:len(dn) - len(base_dn)].strip(','))
+        if not rdns:
+            return node
+        # attributes contained in search result are used for loading node
+        # attributes of the entry
+        partial = None
+        attrlist = self._search_attrlist(attrlist)
+        if not attrlist:
+            attrs = None
+        elif '*' not in attrlist:
+            partial = set([attr.lower() for attr in attrlist])
+        for rdn in reversed(rdns[1:]):
+            rdn = ensure_text(rdn)
+            try:
+                node = node.storage[rdn]
+            except KeyError:
+                node = node._attach_child(rdn, node.child_dn(rdn))
+        rdn = ensure_text(rdns[0])
+        try:
+            return node.storage[rdn]
+        except KeyError:
+            return node._attach_child(rdn, dn, attrs, partial)
+
     @default
     @debug
     def search(self, queryFilter=None, criteria=None, attrlist=None,
                relation=None, relation_node=None, exact_match=False,
                or_search=False, or_keys=None, or_values=None,
-               page_size=None, cookie=None, get_nodes=False):
-        attrset = set(attrlist or [])
-        attrset.discard('dn')
-        attrset.discard('rdn')
+               page_size=None, cookie=None, get_nodes=False, sort_keys=None,
+               offset=0, count=None, match_attr=None, match_values=None,
+               chunk_size=100):
+        _filter = self._search_filter(
+            queryFilter=queryFilter,
+            criteria=criteria,
+            relation=relation,
+            relation_node=relation_node,
+            or_search=or_search,
+            or_keys=or_keys,
+            or_values=or_values
+        )
+        if match_attr is not None:
+            if page_size or cookie is not None:
+                raise ValueError(
+                    u'match_values cannot be combined with page_size'
+                )
+            matches = self._search_chunked(
+                _filter,
+                match_attr,
+                match_values,
+                attrlist,
+                chunk_size,
+                sort_keys
+            )
+            if offset or count is not None:
+                end = None if count is None else offset + max(count, 0)
+                matches = matches[offset:end]
+        else:
+            # perform the backend search
+            logger.debug("LDAP search with filter: \n{0}".format(_filter))
+            matches = self.ldap_session.search(
+                str(_filter),
+                self.search_scope,
+                baseDN=self.DN,
+                force_reload=self._reload,
+                attrlist=self._search_attrlist(attrlist),
+                page_size=page_size,
+                cookie=cookie,
+                sort_keys=sort_keys,
+                offset=offset,
+                count=count
+            )
+        if type(matches) is tuple:
+            matches, cookie = matches
+        # check exact match
+        if exact_match and len(matches) > 1:
+            raise ValueError(u"Exact match asked but result not unique")
+        if exact_match and len(matches) == 0:
+            raise ValueError(u"Exact match asked but result length is zero")
+        # extract key and desired attributes
+        res = [
+            self._search_item(dn, attrs, attrlist, get_nodes)
+            for dn, attrs in matches
+        ]
+        if cookie is not None:
+            return (res, cookie)
+        return res
+
+    @default
+    def iter_search(self, queryFilter=None, criteria=None, attrlist=None,
+                    relation=None, relation_node=None, or_search=False,
+                    or_keys=None, or_values=None, page_size=None,
+                    get_nodes=False):
+        """Search generator yielding results as they arrive.
+
+        Search results are neither cached nor collected, thus memory
+        consumption is bounded regardless of the result size. Pages are
+        requested transparently.
+        """
+        if page_size is None:
+            page_size = self.ldap_session._props.page_size
+        _filter = self._search_filter(
+            queryFilter=queryFilter,
+            criteria=criteria,
+            relation=relation,
+            relation_node=relation_node,
+            or_search=or_search,
+            or_keys=or_keys,
+            or_values=or_values
+        )
+        logger.debug("LDAP iter search with filter: \n{0}".format(_filter))
+        matches = self.ldap_session.iter_search(
+            str(_filter),
+            self.search_scope,
+            baseDN=self.DN,
+            attrlist=self._search_attrlist(attrlist),
+            page_size=page_size
+        )
+        for dn, attrs in matches:
+            yield self._search_item(dn, attrs, attrlist, get_nodes)
+
+    @default
+    def _search_filter(self, queryFilter=None, criteria=None, relation=None,
+                       relation_node=None, or_search=False, or_keys=None,
+                       or_values=None):
         # Create queryFilter from all filter definitions
         # filter for this search ANDed with the default filters defined on self
         search_filter = LDAPFilter(queryFilter)
@@ -507,55 +747,109 @@ class LDAPStorage(OdictStorage):
                 _filter &= relation
             else:
                 _filter &= LDAPRelationFilter(relation_node, relation)
-        # perform the backend search
-        logger.debug("LDAP search with filter: \n{0}".format(_filter))
-        matches = self.ldap_session.search(
+        return _filter
+
+    @default
+    def _search_chunked(self, _filter, match_attr, match_values, attrlist,
+                        chunk_size, sort_keys):
+        # search entries matching any of match_values in match_attr. The
+        # values get split into OR filters of at most chunk_size values,
+        # searches for the chunks are pipelined and the results merged
+        query_attrlist = self._search_attrlist(attrlist)
+        if sort_keys and query_attrlist and '*' not in query_attrlist:
+            # sort attributes must be contained in search result
+            queried = set([attr.lower() for attr in query_attrlist])
+            for sort_key in sort_keys:
+                attr = sort_key.lstrip('-').split(':')[0]
+                if attr.lower() not in queried:
+                    queried.add(attr.lower())
+                    query_attrlist.append(attr)
+        requests = list()
+        for chunk_filter in chunked_or_filters(
+            match_attr,
+            match_values,
+            chunk_size
+        ):
+            query = _filter & chunk_filter
+            logger.debug("LDAP chunked search with filter: \n{0}".format(
+                query
+            ))
+            requests.append(dict(
+                queryFilter=str(query),
+                scope=self.search_scope,
+                baseDN=self.DN,
+                force_reload=self._reload,
+                attrlist=query_attrlist
+            ))
+        matches = list()
+        if not requests:
+            return matches
+        seen = set()
+        for res in self.ldap_session.multi_search(requests):
+            for dn, attrs in res:
+                if dn in seen:
+                    continue
+                seen.add(dn)
+                matches.append((dn, attrs))
+        if sort_keys:
+            matches = sort_entries(matches, sort_keys)
+        return matches
+
+    @default
+    def _search_attrlist(self, attrlist):
+        # attributes to query from directory. dn and rdn are computed
+        attrset = set(attrlist or [])
+        attrset.discard('dn')
+        attrset.discard('rdn')
+        return list(attrset)
+
+    @default
+    def _search_item(self, dn, attrs, attrlist, get_nodes):
+        # extract key and desired attributes from search result entry
+        dn = decode(dn)
+        if attrlist is None:
+            if get_nodes:
+                return self._node_by_search_dn(dn)
+            return dn
+        resattr = dict()
+        for k, v in six.iteritems(attrs):
+            if k in attrlist:
+                # Check binary binary attribute directly from root
+                # data to avoid initing attrs for a simple search.
+                if k in self.root._binary_attributes:
+                    resattr[decode(k)] = v
+                else:
+                    resattr[decode(k)] = decode(v)
+        if 'dn' in attrlist:
+            resattr[u'dn'] = dn
+        if 'rdn' in attrlist:
+            rdn = explode_dn(dn)[0]
+            resattr[u'rdn'] = decode(rdn)
+        if get_nodes:
+            return (self._node_by_search_dn(dn, attrs, attrlist), resattr)
+        return (dn, resattr)
+
+    @default
+    def count(self, queryFilter=None, criteria=None, relation=None,
+              relation_node=None, or_search=False, or_keys=None,
+              or_values=None, sort_key=None, size_limit=None):
+        _filter = self._search_filter(
+            queryFilter=queryFilter,
+            criteria=criteria,
+            relation=relation,
+            relation_node=relation_node,
+            or_search=or_search,
+            or_keys=or_keys,
+            or_values=or_values
+        )
+        logger.debug("LDAP count with filter: \n{0}".format(_filter))
+        return self.ldap_session.count(
             str(_filter),
             self.search_scope,
             baseDN=self.DN,
-            force_reload=self._reload,
-            attrlist=list(attrset),
-            page_size=page_size,
-            cookie=cookie
+            sort_key=sort_key,
+            size_limit=size_limit
         )
-        if type(matches) is tuple:
-            matches, cookie = matches
-        # check exact match
-        if exact_match and len(matches) > 1:
-            raise ValueError(u"Exact match asked but result not unique")
-        if exact_match and len(matches) == 0:
-            raise ValueError(u"Exact match asked but result length is zero")
-        # extract key and desired attributes
-        res = []
-        for dn, attrs in matches:
-            dn = decode(dn)
-            if attrlist is not None:
-                resattr = dict()
-                for k, v in six.iteritems(attrs):
-                    if k in attrlist:
-                        # Check binary binary attribute directly from root
-                        # data to avoid initing attrs for a simple search.
-                        if k in self.root._binary_attributes:
-                            resattr[decode(k)] = v
-                        else:
-                            resattr[decode(k)] = decode(v)
-                if 'dn' in attrlist:
-                    resattr[u'dn'] = dn
-                if 'rdn' in attrlist:
-                    rdn = explode_dn(dn)[0]
-                    resattr[u'rdn'] = decode(rdn)
-                if get_nodes:
-                    res.append((self.node_by_dn(dn, strict=True), resattr))
-                else:
-                    res.append((dn, resattr))
-            else:
-                if get_nodes:
-                    res.append(self.node_by_dn(dn, strict=True))
-                else:
-                    res.append(dn)
-        if cookie is not None:
-            return (res, cookie)
-        return res
 
     @default
     def batched_search(self, page_size=None, search_func=None, **kw):
@@ -565,16 +859,19 @@ class LDAPStorage(OdictStorage):
             page_size = self.ldap_session._props.page_size
         if search_func is None:
             search_func = self.search
-        matches = []
-        cookie = None
         kw['page_size'] = page_size
-        while True:
-            kw['cookie'] = cookie
-            matches, cookie = search_func(**kw)
+
+        def search_page(cookie):
+            return search_func(cookie=cookie, **kw)
+
+        pages = iter_pages(
+            search_page,
+            self.root._page_read_ahead,
+            release=self.ldap_session.release_paged
+        )
+        for matches in pages:
             for item in matches:
                 yield item
-            if not cookie:
-                break
 
     @default
     def invalidate(self, key=None):
@@ -612,6 +909,101 @@ class LDAPStorage(OdictStorage):
         except KeyError:
             pass
 
+    @override
+    def values(self, attrlist=None):
+        """Return child nodes.
+
+        Child nodes not contained in storage yet get created with their
+        attributes from one paged ``ONELEVEL`` search.
+
+        :param attrlist: List of attributes to load. Defaults to all user
+            attributes. Attributes not contained in attrlist get loaded
+            lazily on access.
+        """
+        return [node for _, node in self._hydrated_children(attrlist)]
+
+    @override
+    def items(self, attrlist=None):
+        """Return (key, node) tuples of children.
+
+        See ``values``.
+        """
+        return list(self._hydrated_children(attrlist))
+
+    @override
+    def itervalues(self, attrlist=None):
+        for _, node in self._hydrated_children(attrlist):
+            yield node
+
+    @override
+    def iteritems(self, attrlist=None):
+        for item in self._hydrated_children(attrlist):
+            yield item
+
+    @default
+    def _hydrated_children(self, attrlist=None):
+        # search children including attributes and yield (key, node) tuples.
+        # children not contained in storage yet get created with prefetched
+        # attributes, thus neither checking existence nor loading attributes
+        # requires another search.
+        if self.name is None:
+            return
+        partial = None
+        if attrlist is None:
+            attrlist = ['*']
+        elif '*' not in attrlist:
+            partial = set([attr.lower() for attr in attrlist])
+
+        def search_page(cookie):
+            try:
+                return self.ldap_session.search(
+                    scope=ONELEVEL,
+                    baseDN=self.DN,
+                    force_reload=self._reload,
+                    attrlist=attrlist,
+                    page_size=self._page_size,
+                    cookie=cookie
+                )
+            except NO_SUCH_OBJECT:
+                # happens if not persisted yet
+                return list()
+
+        pages = iter_pages(
+            search_page,
+            self.root._page_read_ahead,
+            release=self.ldap_session.release_paged
+        )
+        for res in pages:
+            for dn, attrs in res:
+                key = ensure_text(explode_dn(dn)[0])
+                # do not yield if node is supposed to be deleted
+                if key in self._deleted_children:
+                    continue
+                try:
+                    node = self.storage[key]
+                except KeyError:
+                    node = self._attach_child(key, dn, attrs, partial)
+                yield key, node
+        # also yield children not persisted yet.
+        for key in self._added_children:
+            yield key, self.storage[key]
+
+    @default
+    def _attach_child(self, key, dn, attrs=None, partial=None):
+        # create child node for key known to exist in the directory and add it
+        # to storage. if attrs are given, node attributes get loaded from them
+        # instead of searching the directory.
+        node = self.child_factory()
+        node.__name__ = key
+        node.__parent__ = self
+        node._dn = dn
+        node._ldap_session = self.ldap_session
+        node._prefetched = attrs
+        node._partial_attrlist = partial
+        node.prefetch = self.prefetch
+        self.storage[key] = node
+        return node
+
     @default
     def _create_suitable_node(self, vessel):
         # convert vessel node to LDAPNode
@@ -638,6 +1030,8 @@ class LDAPStorage(OdictStorage):
     def _ldap_modify(self):
         # modifies attributs of self on the ldap directory.
         modlist = list()
+        # load remaining attributes at once instead of lazily one by one
+        self.attrs.load_attrs()
         orgin = self.attributes_factory(name='__attrs__', parent=self)
         for key in orgin:
             # MOD_DELETE
@@ -1,14 +1,27 @@
 # -*- coding: utf-8 -*-
 from bda.cache import ICacheManager
 from bda.cache.interfaces import INullCacheProvider
+from contextlib import contextmanager
+from ldap.controls.sss import SSSRequestControl
+from ldap.controls.vlv import VLVRequestControl
+from ldap.controls.vlv import VLVResponseControl
+from node.ext.ldap.cache import NEGATIVE_RESULT
 from node.ext.ldap.cache import nullcacheProviderFactory
+from node.ext.ldap.cache import search_cache_index
 from node.ext.ldap.interfaces import ICacheProviderFactory
+from node.ext.ldap.interfaces import ILayeredCacheProvider
+from node.ext.ldap.interfaces import IMemoryCacheProvider
+from node.ext.ldap.pool import LDAPConnectionPool
 from node.ext.ldap.properties import LDAPProps
+from node.ext.ldap.scope import SUBTREE
 from zope.component import queryUtility
+import collections
 import hashlib
 import ldap
 import logging
 import six
+import threading
+import time
 
 
 logger = logging.getLogger('node.ext.ldap')
@@ -49,6 +62,21 @@ def md5digest(key):
     return m.hexdigest()
 
 
+def digest_key(key):
+    """Return hex digest of a tuple based cache key.
+
+    Used as key for cache stores outside the process, which require string
+    keys of limited length.
+
+    :param key: Tuple based cache key.
+    :return digest: hex digest.
+    """
+    return hashlib.blake2b(
+        repr(key).encode('utf-8'),
+        digest_size=16
+    ).hexdigest()
+
+
 def cache_key(parts):
     def dec(p):
         if isinstance(p, bytes):
@@ -67,6 +95,53 @@ def ensure_text(value):
     return value
 
 
+def normalize_dn(dn):
+    """Return normalized DN suitable for comparison.
+
+    Attribute types and values get lowercased and whitespace around
+    separators gets removed.
+
+    :raise ldap.DECODING_ERROR: If given DN is invalid.
+    """
+    return ldap.dn.dn2str([
+        [(attr.lower(), value.lower(), flags) for attr, value, flags in rdn]
+        for rdn in ldap.dn.str2dn(dn)
+    ])
+
+
+def sort_entries(entries, sort_keys):
+    """Sort search result entries client side.
+
+    Used as fallback if the server does not support server side sorting.
+    Values are compared case insensitive, entries lacking a sort attribute
+    are considered larger than all others as defined by RFC 2891. For multi
+    valued attributes the smallest respective largest value is used.
+
+    :param entries: List of (dn, attrs) tuples.
+    :param sort_keys: List of attribute names. Descending order is requested
+        by prefixing the attribute name with ``-``. Ordering rules given as
+        ``attr:rule`` are ignored.
+    :return: Sorted list of entries.
+    """
+    entries = list(entries)
+    # python sort is stable, thus sorting by the least significant key first
+    for sort_key in reversed(sort_keys):
+        reverse = sort_key.startswith('-')
+        attr = sort_key.lstrip('-').split(':')[0].lower()
+
+        def value(entry, attr=attr, reverse=reverse):
+            values = [
+                ensure_text(v).lower() for k, vals in entry[1].items()
+                if k.lower() == attr for v in vals
+            ]
+            if not values:
+                return (True, u'')
+            return (False, max(values) if reverse else min(values))
+
+        entries.sort(key=value, reverse=reverse)
+    return entries
+
+
 def ensure_bytes(value):
     if value and isinstance(value, six.text_type):
         value = value.encode('utf-8')
@@ -100,6 +175,7 @@ class LDAPConnector(object):
         self._bindPW = props.password
         self._cache = props.cache
         self._cachetimeout = props.timeout
+        self._negative_timeout = getattr(props, 'negative_timeout', None)
         self._start_tls = props.start_tls
         self._ignore_cert = props.ignore_cert
         self._tls_cacert_file = props.tls_cacertfile
@@ -113,10 +189,70 @@ class LDAPConnector(object):
         self._conn_timeout = getattr(props, "conn_timeout", -1)
         self._op_timeout = getattr(props, "op_timeout", -1)
         self._con = None
+        # control OIDs advertised by server root DSE, read on demand
+        self._supported_controls = None
+        # connection pooling is disabled if pool size is 0. Use getattr for
+        # props objects not providing the pool properties
+        self._pool = None
+        pool_size = getattr(props, 'pool_size', 0)
+        if pool_size:
+            self._pool = LDAPConnectionPool(
+                self._connect,
+                size=pool_size,
+                min_size=getattr(props, 'pool_min_size', 0),
+                idle_timeout=getattr(props, 'pool_idle_timeout', 300),
+                checkout_timeout=getattr(props, 'pool_timeout', None),
+                check_interval=getattr(props, 'pool_check_interval', 60)
+            )
+        self._auth_pool = None
+        auth_pool_size = getattr(props, 'auth_pool_size', 0)
+        if auth_pool_size:
+            self._auth_pool = LDAPConnectionPool(
+                self._connect_auth,
+                size=auth_pool_size,
+                idle_timeout=getattr(props, 'pool_idle_timeout', 300),
+                checkout_timeout=getattr(props, 'auth_pool_timeout', None),
+                check_interval=getattr(props, 'pool_check_interval', 60)
+            )
+
+    @property
+    def pool(self):
+        """``LDAPConnectionPool`` instance or None if pooling is disabled.
+        """
+        return self._pool
+
+    @property
+    def auth_pool(self):
+        """``LDAPConnectionPool`` instance used for credential checks or None
+        if pooling of bind-check connections is disabled.
+        """
+        return self._auth_pool
 
     def bind(self):
         """Bind to Server and return the Connection Object.
         """
+        self._con = self._connect()
+        return self._con
+
+    def _connect(self):
+        """Create, bind and return a new connection object.
+        """
+        con = self._initialize(reconnect=True)
+        con.simple_bind_s(self._bindDN, self._bindPW)
+        return con
+
+    def _connect_auth(self):
+        """Create and return a new connection object used for credential
+        checks.
+
+        Plain ``LDAPObject`` is used since ``ReconnectLDAPObject`` remembers
+        and reapplies the last bind credentials on reconnect.
+        """
+        return self._initialize(reconnect=False)
+
+    def _initialize(self, reconnect=True):
+        """Create and return a new unbound connection object.
+        """
         if self._ignore_cert:  # pragma: no cover
             ldap.set_option(ldap.OPT_X_TLS_REQUIRE_CERT, ldap.OPT_X_TLS_NEVER)
         elif self._tls_cacert_file:  # pragma: no cover
@@ -128,33 +264,95 @@ class LDAPConnector(object):
             ldap.set_option(ldap.OPT_X_TLS_KEYFILE, self._tls_clkey_file)
         elif self._tls_clcert_file or self._tls_clkey_file:  # pragma: no cover
             logger.exception("Only client certificate or key have been provided.")
-        self._con = ldap.ldapobject.ReconnectLDAPObject(
-            self._uri,
-            bytes_mode=False,
-            bytes_strictness='silent',
-            retry_max=self._retry_max,
-            retry_delay=self._retry_delay
-        )
+        if reconnect:
+            con = ldap.ldapobject.ReconnectLDAPObject(
+                self._uri,
+                bytes_mode=False,
+                bytes_strictness='silent',
+                retry_max=self._retry_max,
+                retry_delay=self._retry_delay
+            )
+        else:
+            con = ldap.initialize(
+                self._uri,
+                bytes_mode=False,
+                bytes_strictness='silent'
+            )
         # Turning referrals off since they cause problems with MS Active
         # Directory More info: https://www.python-ldap.org/faq.html#usage
-        self._con.set_option(ldap.OPT_REFERRALS, 0)
-        self._con.protocol_version = self.protocol
+        con.set_option(ldap.OPT_REFERRALS, 0)
+        con.protocol_version = self.protocol
         # Set the connection timeout
         if self._conn_timeout > 0:
-            self._con.set_option(ldap.OPT_NETWORK_TIMEOUT, self._conn_timeout)
+            con.set_option(ldap.OPT_NETWORK_TIMEOUT, self._conn_timeout)
         # Set the operations timeout
         if self._op_timeout > 0:
-            self._con.timeout = self._op_timeout
+            con.timeout = self._op_timeout
         if self._start_tls:  # pragma: no cover
             # ignore in tests for now. nevertheless provide a test environment
             # for TLS and SSL later
-            self._con.start_tls_s()
-        self._con.simple_bind_s(self._bindDN, self._bindPW)
-        return self._con
+            con.start_tls_s()
+        return con
+
+    def authenticate(self, dn, pw):
+        """Verify credentials without binding the connector to that user.
+
+        If ``auth_pool_size`` is set, bind-check connections are taken from a
+        dedicated pool, which also limits the number of concurrent credential
+        checks. After a check the connection is reset to anonymous state
+        before it gets returned to the pool, thus pooled connections never
+        keep a user identity.
+
+        :param dn: User DN.
+        :param pw: User password.
+        :return: True if credentials are valid, otherwise False.
+        """
+        if self._auth_pool is None:
+            con = self._connect_auth()
+            try:
+                return self._check_credentials(con, dn, pw)
+            finally:
+                try:
+                    con.unbind_s()
+                except ldap.LDAPError:
+                    logger.debug(u"Unbind of bind-check connection failed.")
+        con = self._auth_pool.checkout()
+        discard = True
+        try:
+            res = self._check_credentials(con, dn, pw)
+            if res:
+                # reset connection to anonymous. If this fails, the connection
+                # still carries the user identity and gets discarded
+                try:
+                    con.simple_bind_s('', '')
+                except ldap.LDAPError:
+                    logger.debug(u"Reset of bind-check connection failed.")
+                    return res
+            discard = False
+            return res
+        finally:
+            self._auth_pool.checkin(con, discard=discard)
+
+    def _check_credentials(self, con, dn, pw):
+        try:
+            con.simple_bind_s(dn, pw)
+        except (ldap.INVALID_CREDENTIALS, ldap.UNWILLING_TO_PERFORM):
+            # The UNWILLING_TO_PERFORM event might be thrown, if you query a
+            # local user named ``admin``, but the LDAP server is configured to
+            # deny such queries. Instead of raising an exception, just ignore
+            # this.
+            return False
+        return True
 
     def unbind(self):
         """Unbind from Server.
+
+        Also closes idle pooled connections if pooling is enabled.
         """
+        if self._pool is not None:
+            self._pool.clear()
+        if self._auth_pool is not None:
+            self._auth_pool.clear()
         if self._con is None:
             return
         try:
@@ -183,14 +381,23 @@ class LDAPCommunicator(object):
         self._connector = connector
         self._con = None
         self._cache = None
+        self._cache_provider = None
+        self._cache_index = None
+        self._cache_digest = False
+        self._negative_timeout = None
+        # pooled connections of unfinished paged searches by cookie
+        self._paged = dict()
+        self._paged_lock = threading.Lock()
         if connector._cache:
             cachefactory = queryUtility(ICacheProviderFactory)
             if cachefactory is None:
                 cachefactory = nullcacheProviderFactory
             cacheprovider = cachefactory()
+            self._cache_provider = cacheprovider
             self._cache = ICacheManager(cacheprovider)
             self._cache.setTimeout(connector._cachetimeout)
-            if not INullCacheProvider.providedBy(self._cache):
+            if not INullCacheProvider.providedBy(cacheprovider):
+                self._cache_index = search_cache_index(cacheprovider)
                 logger.debug(
                     u"LDAP Caching activated for instance '{0:s}'. "
                     u"Use '{1:s}' as cache provider".format(
@@ -198,12 +405,23 @@ class LDAPCommunicator(object):
                         repr(cacheprovider)
                     )
                 )
-            else:  # pragma: no cover
+            else:
                 logger.debug(
                     u"LDAP Caching activated for instance '{0:s}'.".format(
                         repr(self._cache),
                     )
                 )
+            # tuple based cache keys are used for in-process caches, others
+            # get a digest of the key
+            self._cache_digest = not (
+                INullCacheProvider.providedBy(cacheprovider)
+                or IMemoryCacheProvider.providedBy(cacheprovider)
+            )
+            # negative caching requires per entry timeouts
+            if IMemoryCacheProvider.providedBy(cacheprovider) \
+                    or ILayeredCacheProvider.providedBy(cacheprovider):
+                self._negative_timeout = connector._negative_timeout \
+                    or getattr(cacheprovider, 'negative_timeout', None)
 
     def bind(self):
         """Bind to LDAP Server.
@@ -213,6 +431,7 @@ class LDAPCommunicator(object):
     def unbind(self):
         """Unbind from LDAP Server.
         """
+        self.release_paged()
         self._connector.unbind()
         self._con = None
 
@@ -222,9 +441,54 @@ class LDAPCommunicator(object):
         if self._con is None:
             self.bind()
 
+    @contextmanager
+    def connection(self):
+        """Context manager providing a bound connection object.
+
+        If connection pooling is enabled, a connection is checked out from the
+        pool and returned afterwards, otherwise the connection of this
+        communicator is used.
+        """
+        pool = self._connector.pool
+        if pool is None:
+            self.ensure_connection()
+            yield self._con
+            return
+        self._expire_paged()
+        with pool.connection() as con:
+            yield con
+
+    def supports_control(self, oid):
+        """Flag whether server advertises support of a control.
+
+        Supported controls are read from the root DSE once per connector.
+
+        :param oid: Control type OID.
+        """
+        connector = self._connector
+        if connector._supported_controls is None:
+            try:
+                with self.connection() as con:
+                    res = con.search_s(
+                        '',
+                        ldap.SCOPE_BASE,
+                        '(objectClass=*)',
+                        ['supportedControl']
+                    )
+            except ldap.LDAPError as e:
+                logger.debug(u"Reading supported controls failed: {}".format(e))
+                return False
+            controls = set()
+            for _, attrs in res:
+                for oid_ in attrs.get('supportedControl', []):
+                    controls.add(ensure_text(oid_))
+            connector._supported_controls = controls
+        return oid in connector._supported_controls
+
     def search(self, queryFilter, scope, baseDN=None,
                force_reload=False, attrlist=None, attrsonly=0,
-               page_size=None, cookie=None):
+               page_size=None, cookie=None, sort_keys=None, offset=0,
+               count=None):
         """Search the directory.
 
         :param queryFilter: LDAP query filter
@@ -237,6 +501,358 @@ class LDAPCommunicator(object):
         :param page_size: Number of items per page, when doing pagination.
         :param cookie: Cookie string returned by previous search with
             pagination.
+        :param sort_keys: List of attribute names to sort the result by.
+            Prefix attribute name with ``-`` for descending order. Uses the
+            server side sort control if supported by the server.
+        :param offset: Index of the first entry of the result window.
+        :param count: Number of entries of the result window. Uses the virtual
+            list view control together with ``sort_keys`` if supported by the
+            server. Cannot be combined with ``page_size``.
+        """
+        if count is not None and page_size:
+            raise ValueError(u"count cannot be combined with page_size")
+        if count is not None and count <= 0:
+            return []
+        sort_keys = list(sort_keys or [])
+        if (sort_keys or offset or count is not None) \
+                and not self._server_sorting(sort_keys, offset, count):
+            return self._client_sorted_search(
+                queryFilter,
+                scope,
+                baseDN,
+                force_reload,
+                attrlist,
+                attrsonly,
+                page_size,
+                cookie,
+                sort_keys,
+                offset,
+                count
+            )
+        baseDN, cookie, serverctrls = self._prepare_search(
+            baseDN,
+            page_size,
+            cookie,
+            sort_keys=sort_keys,
+            offset=offset,
+            count=count
+        )
+
+        def _search(baseDN, scope, queryFilter,
+                    attrlist, attrsonly, serverctrls):
+            # we have to do async search to also retrieve server controls
+            # in case we do pagination of results
+            if type(attrlist) in (list, tuple):
+                attrlist = [str(_) for _ in attrlist]
+
+            def _request(con):
+                try:
+                    msgid = con.search_ext(
+                        baseDN,
+                        scope,
+                        queryFilter,
+                        attrlist,
+                        attrsonly,
+                        serverctrls=serverctrls
+                    )
+                except ldap.LDAPError as e:
+                    logger.warn(str(e))
+                    return []
+                rtype, results, rmsgid, rctrls = con.result3(msgid)
+                if count is not None:
+                    return self._vlv_result(results, rctrls, offset)
+                return self._search_result(results, rctrls)
+            if not page_size or self._connector.pool is None:
+                with self.connection() as con:
+                    return _request(con)
+            # paging cookies are only valid on the connection the paged
+            # search has been started on
+            con, detached = self._checkout_paged(cookie)
+            next_cookie = None
+            discard = False
+            try:
+                res = _request(con)
+                if type(res) is tuple:
+                    next_cookie = res[1]
+                return res
+            except ldap.SERVER_DOWN:
+                discard = True
+                raise
+            finally:
+                self._checkin_paged(
+                    con,
+                    next_cookie,
+                    discard=discard,
+                    detached=detached
+                )
+        args = [baseDN, scope, queryFilter, attrlist, attrsonly, serverctrls]
+        if not self._cache:
+            return _search(*args)
+        key = self._cache_key(
+            baseDN,
+            scope,
+            queryFilter,
+            attrlist,
+            attrsonly,
+            page_size,
+            cookie,
+            sort_keys=sort_keys,
+            offset=offset,
+            count=count
+        )
+        res = self._cache_get(key, force_reload)
+        if res is NEGATIVE_RESULT:
+            raise self._no_such_object(baseDN)
+        if res is None:
+            try:
+                res = _search(*args)
+            except ldap.NO_SUCH_OBJECT:
+                self._cache_negative(key, baseDN)
+                raise
+            self._cache.set(key, res)
+        self._index_cached(key, baseDN, scope)
+        return res
+
+    def iter_search(self, queryFilter, scope, baseDN=None, attrlist=None,
+                    attrsonly=0, page_size=None):
+        """Search the directory and yield entries as they arrive.
+
+        Unlike ``search``, results are neither cached nor collected in memory,
+        thus memory consumption is bounded regardless of the result size. If
+        ``page_size`` is given, subsequent pages are requested transparently.
+        The connection is held until the generator is exhausted or closed,
+        closing it early abandons the running search. Pooled connections are
+        detached from the pool meanwhile, thus searches performed while
+        iterating do not wait for it.
+
+        :param queryFilter: LDAP query filter
+        :param scope: LDAP search scope
+        :param baseDN: Search base. Defaults to ``self.baseDN``
+        :param attrlist: LDAP attrlist to query.
+        :param attrsonly: Flag whether to return only attribute names, without
+            corresponding values.
+        :param page_size: Number of items per page.
+        :return: Generator yielding (dn, attrs) tuples.
+        """
+        baseDN, _, serverctrls = self._prepare_search(
+            baseDN,
+            page_size,
+            None
+        )
+        if type(attrlist) in (list, tuple):
+            attrlist = [str(_) for _ in attrlist]
+        pool = self._connector.pool
+        if pool is None:
+            self.ensure_connection()
+            con = self._con
+        else:
+            # streamed searches hold the connection for an arbitrary time.
+            # detach it from the pool to not block consumers, including
+            # nested searches performed while iterating
+            self._expire_paged()
+            con = pool.checkout()
+            pool.detach(con)
+        discard = False
+        try:
+            while True:
+                try:
+                    msgid = con.search_ext(
+                        baseDN,
+                        scope,
+                        queryFilter,
+                        attrlist,
+                        attrsonly,
+                        serverctrls=serverctrls
+                    )
+                except ldap.LDAPError as e:
+                    logger.warn(str(e))
+                    return
+                while True:
+                    rtype, results, _, rctrls = con.result3(msgid, all=0)
+                    if rtype == ldap.RES_SEARCH_RESULT:
+                        break
+                    # skip search references
+                    if rtype != ldap.RES_SEARCH_ENTRY:
+                        continue
+                    try:
+                        for entry in results:
+                            yield entry
+                    except GeneratorExit:
+                        # generator closed before search completed
+                        con.abandon(msgid)
+                        raise
+                if not page_size:
+                    return
+                res = self._search_result([], rctrls)
+                if type(res) is not tuple or not res[1]:
+                    return
+                serverctrls[0].cookie = res[1]
+        except ldap.SERVER_DOWN:
+            discard = True
+            raise
+        finally:
+            if pool is not None:
+                pool.attach(con, discard=discard)
+
+    def count(self, queryFilter, scope, baseDN=None, sort_key=None,
+              size_limit=None, page_size=None):
+        """Return number of entries matching a search.
+
+        If ``sort_key`` is given and the server supports server side sorting
+        and virtual list view, the content count of the virtual list view
+        response is used and no entries get transferred. Otherwise, or if the
+        virtual list view search fails, entries are streamed without
+        attributes and counted client side.
+
+        :param queryFilter: LDAP query filter
+        :param scope: LDAP search scope
+        :param baseDN: Search base. Defaults to ``self.baseDN``
+        :param sort_key: Attribute name used to sort the virtual list view.
+        :param size_limit: Maximum number to count. If reached, counting stops
+            and ``size_limit`` is returned.
+        :param page_size: Page size used for counting client side.
+        """
+        if sort_key and self._server_sorting([sort_key], 0, 1):
+            baseDN, _, serverctrls = self._prepare_search(
+                baseDN,
+                None,
+                None,
+                sort_keys=[sort_key],
+                count=1
+            )
+            try:
+                with self.connection() as con:
+                    msgid = con.search_ext(
+                        baseDN,
+                        scope,
+                        queryFilter,
+                        ['1.1'],
+                        1,
+                        serverctrls=serverctrls
+                    )
+                    _, _, _, rctrls = con.result3(msgid)
+            except ldap.NO_SUCH_OBJECT:
+                raise
+            except ldap.LDAPError as e:
+                logger.debug(
+                    u"Virtual list view count failed, count client "
+                    u"side: {}".format(e)
+                )
+                rctrls = []
+            ctype = VLVResponseControl.controlType
+            vctrls = [c for c in rctrls if c.controlType == ctype]
+            if vctrls:
+                count = vctrls[0].content_count
+                if size_limit is not None:
+                    count = min(count, size_limit)
+                return count
+        count = 0
+        if size_limit is not None and size_limit <= 0:
+            return count
+        res = self.iter_search(
+            queryFilter,
+            scope,
+            baseDN=baseDN,
+            attrlist=['1.1'],
+            attrsonly=1,
+            page_size=page_size
+        )
+        try:
+            for _ in res:
+                count += 1
+                if count == size_limit:
+                    break
+        finally:
+            # abandons search if size limit reached
+            res.close()
+        return count
+
+    def multi_search(self, requests, window=100):
+        """Perform multiple searches pipelined.
+
+        All searches are sent before collecting the results, thus the round
+        trips of the searches overlap.
+
+        :param requests: List of dicts containing the keyword arguments
+            ``queryFilter``, ``scope``, ``baseDN``, ``force_reload``,
+            ``attrlist`` and ``attrsonly`` as accepted by ``search``.
+            ``queryFilter`` and ``scope`` are required.
+        :param window: Maximum number of searches in flight at once.
+        :return: List of search results in order of requests. Searches failing
+            with ``NO_SUCH_OBJECT`` or ``INVALID_DN_SYNTAX`` result in an
+            empty list. Empty lists are not cached, but ``NO_SUCH_OBJECT``
+            results are cached as negative results if negative caching is
+            enabled.
+        """
+        results = [None] * len(requests)
+        pending = collections.deque()
+        for index, request in enumerate(requests):
+            baseDN, _, _ = self._prepare_search(
+                request.get('baseDN'),
+                None,
+                None
+            )
+            attrlist = request.get('attrlist')
+            attrsonly = request.get('attrsonly', 0)
+            args = (
+                baseDN,
+                request['scope'],
+                request['queryFilter'],
+                attrlist,
+                attrsonly
+            )
+            key = None
+            if self._cache:
+                key = self._cache_key(*(args + (None, None)))
+                res = self._cache_get(key, request.get('force_reload', False))
+                if res is NEGATIVE_RESULT:
+                    results[index] = []
+                    continue
+                if res is not None:
+                    results[index] = res
+                    continue
+            if type(attrlist) in (list, tuple):
+                args = args[:3] + ([str(_) for _ in attrlist], attrsonly)
+            pending.append((index, key, args))
+        if not pending:
+            return results
+        inflight = collections.deque()
+        with self.connection() as con:
+            try:
+                while pending or inflight:
+                    while pending and len(inflight) < window:
+                        index, key, args = pending.popleft()
+                        inflight.append((
+                            index,
+                            key,
+                            args[0],
+                            args[1],
+                            con.search_ext(*args)
+                        ))
+                    index, key, baseDN, scope, msgid = inflight.popleft()
+                    try:
+                        res = con.result3(msgid)[1]
+                    except ldap.NO_SUCH_OBJECT:
+                        results[index] = []
+                        if key is not None:
+                            self._cache_negative(key, baseDN)
+                        continue
+                    except ldap.INVALID_DN_SYNTAX:
+                        results[index] = []
+                        continue
+                    results[index] = res
+                    if key is not None:
+                        self._cache.set(key, res)
+                        self._index_cached(key, baseDN, scope)
+            except Exception:
+                for _, _, _, _, msgid in inflight:
+                    con.abandon(msgid)
+                raise
+        return results
+
+    def _prepare_search(self, baseDN, page_size, cookie, sort_keys=None,
+                        offset=0, count=None):
+        """Return search base, cookie and server controls for a search.
         """
         if baseDN is None:
             baseDN = self.baseDN
@@ -252,52 +868,287 @@ class LDAPCommunicator(object):
             if cookie:
                 raise ValueError('cookie passed without page_size')
             serverctrls = []
+        if sort_keys:
+            serverctrls.append(SSSRequestControl(
+                criticality=True,
+                ordering_rules=list(sort_keys)
+            ))
+        if count is not None:
+            # offset of virtual list view is 1-based
+            serverctrls.append(VLVRequestControl(
+                criticality=True,
+                before_count=0,
+                after_count=count - 1,
+                offset=offset + 1,
+                content_count=0
+            ))
+        return baseDN, cookie, serverctrls
 
-        def _search(baseDN, scope, queryFilter,
-                    attrlist, attrsonly, serverctrls):
-            # we have to do async search to also retrieve server controls
-            # in case we do pagination of results
-            self.ensure_connection()
-            if type(attrlist) in (list, tuple):
-                attrlist = [str(_) for _ in attrlist]
-            try:
-                msgid = self._con.search_ext(
-                    baseDN,
-                    scope,
+    def release_paged(self, cookie=None):
+        """Release connection pinned to an unfinished paged search.
+
+        Needs to be called if a paged search is not continued until the last
+        page. The pinned connection is handed back to the pool.
+
+        :param cookie: Paged results cookie returned by ``search``. If None,
+            connections of all unfinished paged searches are released.
+        """
+        pool = self._connector.pool
+        if pool is None:
+            return
+        with self._paged_lock:
+            if cookie is None:
+                pinned = [con for con, _ in self._paged.values()]
+                self._paged.clear()
+            elif cookie in self._paged:
+                pinned = [self._paged.pop(cookie)[0]]
+            else:
+                pinned = list()
+        for con in pinned:
+            pool.attach(con)
+
+    def _checkout_paged(self, cookie):
+        """Return pooled connection for a paged search.
+
+        If ``cookie`` continues a paged search, the connection pinned to it is
+        returned, otherwise a connection is checked out from the pool. Returns
+        a tuple containing the connection and a flag whether the connection
+        is detached from the pool.
+        """
+        con = self._pinned(cookie)
+        if con is not None:
+            return con, True
+        return self._connector.pool.checkout(), False
+
+    def _pinned(self, cookie):
+        """Return and unpin the connection pinned to ``cookie`` or None.
+        """
+        self._expire_paged()
+        if not cookie:
+            return None
+        with self._paged_lock:
+            return self._paged.pop(cookie, (None, None))[0]
+
+    def _expire_paged(self):
+        """Discard pinned connections not continued within
+        ``pool_idle_timeout`` seconds.
+        """
+        pool = self._connector.pool
+        if not self._paged or pool.idle_timeout is None:
+            return
+        limit = time.time() - pool.idle_timeout
+        with self._paged_lock:
+            expired = list()
+            for cookie, (con, stamp) in list(self._paged.items()):
+                if stamp <= limit:
+                    del self._paged[cookie]
+                    expired.append(con)
+        for con in expired:
+            pool.attach(con, discard=True)
+
+    def _checkin_paged(self, con, cookie, discard=False, detached=False):
+        """Pin connection to ``cookie`` if more pages are available, otherwise
+        return it to the pool.
+
+        Pinned connections get detached from the pool, thus consumers of the
+        pool are not blocked while a paged search is not continued.
+        """
+        pool = self._connector.pool
+        if cookie and not discard:
+            if not detached:
+                pool.detach(con)
+            with self._paged_lock:
+                self._paged[cookie] = (con, time.time())
+        elif detached:
+            pool.attach(con, discard=discard)
+        else:
+            pool.checkin(con, discard=discard)
+
+    def _server_sorting(self, sort_keys, offset, count):
+        """Flag whether sorting and result window can be applied by server.
+
+        Server side result windows require sort keys.
+        """
+        if not sort_keys:
+            return False
+        if not self.supports_control(SSSRequestControl.controlType):
+            return False
+        if count is None:
+            return not offset
+        return self.supports_control(VLVRequestControl.controlType)
+
+    def _client_sorted_search(self, queryFilter, scope, baseDN, force_reload,
+                              attrlist, attrsonly, page_size, cookie,
+                              sort_keys, offset, count):
+        """Fallback for sorted or windowed searches if not supported by the
+        server.
+
+        The complete result is fetched, sorted and sliced. A paged search
+        returns the complete result as single page.
+        """
+        if cookie:
+            return [], ''
+        # sort attributes must be contained in search result
+        added = list()
+        query_attrlist = attrlist
+        if sort_keys and attrlist and '*' not in attrlist:
+            queried = set([str(attr).lower() for attr in attrlist])
+            for sort_key in sort_keys:
+                attr = sort_key.lstrip('-').split(':')[0]
+                if attr.lower() not in queried:
+                    queried.add(attr.lower())
+                    added.append(attr)
+            query_attrlist = [
+                attr for attr in attrlist if attr not in ('', '1.1')
+            ] + added
+        if page_size:
+            results = list()
+            page_cookie = ''
+            while True:
+                res, page_cookie = self.search(
                     queryFilter,
-                    attrlist,
-                    attrsonly,
-                    serverctrls=serverctrls
+                    scope,
+                    baseDN=baseDN,
+                    force_reload=force_reload,
+                    attrlist=query_attrlist,
+                    attrsonly=attrsonly,
+                    page_size=page_size,
+                    cookie=page_cookie
                 )
-            except ldap.LDAPError as e:
-                logger.warn(str(e))
-                return []
-            rtype, results, rmsgid, rctrls = self._con.result3(msgid)
-            ctype = ldap.controls.libldap.SimplePagedResultsControl.controlType
-            pctrls = [c for c in rctrls if c.controlType == ctype]
-            if pctrls:
-                return results, pctrls[0].cookie
-            else:
-                return results
-        args = [baseDN, scope, queryFilter, attrlist, attrsonly, serverctrls]
-        if self._cache:
-            key_items = [
-                self._connector._bindDN,
-                baseDN,
-                sorted(attrlist or []),
-                attrsonly,
+                results += res
+                if not page_cookie:
+                    break
+        else:
+            results = self.search(
                 queryFilter,
                 scope,
-                page_size,
-                cookie
-            ]
-            return self._cache.getData(
-                _search,
-                md5digest(cache_key(key_items)),
-                force_reload,
-                args
+                baseDN=baseDN,
+                force_reload=force_reload,
+                attrlist=query_attrlist,
+                attrsonly=attrsonly
             )
-        return _search(*args)
+        if sort_keys:
+            results = sort_entries(results, sort_keys)
+        if offset or count is not None:
+            end = None if count is None else offset + count
+            results = results[offset:end]
+        if added:
+            # do not modify cached results
+            added = set([attr.lower() for attr in added])
+            results = [(dn, dict([
+                (key, val) for key, val in attrs.items()
+                if key.lower() not in added
+            ])) for dn, attrs in results]
+        if page_size:
+            return results, ''
+        return results
+
+    def _vlv_result(self, results, rctrls, offset):
+        """Return search results of virtual list view search.
+
+        Server returns the last entries if offset exceeds the content count,
+        return an empty result in this case.
+        """
+        ctype = VLVResponseControl.controlType
+        vctrls = [c for c in rctrls if c.controlType == ctype]
+        if vctrls and offset >= vctrls[0].content_count:
+            return []
+        return results
+
+    def _search_result(self, results, rctrls):
+        """Return search results, or a tuple containing search results and
+        cookie if paged results control contained in response controls.
+        """
+        ctype = ldap.controls.libldap.SimplePagedResultsControl.controlType
+        pctrls = [c for c in rctrls if c.controlType == ctype]
+        if pctrls:
+            return results, pctrls[0].cookie
+        return results
+
+    def _cache_key(self, baseDN, scope, queryFilter, attrlist, attrsonly,
+                   page_size, cookie, sort_keys=None, offset=0, count=None):
+        """Return cache key for search.
+
+        The key is a tuple if the cache provider lives in process, otherwise
+        a hex digest of it.
+        """
+        if attrlist:
+            attrlist = tuple(sorted([str(_) for _ in attrlist]))
+        key = (
+            self._connector._bindDN,
+            baseDN,
+            attrlist or (),
+            attrsonly,
+            queryFilter,
+            scope,
+            page_size,
+            cookie
+        )
+        # extend key by sorting and result window only if requested
+        if sort_keys or offset or count is not None:
+            key += (tuple(sort_keys or ()), offset, count)
+        if self._cache_digest:
+            return digest_key(key)
+        return key
+
+    def _cache_get(self, key, force_reload=False):
+        """Return cached search result or None.
+
+        Keys of search results no longer contained in the cache are pruned
+        from the search cache index.
+        """
+        res = self._cache.get(key, force_reload)
+        if res is None and self._cache_index is not None:
+            self._cache_index.discard(key)
+        return res
+
+    def _index_cached(self, key, baseDN, scope):
+        """Index cached search result for invalidation on write operations.
+        """
+        index = self._cache_index
+        if index is None:
+            return
+        timeout = self._connector._cachetimeout
+        for dropped in index.add(key, baseDN, scope, timeout):
+            del self._cache[dropped]
+
+    def _cache_negative(self, key, baseDN):
+        """Cache ``NO_SUCH_OBJECT`` search result if negative caching is
+        enabled.
+        """
+        if not self._negative_timeout:
+            return
+        self._cache_provider.set(
+            key,
+            NEGATIVE_RESULT,
+            timeout=self._negative_timeout
+        )
+        # index negative results as subtree search, they get invalidated if
+        # search base or any ancestor gets added
+        self._index_cached(key, baseDN, SUBTREE)
+
+    def _no_such_object(self, baseDN):
+        """Return ``NO_SUCH_OBJECT`` error for cached negative result.
+        """
+        return ldap.NO_SUCH_OBJECT({
+            'desc': 'No such object',
+            'matched': '',
+            'info': u"Cached negative result for '{}'".format(baseDN)
+        })
+
+    def invalidate(self, dn):
+        """Remove cached search results which might be affected by a write
+        operation on the entry with given DN.
+
+        Called by all write operations of the communicator.
+
+        :param dn: DN of added, modified or deleted entry.
+        """
+        index = self._cache_index
+        if index is None:
+            return
+        for key in index.invalidate(dn):
+            del self._cache[key]
 
     def add(self, dn, data):
         """Insert an entry into directory.
@@ -306,8 +1157,11 @@ class LDAPCommunicator(object):
         :param data: Dict containing key/value pairs of entry attributes
         """
         attributes = [(k, v) for k, v in data.items()]
-        self.ensure_connection()
-        self._con.add_s(dn, attributes)
+        try:
+            with self.connection() as con:
+                con.add_s(dn, attributes)
+        finally:
+            self.invalidate(dn)
 
     def modify(self, dn, modlist):
         """Modify an existing entry in the directory.
@@ -318,20 +1172,36 @@ class LDAPCommunicator(object):
         gives the name of the field to modify, and the third gives the new
         value for the field (for MOD_ADD and MOD_REPLACE).
         """
-        self.ensure_connection()
-        self._con.modify_s(dn, modlist)
+        try:
+            with self.connection() as con:
+                con.modify_s(dn, modlist)
+        finally:
+            self.invalidate(dn)
 
     def delete(self, deleteDN):
         """Delete an entry from the directory.
 
         Take the DN to delete from the directory as argument.
         """
-        self.ensure_connection()
-        self._con.delete_s(deleteDN)
+        try:
+            with self.connection() as con:
+                con.delete_s(deleteDN)
+        finally:
+            self.invalidate(deleteDN)
 
     def passwd(self, userdn, oldpw, newpw):
-        self.ensure_connection()
-        self._con.passwd_s(userdn, oldpw, newpw)
+        try:
+            with self.connection() as con:
+                con.passwd_s(userdn, oldpw, newpw)
+        finally:
+            self.invalidate(userdn)
+
+    def authenticate(self, dn, pw):
+        """Verify credentials, but don't rebind to that user.
+
+        See ``LDAPConnector.authenticate``.
+        """
+        return self._connector.authenticate(dn, pw)
 
 
 def main():
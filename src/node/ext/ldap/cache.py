@@ -1,8 +1,21 @@
 # -*- coding: utf-8 -*-
+from bda.cache import ICacheManager
 from bda.cache import Memcached
 from bda.cache import NullCache
 from node.ext.ldap.interfaces import ICacheProviderFactory
+from node.ext.ldap.interfaces import ILayeredCacheProvider
+from node.ext.ldap.interfaces import IMemoryCacheProvider
+from node.ext.ldap.scope import BASE
+from node.ext.ldap.scope import ONELEVEL
+from zope.component import adapter
+from zope.component import provideAdapter
 from zope.interface import implementer
+import collections
+import ldap
+import sys
+import threading
+import time
+import weakref
 
 
 def nullcacheProviderFactory():
@@ -23,3 +36,455 @@ class MemcachedProviderFactory(object):
 
     def __call__(self):
         return Memcached(self.servers)
+
+
+class NegativeResult(object):
+    """Marker for cached ``NO_SUCH_OBJECT`` search results.
+    """
+
+    def __repr__(self):
+        return '<NEGATIVE_RESULT>'
+
+
+NEGATIVE_RESULT = NegativeResult()
+
+
+def approximate_size(value):
+    """Return approximate memory size of value in bytes.
+
+    Considers contents of dicts, lists, tuples and sets.
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += approximate_size(key) + approximate_size(item)
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        for item in value:
+            size += approximate_size(item)
+    return size
+
+
+@implementer(IMemoryCacheProvider)
+class MemoryCache(object):
+    """Thread safe in-process LRU cache with per entry timeout.
+
+    Cached values are not copied, consumers must not modify them.
+    """
+
+    def __init__(self, maxsize=10000, maxbytes=None, timeout=0):
+        """Initialize memory cache.
+
+        :param maxsize: Maximum number of entries. ``None`` means unlimited.
+        :param maxbytes: Maximum approximate size of all values in bytes.
+            ``None`` means unlimited.
+        :param timeout: Default timeout of entries in seconds. ``0`` means
+            entries never expire.
+        """
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # key -> (value, expires, size). least recently used entries first
+        self._data = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def size(self):
+        return self._bytes
+
+    def keys(self):
+        with self._lock:
+            self._expire()
+            return list(self._data.keys())
+
+    def values(self):
+        with self._lock:
+            self._expire()
+            return [entry[0] for entry in self._data.values()]
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires, _ = entry
+            if expires and expires <= time.time():
+                self._remove(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def __getitem__(self, key):
+        return self.get(key)
+
+    def set(self, key, value, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        expires = time.time() + timeout if timeout else 0
+        size = approximate_size(value)
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            if self.maxbytes is not None and size > self.maxbytes:
+                return
+            self._data[key] = (value, expires, size)
+            self._bytes += size
+            self._shrink()
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __delitem__(self, key):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return dict(
+            entries=len(self._data),
+            bytes=self._bytes,
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions
+        )
+
+    def _remove(self, key):
+        self._bytes -= self._data.pop(key)[2]
+
+    def _expire(self):
+        now = time.time()
+        expired = [
+            key for key, (_, expires, _) in self._data.items()
+            if expires and expires <= now
+        ]
+        for key in expired:
+            self._remove(key)
+
+    def _shrink(self):
+        # evict least recently used entries until limits are satisfied
+        while self._data and (
+            (self.maxsize is not None and len(self._data) > self.maxsize)
+            or (self.maxbytes is not None and self._bytes > self.maxbytes)
+        ):
+            self._bytes -= self._data.popitem(last=False)[1][2]
+            self.evictions += 1
+
+
+@implementer(ICacheManager)
+@adapter(IMemoryCacheProvider)
+class MemoryCacheManager(object):
+    """Cache manager for ``IMemoryCacheProvider`` implementations.
+    """
+
+    def __init__(self, context):
+        self.cache = context
+
+    def setTimeout(self, timeout):
+        self.cache.timeout = timeout
+
+    def getData(self, func, key, force_reload=False, args=[], kwargs={}):
+        ret = self.get(key, force_reload)
+        if ret is None:
+            ret = func(*args, **kwargs)
+            self.set(key, ret)
+        return ret
+
+    def get(self, key, force_reload=False):
+        if force_reload:
+            del self.cache[key]
+            return None
+        return self.cache.get(key)
+
+    def set(self, key, item):
+        self.cache[key] = item
+
+    def rem(self, key):
+        del self.cache[key]
+
+    def __delitem__(self, key):
+        del self.cache[key]
+
+
+provideAdapter(MemoryCacheManager)
+provideAdapter(MemoryCacheManager, adapts=(ILayeredCacheProvider,))
+
+
+@implementer(ICacheProviderFactory)
+class MemoryCacheProviderFactory(object):
+    """In-process memory cache provider factory.
+
+    All communicators share one ``MemoryCache`` instance.
+    """
+
+    def __init__(self, maxsize=10000, maxbytes=None):
+        self.cache = MemoryCache(maxsize=maxsize, maxbytes=maxbytes)
+
+    def __call__(self):
+        return self.cache
+
+
+@implementer(ILayeredCacheProvider)
+class LayeredCache(object):
+    """Cache with a local first level cache in front of a shared second level
+    cache.
+
+    Values read from or written to the second level cache are kept in the
+    first level cache for ``l1_timeout`` seconds. Negative results are only
+    cached in the first level cache.
+    """
+
+    def __init__(self, l2, l1=None, l1_timeout=5, negative_timeout=None):
+        """Initialize layered cache.
+
+        :param l2: Second level ``ICacheProvider``, e.g. ``Memcached``.
+        :param l1: First level ``IMemoryCacheProvider``. Defaults to a new
+            ``MemoryCache`` instance.
+        :param l1_timeout: Timeout of first level cache entries in seconds.
+        :param negative_timeout: Timeout of cached ``NO_SUCH_OBJECT`` results
+            in seconds. ``None`` disables negative caching.
+        """
+        self.l1 = l1 if l1 is not None else MemoryCache(maxsize=1000)
+        self.l2 = l2
+        self.l1_timeout = l1_timeout
+        self.negative_timeout = negative_timeout
+
+    @property
+    def timeout(self):
+        return self.l2.timeout
+
+    @timeout.setter
+    def timeout(self, timeout):
+        self.l2.timeout = timeout
+
+    def reset(self):
+        self.l1.reset()
+        self.l2.reset()
+
+    def size(self):
+        return self.l1.size() + self.l2.size()
+
+    def keys(self):
+        return self.l2.keys()
+
+    def values(self):
+        return self.l2.values()
+
+    def get(self, key, default=None):
+        value = self.l1.get(key)
+        if value is not None:
+            return value
+        value = self.l2.get(key)
+        if value is None:
+            return default
+        self.l1.set(key, value, timeout=self.l1_timeout)
+        return value
+
+    def __getitem__(self, key):
+        return self.get(key)
+
+    def set(self, key, value, timeout=None):
+        if value is NEGATIVE_RESULT:
+            timeout = timeout or self.negative_timeout
+            if timeout:
+                self.l1.set(key, value, timeout=timeout)
+            return
+        self.l2[key] = value
+        self.l1.set(key, value, timeout=self.l1_timeout)
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __delitem__(self, key):
+        del self.l1[key]
+        del self.l2[key]
+
+
+@implementer(ICacheProviderFactory)
+class LayeredCacheProviderFactory(object):
+    """Layered cache provider factory.
+
+    Uses a process wide ``MemoryCache`` as first level and ``Memcached`` as
+    second level cache.
+    """
+
+    def __init__(self, servers=['127.0.0.1:11211'], l1_maxsize=1000,
+                 l1_maxbytes=None, l1_timeout=5, negative_timeout=None):
+        self.servers = servers
+        self.l1 = MemoryCache(maxsize=l1_maxsize, maxbytes=l1_maxbytes)
+        self.l1_timeout = l1_timeout
+        self.negative_timeout = negative_timeout
+
+    def __call__(self):
+        return LayeredCache(
+            Memcached(self.servers),
+            l1=self.l1,
+            l1_timeout=self.l1_timeout,
+            negative_timeout=self.negative_timeout
+        )
+
+
+def dn_path(dn):
+    """Return normalized DN as tuple of RDN strings.
+
+    :raise ldap.DECODING_ERROR: If given DN is invalid.
+    """
+    return tuple([
+        '+'.join(sorted([
+            '{}={}'.format(attr.lower(), value.lower())
+            for attr, value, _ in rdn
+        ]))
+        for rdn in ldap.dn.str2dn(dn)
+    ])
+
+
+class SearchCacheIndex(object):
+    """Index of cached search results by search base and scope.
+
+    Used to find cached search results affected by write operations on the
+    directory.
+    """
+
+    def __init__(self, maxsize=100000):
+        """Initialize search cache index.
+
+        :param maxsize: Maximum number of indexed cache keys. If exceeded,
+            oldest keys are dropped from the index and must be removed from
+            the cache by the caller.
+        """
+        self.maxsize = maxsize
+        # key -> (path, expires). oldest entries first
+        self._keys = collections.OrderedDict()
+        # path -> {key: scope}
+        self._paths = dict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, key, baseDN, scope, timeout=0):
+        """Index cache key of a search result.
+
+        :param key: Cache key of search result.
+        :param baseDN: Search base.
+        :param scope: Search scope.
+        :param timeout: Timeout of cache entry in seconds. ``0`` means the
+            entry never expires.
+        :return: List of cache keys which must be removed from cache. Contains
+            ``key`` itself if search base cannot be indexed.
+        """
+        try:
+            path = dn_path(baseDN)
+        except ldap.DECODING_ERROR:
+            return [key]
+        expires = time.time() + timeout if timeout else 0
+        dropped = list()
+        with self._lock:
+            self._discard(key)
+            self._keys[key] = (path, expires)
+            self._paths.setdefault(path, dict())[key] = scope
+            now = time.time()
+            while len(self._keys) > self.maxsize:
+                old, (_, old_expires) = next(iter(self._keys.items()))
+                self._discard(old)
+                if not old_expires or old_expires > now:
+                    dropped.append(old)
+        return dropped
+
+    def invalidate(self, dn):
+        """Remove cache keys of search results affected by a write operation
+        on the entry with given DN from index.
+
+        These are ``BASE`` searches on the entry itself, ``ONELEVEL``
+        searches on its parent and ``SUBTREE`` searches on the entry or any
+        of its ancestors.
+
+        :param dn: DN of added, modified or deleted entry.
+        :return: List of cache keys which must be removed from cache.
+        """
+        try:
+            path = dn_path(dn)
+        except ldap.DECODING_ERROR:
+            return self.clear()
+        now = time.time()
+        affected = list()
+        with self._lock:
+            for depth in range(len(path) + 1):
+                keys = self._paths.get(path[depth:])
+                if not keys:
+                    continue
+                for key, scope in list(keys.items()):
+                    if scope == BASE and depth != 0:
+                        continue
+                    if scope == ONELEVEL and depth != 1:
+                        continue
+                    expires = self._keys[key][1]
+                    self._discard(key)
+                    if not expires or expires > now:
+                        affected.append(key)
+        return affected
+
+    def discard(self, key):
+        """Remove cache key from index.
+
+        Used to prune keys of search results no longer contained in the cache.
+
+        :param key: Cache key of search result.
+        """
+        with self._lock:
+            self._discard(key)
+
+    def clear(self):
+        """Clear index.
+
+        :return: List of all previously indexed cache keys.
+        """
+        with self._lock:
+            keys = list(self._keys)
+            self._keys.clear()
+            self._paths.clear()
+        return keys
+
+    def _discard(self, key):
+        entry = self._keys.pop(key, None)
+        if entry is None:
+            return
+        keys = self._paths[entry[0]]
+        del keys[key]
+        if not keys:
+            del self._paths[entry[0]]
+
+
+# search cache indexes by cache provider
+_search_cache_indexes = weakref.WeakKeyDictionary()
+_search_cache_indexes_lock = threading.Lock()
+
+
+def search_cache_index(provider):
+    """Return ``SearchCacheIndex`` of cache provider.
+
+    All communicators using the same cache provider instance share one index.
+    Layered cache providers use the index of their first level cache, which is
+    shared by all providers created by ``LayeredCacheProviderFactory``.
+
+    :param provider: Cache provider instance.
+    """
+    if ILayeredCacheProvider.providedBy(provider):
+        provider = provider.l1
+    with _search_cache_indexes_lock:
+        index = _search_cache_indexes.get(provider)
+        if index is None:
+            index = _search_cache_indexes[provider] = SearchCacheIndex()
+    return index
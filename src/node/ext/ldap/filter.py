@@ -1,8 +1,15 @@
 # -*- coding: utf-8 -*-
+from ldap.filter import escape_filter_chars
 from node.ext.ldap.base import ensure_bytes_py2
+from node.ext.ldap.base import ensure_text
+import logging
+import re
 import six
 
 
+logger = logging.getLogger('node.ext.ldap')
+
+
 # all special characters except * are escaped, that means * can be
 # used to perform suffix/prefix/contains searches, monkey-patch if you
 # don't like
@@ -18,7 +25,254 @@ ESCAPE_CHARS = {
 string_type = basestring if six.PY2 else str
 
 
+###############################################################################
+# filter expressions
+###############################################################################
+
+class FilterExpression(object):
+    """Base class for parsed LDAP filter expressions.
+
+    Expressions are immutable. ``str`` serializes the expression in one pass.
+    """
+
+    def _tokens(self):
+        # return opening string, operand expressions and closing string
+        raise NotImplementedError(
+            'Abstract ``FilterExpression`` does not implement ``_tokens``'
+        )
+
+    def __contains__(self, attr):
+        name = attr.lower()
+        stack = [self]
+        while stack:
+            expression = stack.pop()
+            if isinstance(expression, FilterItem):
+                if expression.attribute.lower() == name:
+                    return True
+            elif isinstance(expression, FilterText):
+                if expression.text.find('({}='.format(attr)) > -1:
+                    return True
+            else:
+                stack.extend(expression._tokens()[1])
+        return False
+
+    def __eq__(self, other):
+        return type(self) is type(other) and str(self) == str(other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(str(self))
+
+    def __str__(self):
+        parts = list()
+        stack = [self]
+        while stack:
+            expression = stack.pop()
+            if isinstance(expression, string_type):
+                parts.append(expression)
+                continue
+            opening, operands, closing = expression._tokens()
+            parts.append(opening)
+            if closing:
+                stack.append(closing)
+            stack.extend(reversed(operands))
+        return ''.join(parts)
+
+    def __repr__(self):
+        return "{}('{}')".format(self.__class__.__name__, str(self))
+
+
+class FilterItem(FilterExpression):
+    """Filter item like ``(cn=foo)``, ``(uid>=1000)`` or ``(cn:dn:=foo)``.
+
+    ``value`` is expected to be escaped already.
+    """
+
+    def __init__(self, attr, op, value):
+        self.attr = attr
+        self.op = op
+        self.value = value
+
+    @property
+    def attribute(self):
+        """Attribute type without options and extensible match rules."""
+        return self.attr.partition(':')[0].partition(';')[0]
+
+    @property
+    def matches_all(self):
+        return self.attribute.lower() == 'objectclass' \
+            and self.op == '=' \
+            and self.value == '*'
+
+    def _tokens(self):
+        return '({}{}{})'.format(self.attr, self.op, self.value), (), ''
+
+
+class FilterText(FilterExpression):
+    """Filter string which could not be parsed, serialized as is."""
+
+    def __init__(self, text):
+        self.text = text
+
+    def _tokens(self):
+        return self.text, (), ''
+
+
+class FilterNot(FilterExpression):
+    """Negation of a filter expression."""
+
+    def __init__(self, operand):
+        self.operand = operand
+
+    def _tokens(self):
+        return '(!', (self.operand,), ')'
+
+
+class FilterCompound(FilterExpression):
+    """Base class for conjunction and disjunction of filter expressions."""
+    operator = None
+
+    def __init__(self, operands):
+        self.operands = list(operands)
+
+    def _tokens(self):
+        return '({}'.format(self.operator), self.operands, ')'
+
+
+class FilterAnd(FilterCompound):
+    """Conjunction of filter expressions."""
+    operator = '&'
+
+
+class FilterOr(FilterCompound):
+    """Disjunction of filter expressions."""
+    operator = '|'
+
+
+_FILTER_ITEM = re.compile(r'(?P<attr>[^()=~<>]+?)(?P<op>[~<>:]?=)'
+                          r'(?P<value>[^()]*)')
+
+
+def parse_filter(text):
+    """Parse RFC 4515 filter string into a filter expression.
+
+    A filter string missing the enclosing parentheses is accepted. Raise
+    ``ValueError`` if ``text`` is no valid filter string.
+    """
+    text = ensure_bytes_py2(text).strip()
+    if not text.startswith('('):
+        text = '({})'.format(text)
+    expression, pos = _parse_filter(text, 0)
+    if pos != len(text):
+        raise _invalid_filter(text, pos)
+    return expression
+
+
+def _invalid_filter(text, pos):
+    return ValueError(
+        'Invalid filter "{}" at position {}'.format(text, pos)
+    )
+
+
+def _parse_filter(text, pos):
+    # parse filter starting at pos, return expression and end position
+    if text[pos:pos + 1] != '(':
+        raise _invalid_filter(text, pos)
+    pos += 1
+    char = text[pos:pos + 1]
+    if char in ('&', '|'):
+        pos += 1
+        operands = list()
+        while text[pos:pos + 1] == '(':
+            operand, pos = _parse_filter(text, pos)
+            operands.append(operand)
+        if not operands:
+            raise _invalid_filter(text, pos)
+        if char == '&':
+            expression = FilterAnd(operands)
+        else:
+            expression = FilterOr(operands)
+    elif char == '!':
+        operand, pos = _parse_filter(text, pos + 1)
+        expression = FilterNot(operand)
+    else:
+        match = _FILTER_ITEM.match(text, pos)
+        if not match:
+            raise _invalid_filter(text, pos)
+        expression = FilterItem(
+            match.group('attr'),
+            match.group('op'),
+            match.group('value')
+        )
+        pos = match.end()
+    if text[pos:pos + 1] != ')':
+        raise _invalid_filter(text, pos)
+    return expression, pos + 1
+
+
+def simplify_filter(expression):
+    """Return canonical form of a filter expression.
+
+    Nested conjunctions and disjunctions get flattened, duplicate operands
+    are removed and ``(objectClass=*)`` is dropped from conjunctions with other
+    operands. Order of operands is preserved.
+    """
+    if isinstance(expression, FilterNot):
+        return FilterNot(simplify_filter(expression.operand))
+    if not isinstance(expression, FilterCompound):
+        return expression
+    cls = type(expression)
+    conjunction = cls is FilterAnd
+    operands = list()
+    seen = set()
+    match_all = None
+    stack = list(reversed(expression.operands))
+    while stack:
+        operand = stack.pop()
+        if type(operand) is cls:
+            stack.extend(reversed(operand.operands))
+            continue
+        simplified = simplify_filter(operand)
+        # simplification might end up with an operand of the same type
+        if type(simplified) is cls:
+            simplified = simplified.operands
+        else:
+            simplified = [simplified]
+        for operand in simplified:
+            if conjunction \
+                    and isinstance(operand, FilterItem) \
+                    and operand.matches_all:
+                match_all = operand
+                continue
+            key = str(operand)
+            if key in seen:
+                continue
+            seen.add(key)
+            operands.append(operand)
+    if not operands:
+        return match_all if match_all is not None else expression
+    if len(operands) == 1:
+        return operands[0]
+    return cls(operands)
+
+
+def _combine(operands, cls):
+    operands = [_ for _ in operands if _ is not None]
+    if not operands:
+        return None
+    if len(operands) == 1:
+        return operands[0]
+    return cls(operands)
+
+
+###############################################################################
+# filter API
+###############################################################################
+
 class LDAPFilter(object):
+    _expression = None
 
     def __init__(self, queryFilter=None):
         if queryFilter is not None \
@@ -26,48 +280,70 @@ class LDAPFilter(object):
                 and not isinstance(queryFilter, LDAPFilter):
             raise TypeError('Query filter must be LDAPFilter or string')
         queryFilter = ensure_bytes_py2(queryFilter)
-        self._filter = queryFilter
         if isinstance(queryFilter, LDAPFilter):
-            self._filter = str(queryFilter)
+            self._expression = queryFilter.expression
+        elif queryFilter:
+            try:
+                self._expression = parse_filter(queryFilter)
+            except ValueError as e:
+                logger.debug(
+                    u"Keep filter which cannot be parsed as is: {}".format(e)
+                )
+                self._expression = FilterText(queryFilter)
+
+    @property
+    def expression(self):
+        """Filter expression or ``None`` if filter is empty.
+        """
+        return self._expression
+
+    @property
+    def _filter(self):
+        # BBB, filter string
+        return str(self)
+
+    def _operand(self, other):
+        if isinstance(other, LDAPFilter):
+            return other.expression
+        if isinstance(other, string_type):
+            return LDAPFilter(other).expression
+        raise TypeError('unsupported operand type')
 
     def __and__(self, other):
         if other is None:
             return self
-        res = ''
-        if isinstance(other, LDAPFilter):
-            other = str(other)
-        elif not isinstance(other, string_type):
-            raise TypeError('unsupported operand type')
-        us = str(self)
-        if us and other:
-            res = '(&{}{})'.format(us, other)
-        elif us:
-            res = us
-        elif other:
-            res = other
-        return LDAPFilter(res)
+        other = self._operand(other)
+        return _filter_from_expression(
+            _combine([self.expression, other], FilterAnd)
+        )
 
     def __or__(self, other):
         if other is None:
             return self
-        res = ''
-        if isinstance(other, LDAPFilter):
-            other = str(other)
-        elif not isinstance(other, string_type):
-            raise TypeError('unsupported operand type')
-        us = str(self)
-        if us and other:
-            res = '(|{}{})'.format(us, other)
-        return LDAPFilter(res)
+        other = self._operand(other)
+        us = self.expression
+        if us is None or other is None:
+            return LDAPFilter()
+        return _filter_from_expression(FilterOr([us, other]))
 
     def __contains__(self, attr):
-        return self._filter.find('({}='.format(attr)) > -1
+        expression = self.expression
+        return expression is not None and attr in expression
 
     def __str__(self):
-        return self._filter and self._filter or ''
+        expression = self.expression
+        if expression is None:
+            return ''
+        return str(simplify_filter(expression))
 
     def __repr__(self):
-        return "LDAPFilter('{}')".format(self._filter)
+        return "LDAPFilter('{}')".format(str(self))
+
+
+def _filter_from_expression(expression):
+    _filter = LDAPFilter()
+    _filter._expression = expression
+    return _filter
 
 
 class LDAPDictFilter(LDAPFilter):
@@ -79,15 +355,16 @@ class LDAPDictFilter(LDAPFilter):
         self.or_keys = or_keys
         self.or_values = or_values
 
-    def __str__(self):
+    @property
+    def expression(self):
         if not self.criteria:
-            return ''
-        return str(dict_to_filter(
+            return None
+        return dict_to_filter(
             self.criteria,
             or_search=self.or_search,
             or_keys=self.or_keys,
             or_values=self.or_values
-        ))
+        ).expression
 
     def __repr__(self):
         cr = [
@@ -104,8 +381,9 @@ class LDAPRelationFilter(LDAPFilter):
         self.gattrs = node.attrs
         self.or_search = or_search
 
-    def __str__(self):
-        """turn relation string into ldap filter string
+    @property
+    def expression(self):
+        """turn relation string into ldap filter expression
         """
         dictionary = dict()
         parsedRelation = dict()
@@ -122,44 +400,70 @@ class LDAPRelationFilter(LDAPFilter):
                 dictionary[str(v)] = self.gattrs[str(k)]
         self.dictionary = dictionary
         if self.dictionary:
-            return str(dict_to_filter(self.dictionary, self.or_search))
-        return ''
+            return dict_to_filter(self.dictionary, self.or_search).expression
+        return None
 
     def __repr__(self):
         return "LDAPRelationFilter('{}')".format(str(self))
 
 
 def dict_to_filter(criteria, or_search=False, or_keys=None, or_values=None):
-    """Turn dictionary criteria into ldap queryFilter string
+    """Turn dictionary criteria into ldap queryFilter
     """
     or_keys = (or_keys is None) and or_search or or_keys
     or_values = (or_values is None) and or_search or or_values
-    _filter = None
+    attrfilters = list()
     for attr, values in sorted(criteria.items()):
         attr = ensure_bytes_py2(attr)
+        attr = ''.join([ESCAPE_CHARS.get(x, x) for x in attr])
         if not isinstance(values, list):
             values = [values]
-        attrfilter = None
+        valuefilters = list()
         for value in values:
             value = ensure_bytes_py2(value)
-            attr = ''.join([ESCAPE_CHARS.get(x, x) for x in attr])
             if isinstance(value, str):
                 value = ''.join([ESCAPE_CHARS.get(x, x) for x in value])
-            valuefilter = LDAPFilter('({}={})'.format(attr, value))
-            if attrfilter is None:
-                attrfilter = valuefilter
-                continue
-            if or_values:
-                attrfilter |= valuefilter
-            else:
-                attrfilter &= valuefilter
-        if _filter is None:
-            _filter = attrfilter
+            valuefilters.append(FilterItem(attr, '=', '{}'.format(value)))
+        attrfilters.append(
+            _combine(valuefilters, FilterOr if or_values else FilterAnd)
+        )
+    return _filter_from_expression(
+        _combine(attrfilters, FilterOr if or_keys else FilterAnd)
+    )
+
+
+def equality_filter(attr, value):
+    """Return filter matching ``value`` of ``attr`` literally.
+
+    Unlike ``dict_to_filter``, all special characters of the value including
+    ``*`` are escaped.
+    """
+    return _filter_from_expression(_equality_item(attr, value))
+
+
+def chunked_or_filters(attr, values, chunk_size):
+    """Turn values of an attribute into a list of OR filters, each containing
+    at most ``chunk_size`` values. Duplicate values are skipped. Values are
+    matched literally, see ``equality_filter``.
+    """
+    if chunk_size < 1:
+        raise ValueError('chunk_size must be greater than 0')
+    unique = list()
+    seen = set()
+    for value in values:
+        if value in seen:
             continue
-        if or_keys:
-            _filter |= attrfilter
-        else:
-            _filter &= attrfilter
-    if _filter is None:
-        _filter = LDAPFilter()
-    return _filter
+        seen.add(value)
+        unique.append(value)
+    return [
+        _filter_from_expression(_combine([
+            _equality_item(attr, value)
+            for value in unique[i:i + chunk_size]
+        ], FilterOr))
+        for i in range(0, len(unique), chunk_size)
+    ]
+
+
+def _equality_item(attr, value):
+    attr = ''.join([ESCAPE_CHARS.get(x, x) for x in ensure_bytes_py2(attr)])
+    return FilterItem(attr, '=', escape_filter_chars(ensure_text(value)))
@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+from bda.cache.interfaces import ICacheProvider
 from node.interfaces import IMappingStorage
 from node.interfaces import INodeAddedEvent
 from node.interfaces import INodeCreatedEvent
@@ -19,6 +20,42 @@ class ICacheProviderFactory(Interface):
         """
 
 
+class IMemoryCacheProvider(ICacheProvider):
+    """In-process cache provider.
+    """
+
+    hits = Attribute('Number of cache hits')
+
+    misses = Attribute('Number of cache misses')
+
+    evictions = Attribute('Number of entries evicted due to size limits')
+
+    def set(key, value, timeout=None):
+        """Store value by key with optional per entry timeout in seconds.
+        """
+
+    def stats():
+        """Return dict containing cache statistics.
+        """
+
+
+class ILayeredCacheProvider(ICacheProvider):
+    """Cache provider with a local first level cache in front of a shared
+    second level cache.
+    """
+
+    l1 = Attribute('First level ``IMemoryCacheProvider``')
+
+    l2 = Attribute('Second level ``ICacheProvider``')
+
+    l1_timeout = Attribute('Timeout of first level cache entries in seconds')
+
+    negative_timeout = Attribute(
+        'Timeout of cached ``NO_SUCH_OBJECT`` results in seconds. ``None`` '
+        'disables negative caching'
+    )
+
+
 class ILDAPProps(Interface):
     """LDAP properties configuration interface.
     """
@@ -55,10 +92,40 @@ class ILDAPProps(Interface):
 
     page_size = Attribute('Page size for LDAP queries.')
 
+    page_read_ahead = Attribute(
+        'Number of pages read in background while iterating paged results'
+    )
+
     conn_timeout = Attribute('LDAP connecton timeout')
 
     op_timemout = Attribute('LDAP operations timeout')
 
+    pool_size = Attribute('Maximum number of pooled connections')
+
+    pool_min_size = Attribute('Minimum number of idle pooled connections')
+
+    pool_idle_timeout = Attribute('Idle timeout of pooled connections')
+
+    pool_timeout = Attribute('Timeout waiting for a free pooled connection')
+
+    pool_check_interval = Attribute(
+        'Idle seconds after which pooled connections get health checked'
+    )
+
+    auth_pool_size = Attribute(
+        'Maximum number of pooled connections used for credential checks'
+    )
+
+    auth_pool_timeout = Attribute(
+        'Timeout waiting for a free pooled bind-check connection'
+    )
+
+    negative_timeout = Attribute('Timeout of cached negative search results')
+
+    eager_attributes = Attribute(
+        'Attributes loaded at once, remaining attributes get loaded lazily'
+    )
+
 
 class ILDAPPrincipalsConfig(Interface):
     """LDAP principals configuration interface.
@@ -118,6 +185,38 @@ class ILDAPPrincipalsConfig(Interface):
         '``EXPIRATION_SECONDS``. Defaults to days.'
     )
 
+    # Membership index related settings only get considered for groups and
+    # roles
+    membershipIndex = Attribute(
+        'Flag whether to resolve memberships from an in-process reverse '
+        'membership index. Defaults to False.'
+    )
+
+    membershipIndexInterval = Attribute(
+        'Minimum number of seconds between membership index refreshes. '
+        'Defaults to 30.'
+    )
+
+    membershipIndexAttr = Attribute(
+        'Operational attribute used to refresh the membership index '
+        'incrementally. Defaults to ``modifyTimestamp``.'
+    )
+
+    # Nested groups related settings only get considered for groups and roles
+    nestedGroups = Attribute(
+        'Flag whether groups may contain groups of the same container as '
+        'members, which get expanded transitively. Defaults to False.'
+    )
+
+    nestedGroupsDepth = Attribute(
+        'Maximum number of nesting levels to expand. Defaults to 10.'
+    )
+
+    nestedGroupsInterval = Attribute(
+        'Number of seconds expanded nested group memberships are cached. '
+        'Defaults to 30.'
+    )
+
 
 class ILDAPUsersConfig(ILDAPPrincipalsConfig):
     """LDAP users configuration interface.
@@ -156,6 +255,12 @@ class ILDAPStorage(IMappingStorage):
         'on ``__setitem__`` if not present yet.'
     )
 
+    prefetch = Attribute(
+        'Flag whether iteration prefetches attributes of children. If set, '
+        'accessing children and their attributes after iteration requires no '
+        'further LDAP searches. Inherited by child nodes.'
+    )
+
     def child_dn(key):
         """Return child DN for ``key``.
 
@@ -165,7 +270,9 @@ class ILDAPStorage(IMappingStorage):
     def search(queryFilter=None, criteria=None, attrlist=None,
                relation=None, relation_node=None, exact_match=False,
                or_search=False, or_keys=None, or_values=None,
-               page_size=None, cookie=None, get_nodes=False):
+               page_size=None, cookie=None, get_nodes=False, sort_keys=None,
+               offset=0, count=None, match_attr=None, match_values=None,
+               chunk_size=100):
         """Search the directors.
 
         All search criteria are additive and will be ``&``ed. ``queryFilter``
@@ -207,10 +314,42 @@ class ILDAPStorage(IMappingStorage):
         :param page_size: LDAP pagination search size.
         :param cookie: LDAP pagination search cookie.
         :param get_nodes: Flag whether to return LDAP nodes in search result.
+        :param sort_keys: List of attribute names to sort the result by.
+            Prefix attribute name with ``-`` for descending order. Server side
+            sorting is used if supported by the server, otherwise the result
+            gets sorted client side.
+        :param offset: Index of the first result item to return.
+        :param count: Number of result items to return. Virtual list view is
+            used together with ``sort_keys`` if supported by the server,
+            otherwise the result gets sliced client side. Cannot be combined
+            with ``page_size``.
+        :param match_attr: Attribute name ``match_values`` are searched in.
+        :param match_values: Iterable of attribute values. Entries matching
+            any of these values in ``match_attr`` are searched. Values are
+            matched literally, ``*`` is no wildcard. Values get split into OR
+            filters containing at most ``chunk_size`` values, the searches
+            for these chunks are pipelined and the results are merged without
+            duplicates. Cannot be combined with ``page_size``.
+        :param chunk_size: Maximum number of values per search filter.
         :return result: If no page size defined, return value is the result,
             otherwise a tuple containing (cookie, result).
         """
 
+    def iter_search(queryFilter=None, criteria=None, attrlist=None,
+                    relation=None, relation_node=None, or_search=False,
+                    or_keys=None, or_values=None, page_size=None,
+                    get_nodes=False):
+        """Search the directory and yield results as they arrive.
+
+        Arguments and result items are the same as in ``search``. Results are
+        neither cached nor collected in memory. Nodes yielded if ``get_nodes``
+        is True get added to the tree like on child access.
+
+        :param page_size: LDAP pagination search size. Defaults to
+            ``page_size`` of LDAP properties.
+        :return result: Generator yielding search results.
+        """
+
 
 ###############################################################################
 # events
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+import queue
+import threading
+
+
+class _PageError(object):
+    """Wraps an exception raised while reading pages in background.
+    """
+
+    def __init__(self, exc):
+        self.exc = exc
+
+
+_DONE = object()
+
+
+def iter_pages(search_page, read_ahead=0, release=None):
+    """Generator yielding the result pages of a paged search.
+
+    If ``read_ahead`` is greater than 0, pages are read by a background thread
+    while the current page gets consumed, thus network latency and processing
+    of results overlap. At most ``read_ahead`` pages are buffered. Exceptions
+    raised while reading pages are raised in the consuming thread.
+
+    :param search_page: Callable accepting a paged results ``cookie`` and
+        returning a tuple containing the page results and the cookie of the
+        next page. A result which is not a tuple is considered as the only
+        page.
+    :param read_ahead: Number of pages read in advance. Defaults to 0, which
+        reads the next page after the current page has been consumed.
+    :param release: Optional callable accepting a paged results ``cookie``.
+        Gets called with the cookie of the next page if the generator is
+        closed before the last page has been read, e.g. to release resources
+        bound to the unfinished paged search.
+    """
+    if not read_ahead:
+        cookie = ''
+        # cookie of the next page while suspended
+        pending = None
+        try:
+            while True:
+                res = search_page(cookie)
+                if not isinstance(res, tuple):
+                    yield res
+                    return
+                res, cookie = res
+                pending = cookie
+                yield res
+                pending = None
+                if not cookie:
+                    return
+        finally:
+            if pending and release is not None:
+                release(pending)
+    pages = queue.Queue(maxsize=read_ahead)
+    stop = threading.Event()
+
+    def put(item):
+        # returns False if consumer has gone
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read():
+        cookie = ''
+        try:
+            while not stop.is_set():
+                res = search_page(cookie)
+                if not isinstance(res, tuple):
+                    res, cookie = res, None
+                else:
+                    res, cookie = res
+                if not put(res) or not cookie:
+                    break
+        except Exception as e:
+            cookie = None
+            put(_PageError(e))
+        # reader stops before the last page if consumer has gone
+        if cookie and release is not None:
+            release(cookie)
+        put(_DONE)
+
+    reader = threading.Thread(target=read, name='ldap-page-reader')
+    reader.daemon = True
+    reader.start()
+    try:
+        while True:
+            page = pages.get()
+            if page is _DONE:
+                break
+            if isinstance(page, _PageError):
+                raise page.exc
+            yield page
+    finally:
+        # tell reader to stop if generator gets closed early
+        stop.set()
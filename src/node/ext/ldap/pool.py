@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+from contextlib import contextmanager
+from node.ext.ldap.scope import BASE
+import collections
+import ldap
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger('node.ext.ldap')
+
+
+class LDAPPoolExhausted(RuntimeError):
+    """Raised if no pooled connection becomes available in time.
+    """
+
+
+class LDAPConnectionPool(object):
+    """Thread safe pool of LDAP connections.
+
+    Connections are created lazily by calling ``factory`` and handed out via
+    ``checkout`` respective returned via ``checkin``. Idle connections exceeding
+    ``min_size`` get closed after ``idle_timeout`` seconds. Connections idle for
+    more than ``check_interval`` seconds get health checked before they are
+    handed out again.
+    """
+
+    def __init__(self, factory, size=10, min_size=0, idle_timeout=300,
+                 checkout_timeout=None, check_interval=60):
+        """Initialize LDAP connection pool.
+
+        :param factory: Callable returning a new ready to use connection.
+        :param size: Maximum number of connections.
+        :param min_size: Number of idle connections kept open regardless of
+            ``idle_timeout``.
+        :param idle_timeout: Seconds after which idle connections get closed.
+            ``None`` disables idle eviction.
+        :param checkout_timeout: Seconds to wait for a free connection if all
+            connections are in use. ``None`` waits forever.
+        :param check_interval: Seconds a connection may be idle before it gets
+            health checked on checkout. ``None`` disables health checks.
+        """
+        if size < 1:
+            raise ValueError(u"Pool size must be >= 1")
+        self.factory = factory
+        self.size = size
+        self.min_size = min(min_size, size)
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.check_interval = check_interval
+        # idle connections as (connection, timestamp) tuples. most recently
+        # returned connections are on the right.
+        self._idle = collections.deque()
+        self._used = 0
+        self._cond = threading.Condition(threading.Lock())
+
+    @property
+    def idle(self):
+        """Number of idle connections.
+        """
+        return len(self._idle)
+
+    @property
+    def used(self):
+        """Number of checked out connections.
+        """
+        return self._used
+
+    def checkout(self, timeout=None):
+        """Return a connection from the pool.
+
+        Creates a new connection if no idle connection is available and pool
+        size is not exceeded yet, otherwise waits until a connection gets
+        checked in.
+
+        :param timeout: Seconds to wait for a free connection. Defaults to
+            ``self.checkout_timeout``.
+        :raise LDAPPoolExhausted: If no connection gets available in time.
+        """
+        if timeout is None:
+            timeout = self.checkout_timeout
+        deadline = None if timeout is None else time.time() + timeout
+        con = stamp = None
+        with self._cond:
+            expired = self._evict()
+            while True:
+                if self._idle:
+                    con, stamp = self._idle.pop()
+                    break
+                if self._used + len(self._idle) < self.size:
+                    break
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        self._close(expired)
+                        raise LDAPPoolExhausted(
+                            u"No LDAP connection available within "
+                            u"{} seconds".format(timeout)
+                        )
+                self._cond.wait(remaining)
+            self._used += 1
+        self._close(expired)
+        try:
+            if con is not None and not self._check(con, stamp):
+                self._close([con])
+                con = None
+            if con is None:
+                con = self.factory()
+        except Exception:
+            self._release()
+            raise
+        return con
+
+    def checkin(self, con, discard=False):
+        """Return a connection to the pool.
+
+        :param con: Connection returned by ``checkout``.
+        :param discard: Flag whether to close the connection instead of
+            keeping it for later reuse.
+        """
+        if discard:
+            self._close([con])
+            self._release()
+            return
+        with self._cond:
+            self._used -= 1
+            self._idle.append((con, time.time()))
+            self._cond.notify()
+
+    def detach(self, con):
+        """Release the pool slot of a checked out connection which is kept
+        for a longer lasting operation.
+
+        Detached connections do not count against ``size``, thus other
+        consumers are not blocked by them. Use ``attach`` to hand them back.
+
+        :param con: Connection returned by ``checkout``.
+        """
+        self._release()
+
+    def attach(self, con, discard=False):
+        """Hand back a detached connection.
+
+        The connection is kept as idle connection if pool size permits,
+        otherwise it gets closed.
+
+        :param con: Connection passed to ``detach``.
+        :param discard: Flag whether to close the connection anyway.
+        """
+        if not discard:
+            with self._cond:
+                if self._used + len(self._idle) < self.size:
+                    self._idle.append((con, time.time()))
+                    self._cond.notify()
+                    return
+        self._close([con])
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Context manager checking out a connection and returning it
+        afterwards. Connections are discarded if the server is down.
+        """
+        con = self.checkout(timeout=timeout)
+        discard = False
+        try:
+            yield con
+        except ldap.SERVER_DOWN:
+            discard = True
+            raise
+        finally:
+            self.checkin(con, discard=discard)
+
+    def clear(self):
+        """Close all idle connections.
+        """
+        with self._cond:
+            idle = [con for con, _ in self._idle]
+            self._idle.clear()
+        self._close(idle)
+
+    def _release(self):
+        with self._cond:
+            self._used -= 1
+            self._cond.notify()
+
+    def _evict(self):
+        # remove expired idle connections. Needs to be called while holding
+        # the lock, the returned connections must be closed after releasing it
+        expired = list()
+        if self.idle_timeout is None:
+            return expired
+        limit = time.time() - self.idle_timeout
+        while self._idle and self._used + len(self._idle) > self.min_size:
+            con, stamp = self._idle[0]
+            if stamp > limit:
+                break
+            self._idle.popleft()
+            expired.append(con)
+        return expired
+
+    def _check(self, con, stamp):
+        # health check connection if idle for longer than check_interval
+        if self.check_interval is None:
+            return True
+        if time.time() - stamp < self.check_interval:
+            return True
+        try:
+            con.search_ext_s('', BASE, '(objectClass=*)', ['1.1'])
+        except ldap.LDAPError:
+            logger.debug(u"Discard pooled LDAP connection. Health check failed.")
+            return False
+        return True
+
+    def _close(self, connections):
+        for con in connections:
+            try:
+                con.unbind_s()
+            except (AttributeError, ldap.LDAPError):
+                logger.debug(u"Unbind of pooled LDAP connection failed.")
@@ -58,6 +58,16 @@ class LDAPServerProperties(object):
         page_size=1000,
         conn_timeout=-1,
         op_timeout=-1,
+        pool_size=0,
+        pool_min_size=0,
+        pool_idle_timeout=300,
+        pool_timeout=None,
+        pool_check_interval=60,
+        auth_pool_size=0,
+        auth_pool_timeout=None,
+        negative_timeout=None,
+        eager_attributes=None,
+        page_read_ahead=0,
     ):
         """Take the connection properties as arguments.
 
@@ -108,6 +118,33 @@ class LDAPServerProperties(object):
             not defined).
         :param op_timeout: Operations timeout in seconds, defaults to -1 (i.e.
             not defined).
+        :param pool_size: Maximum number of pooled connections used for
+            directory operations. Defaults to 0, which disables connection
+            pooling.
+        :param pool_min_size: Number of idle pooled connections kept open
+            regardless of ``pool_idle_timeout``. Defaults to 0.
+        :param pool_idle_timeout: Seconds after which idle pooled connections
+            get closed, defaults to 300.
+        :param pool_timeout: Seconds to wait for a free pooled connection if
+            all connections are in use. Defaults to None (i.e. wait forever).
+        :param pool_check_interval: Seconds a pooled connection may be idle
+            before it gets health checked on checkout, defaults to 60.
+        :param auth_pool_size: Maximum number of pooled connections used for
+            credential checks, which also limits the number of concurrent
+            credential checks. Defaults to 0, which disables pooling of
+            bind-check connections.
+        :param auth_pool_timeout: Seconds to wait for a free bind-check
+            connection. Defaults to None (i.e. wait forever).
+        :param negative_timeout: Timeout in seconds of cached searches failing
+            with ``NO_SUCH_OBJECT``. Only takes affect if cache is enabled and
+            the cache provider supports per entry timeouts. Defaults to None,
+            which disables negative caching.
+        :param eager_attributes: List of attribute names loaded when node
+            attributes are read. Remaining attributes get loaded lazily on
+            access. Defaults to None, which loads all attributes at once.
+        :param page_read_ahead: Number of pages read in background while
+            iterating paged search results. Defaults to 0, which disables
+            read-ahead.
         """
         if uri is None:
             # old school
@@ -132,6 +169,16 @@ class LDAPServerProperties(object):
         self.page_size = page_size
         self.conn_timeout = conn_timeout
         self.op_timeout = op_timeout
+        self.pool_size = pool_size
+        self.pool_min_size = pool_min_size
+        self.pool_idle_timeout = pool_idle_timeout
+        self.pool_timeout = pool_timeout
+        self.pool_check_interval = pool_check_interval
+        self.auth_pool_size = auth_pool_size
+        self.auth_pool_timeout = auth_pool_timeout
+        self.negative_timeout = negative_timeout
+        self.eager_attributes = eager_attributes
+        self.page_read_ahead = page_read_ahead
 
 
 # B/C
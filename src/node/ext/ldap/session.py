@@ -3,7 +3,12 @@ from node.ext.ldap import BASE
 from node.ext.ldap import LDAPCommunicator
 from node.ext.ldap import LDAPConnector
 from node.ext.ldap import testLDAPConnectivity
+from node.ext.ldap.cache import NEGATIVE_RESULT
+from node.ext.ldap.pool import LDAPPoolExhausted
+import asyncio
 import ldap
+import threading
+import time
 
 
 class LDAPSession(object):
@@ -35,7 +40,8 @@ class LDAPSession(object):
 
     def search(self, queryFilter='(objectClass=*)', scope=BASE, baseDN=None,
                force_reload=False, attrlist=None, attrsonly=0,
-               page_size=None, cookie=None):
+               page_size=None, cookie=None, sort_keys=None, offset=0,
+               count=None):
         if not queryFilter:
             # It makes no sense to really pass these to LDAP, therefore, we
             # interpret them as "don't filter" which in LDAP terms is
@@ -49,7 +55,10 @@ class LDAPSession(object):
             attrlist,
             attrsonly,
             page_size,
-            cookie
+            cookie,
+            sort_keys=sort_keys,
+            offset=offset,
+            count=count
         )
         if page_size:
             res, cookie = res
@@ -59,44 +68,74 @@ class LDAPSession(object):
             return res, cookie
         return res
 
+    def iter_search(self, queryFilter='(objectClass=*)', scope=BASE,
+                    baseDN=None, attrlist=None, attrsonly=0, page_size=None):
+        """Search the directory and yield entries as they arrive.
+
+        See ``LDAPCommunicator.iter_search``.
+        """
+        if not queryFilter:
+            queryFilter = '(objectClass=*)'
+        res = self._communicator.iter_search(
+            queryFilter,
+            scope,
+            baseDN,
+            attrlist,
+            attrsonly,
+            page_size
+        )
+        # ActiveDirectory returns entries with dn None, which can be ignored
+        return (x for x in res if x[0] is not None)
+
+    def count(self, queryFilter='(objectClass=*)', scope=BASE, baseDN=None,
+              sort_key=None, size_limit=None):
+        """Return number of entries matching a search.
+
+        See ``LDAPCommunicator.count``. Entries counted client side are
+        requested with ``page_size`` of LDAP properties.
+        """
+        if not queryFilter:
+            queryFilter = '(objectClass=*)'
+        return self._communicator.count(
+            queryFilter,
+            scope,
+            baseDN=baseDN,
+            sort_key=sort_key,
+            size_limit=size_limit,
+            page_size=self._props.page_size
+        )
+
+    def release_paged(self, cookie):
+        """Release connection pinned to an unfinished paged search.
+
+        See ``LDAPCommunicator.release_paged``.
+        """
+        self._communicator.release_paged(cookie)
+
+    def multi_search(self, requests, window=100):
+        """Perform multiple searches pipelined.
+
+        See ``LDAPCommunicator.multi_search``. ``queryFilter`` defaults to
+        ``(objectClass=*)`` and ``scope`` defaults to ``BASE``.
+        """
+        normalized = list()
+        for request in requests:
+            request = dict(request)
+            if not request.get('queryFilter'):
+                request['queryFilter'] = '(objectClass=*)'
+            request.setdefault('scope', BASE)
+            normalized.append(request)
+        results = self._communicator.multi_search(normalized, window=window)
+        # ActiveDirectory returns entries with dn None, which can be ignored
+        return [[x for x in res if x[0] is not None] for res in results]
+
     def add(self, dn, data):
         self._communicator.add(dn, data)
 
     def authenticate(self, dn, pw):
         """Verify credentials, but don't rebind the session to that user
         """
-        # Let's bypass connector/communicator until they are sorted out
-        if self._props.ignore_cert:  # pragma: no cover
-            ldap.set_option(ldap.OPT_X_TLS_REQUIRE_CERT, ldap.OPT_X_TLS_NEVER)
-        elif self._props.tls_cacertfile:  # pragma: no cover
-            ldap.set_option(ldap.OPT_X_TLS_CACERTFILE, self._props.tls_cacertfile)
-        elif self._props.tls_cacertdir:  # pragma: no cover
-            ldap.set_option(ldap.OPT_X_TLS_CACERTDIR, self._props.tls_cacertdir)
-        if self._props.tls_clcertfile and self._props.tls_clkeyfile:  # pragma: no cover
-            ldap.set_option(ldap.OPT_X_TLS_CERTFILE, self._props.tls_clcertfile)
-            ldap.set_option(ldap.OPT_X_TLS_KEYFILE, self._props.tls_clkeyfile)
-        elif self._props.tls_clcertfile or self._props.tls_clkeyfile:  # pragma: no cover
-            logger.exception("Only client certificate or key have been provided.")
-        con = ldap.initialize(
-            self._props.uri,
-            bytes_mode=False,
-            bytes_strictness='silent'
-        )
-        # Turning referrals off since they cause problems with MS Active
-        # Directory More info: https://www.python-ldap.org/faq.html#usage
-        con.set_option(ldap.OPT_REFERRALS, 0)
-        try:
-            if self._props.start_tls:
-                con.start_tls_s()
-            con.simple_bind_s(dn, pw)
-        except (ldap.INVALID_CREDENTIALS, ldap.UNWILLING_TO_PERFORM):
-            # The UNWILLING_TO_PERFORM event might be thrown, if you query a
-            # local user named ``admin``, but the LDAP server is configured to
-            # deny such queries. Instead of raising an exception, just ignore
-            # this.
-            return False
-        else:
-            return True
+        return self._communicator.authenticate(dn, pw)
 
     def modify(self, dn, data, replace=False):
         """Modify an existing entry in the directory.
@@ -120,3 +159,270 @@ class LDAPSession(object):
 
     def unbind(self):
         self._communicator.unbind()
+
+
+class AsyncLDAPSession(object):
+    """LDAP Session providing awaitable directory operations.
+
+    Operations are sent asynchronously and their results are polled without
+    blocking the event loop, thus many directory operations can be in flight
+    at once. If connection pooling is enabled, operations use pooled
+    connections, otherwise they share one connection. Binding is done in the
+    default executor of the event loop.
+    """
+    # initial and maximum interval in seconds between polling for results
+    poll_interval = 0.001
+    max_poll_interval = 0.05
+
+    def __init__(self, props):
+        self._props = props
+        connector = LDAPConnector(props=props)
+        self._communicator = LDAPCommunicator(connector)
+        self._bind_lock = threading.Lock()
+
+    def checkServerProperties(self):
+        """Test if connection can be established.
+        """
+        res = testLDAPConnectivity(props=self._props)
+        if res == 'success':
+            return (True, 'OK')
+        else:
+            return (False, res)
+
+    @property
+    def baseDN(self):
+        baseDN = self._communicator.baseDN
+        return baseDN
+
+    @baseDN.setter
+    def baseDN(self, baseDN):
+        self._communicator.baseDN = baseDN
+
+    async def search(self, queryFilter='(objectClass=*)', scope=BASE,
+                     baseDN=None, force_reload=False, attrlist=None,
+                     attrsonly=0, page_size=None, cookie=None):
+        """Search the directory.
+
+        See ``LDAPSession.search``.
+        """
+        if not queryFilter:
+            queryFilter = '(objectClass=*)'
+        communicator = self._communicator
+        baseDN, cookie, serverctrls = communicator._prepare_search(
+            baseDN,
+            page_size,
+            cookie
+        )
+        cache = communicator._cache
+        res = None
+        if cache:
+            key = communicator._cache_key(
+                baseDN,
+                scope,
+                queryFilter,
+                attrlist,
+                attrsonly,
+                page_size,
+                cookie
+            )
+            res = communicator._cache_get(key, force_reload)
+            if res is NEGATIVE_RESULT:
+                raise communicator._no_such_object(baseDN)
+        if res is None:
+            if type(attrlist) in (list, tuple):
+                attrlist = [str(_) for _ in attrlist]
+            args = [baseDN, scope, queryFilter, attrlist, attrsonly]
+            try:
+                if page_size and communicator._connector.pool is not None:
+                    _, results, _, rctrls = await self._paged_search(
+                        cookie,
+                        *args,
+                        serverctrls=serverctrls
+                    )
+                else:
+                    _, results, _, rctrls = await self._call(
+                        'search_ext',
+                        *args,
+                        serverctrls=serverctrls
+                    )
+            except ldap.NO_SUCH_OBJECT:
+                if cache:
+                    communicator._cache_negative(key, baseDN)
+                raise
+            res = communicator._search_result(results, rctrls)
+            if cache:
+                cache.set(key, res)
+                communicator._index_cached(key, baseDN, scope)
+        if page_size:
+            res, cookie = res
+        # ActiveDirectory returns entries with dn None, which can be ignored
+        res = [x for x in res if x[0] is not None]
+        if page_size:
+            return res, cookie
+        return res
+
+    async def add(self, dn, data):
+        try:
+            await self._call('add_ext', dn, [(k, v) for k, v in data.items()])
+        finally:
+            self._communicator.invalidate(dn)
+
+    async def authenticate(self, dn, pw):
+        """Verify credentials, but don't rebind the session to that user.
+
+        See ``LDAPConnector.authenticate``.
+        """
+        connector = self._communicator._connector
+        pool = connector.auth_pool
+        if pool is None:
+            con = connector._connect_auth()
+            try:
+                return await self._check_credentials(con, dn, pw)
+            finally:
+                try:
+                    con.unbind_s()
+                except ldap.LDAPError:
+                    pass
+        con = await self._checkout(pool)
+        discard = True
+        try:
+            res = await self._check_credentials(con, dn, pw)
+            if res:
+                # reset connection to anonymous. If this fails, the connection
+                # still carries the user identity and gets discarded
+                try:
+                    await self._result(con, con.simple_bind('', ''))
+                except ldap.LDAPError:
+                    return res
+            discard = False
+            return res
+        finally:
+            pool.checkin(con, discard=discard)
+
+    async def modify(self, dn, data, replace=False):
+        """Modify an existing entry in the directory.
+
+        See ``LDAPSession.modify``.
+        """
+        try:
+            await self._call('modify_ext', dn, data)
+        finally:
+            self._communicator.invalidate(dn)
+
+    async def delete(self, dn):
+        try:
+            await self._call('delete_ext', dn)
+        finally:
+            self._communicator.invalidate(dn)
+
+    async def passwd(self, userdn, oldpw, newpw):
+        try:
+            await self._call('passwd', userdn, oldpw, newpw, add_extop=1)
+        finally:
+            self._communicator.invalidate(userdn)
+
+    def unbind(self):
+        self._communicator.unbind()
+
+    async def _call(self, name, *args, **kw):
+        # send operation and await the result
+        add_extop = kw.pop('add_extop', 0)
+        communicator = self._communicator
+        pool = communicator._connector.pool
+        if pool is None:
+            con = await self._connection()
+            try:
+                msgid = getattr(con, name)(*args, **kw)
+                return await self._result(con, msgid, add_extop=add_extop)
+            except ldap.SERVER_DOWN:
+                # drop broken connection, next operation binds again
+                communicator._connector._con = None
+                communicator._con = None
+                raise
+        communicator._expire_paged()
+        con = await self._checkout(pool)
+        discard = False
+        try:
+            msgid = getattr(con, name)(*args, **kw)
+            return await self._result(con, msgid, add_extop=add_extop)
+        except ldap.SERVER_DOWN:
+            discard = True
+            raise
+        finally:
+            pool.checkin(con, discard=discard)
+
+    async def _paged_search(self, cookie, *args, **kw):
+        # paging cookies are only valid on the connection the paged search
+        # has been started on. keep pooled connection pinned to the returned
+        # cookie until the last page is fetched
+        communicator = self._communicator
+        con = communicator._pinned(cookie)
+        detached = con is not None
+        if not detached:
+            con = await self._checkout(communicator._connector.pool)
+        next_cookie = None
+        discard = False
+        try:
+            res = await self._result(con, con.search_ext(*args, **kw))
+            paged = communicator._search_result([], res[3])
+            if type(paged) is tuple:
+                next_cookie = paged[1]
+            return res
+        except ldap.SERVER_DOWN:
+            discard = True
+            raise
+        finally:
+            communicator._checkin_paged(
+                con,
+                next_cookie,
+                discard=discard,
+                detached=detached
+            )
+
+    async def _connection(self):
+        # return session connection. binding blocks, thus it is done in the
+        # default executor
+        communicator = self._communicator
+        if communicator._con is None:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._bind)
+        return communicator._con
+
+    def _bind(self):
+        # called from executor threads, bind only once
+        with self._bind_lock:
+            self._communicator.ensure_connection()
+
+    async def _result(self, con, msgid, add_extop=0):
+        # poll for operation result
+        interval = self.poll_interval
+        while True:
+            res = con.result4(msgid, all=1, timeout=0, add_extop=add_extop)
+            if res[0] is not None:
+                return res
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, self.max_poll_interval)
+
+    async def _check_credentials(self, con, dn, pw):
+        try:
+            await self._result(con, con.simple_bind(dn, pw))
+        except (ldap.INVALID_CREDENTIALS, ldap.UNWILLING_TO_PERFORM):
+            return False
+        return True
+
+    async def _checkout(self, pool):
+        # checkout connection from pool without blocking the event loop. new
+        # pooled connections get bound, thus checkout is done in the default
+        # executor
+        loop = asyncio.get_running_loop()
+        timeout = pool.checkout_timeout
+        deadline = None if timeout is None else time.time() + timeout
+        interval = self.poll_interval
+        while True:
+            try:
+                return await loop.run_in_executor(None, pool.checkout, 0)
+            except LDAPPoolExhausted:
+                if deadline is not None and time.time() >= deadline:
+                    raise
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, self.max_poll_interval)
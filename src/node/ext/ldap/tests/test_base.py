@@ -8,11 +8,16 @@ from node.ext.ldap import LDAPProps
 from node.ext.ldap import SUBTREE
 from node.ext.ldap import testing
 from node.ext.ldap.base import cache_key
+from node.ext.ldap.base import digest_key
 from node.ext.ldap.base import main
+from node.ext.ldap.base import md5digest
+from node.ext.ldap.base import sort_entries
 from node.ext.ldap.base import testLDAPConnectivity
 from node.tests import NodeTestCase
 from zope.component import provideAdapter
+import logging
 import sys
+import timeit
 
 
 class TestBase(NodeTestCase):
@@ -218,3 +223,267 @@ class TestBase(NodeTestCase):
             key,
             u'hällo-wörld-0-None-True-False-hällo-wörld-0-None-True-False'
         )
+
+    def test_search_cache_key(self):
+        props = LDAPProps(
+            uri=testing.SLAPDURIS,
+            user=testing.user,
+            password=testing.pwd,
+            cache=True
+        )
+        communicator = LDAPCommunicator(LDAPConnector(props=props))
+        self.assertFalse(communicator._cache_digest)
+
+        # Tuple based key is used for in-process caches
+        key = communicator._cache_key(
+            'dc=my-domain,dc=com',
+            SUBTREE,
+            '(cn=foo)',
+            ['sn', 'cn'],
+            0,
+            None,
+            None
+        )
+        self.assertEqual(key, (
+            'cn=Manager,dc=my-domain,dc=com',
+            'dc=my-domain,dc=com',
+            ('cn', 'sn'),
+            0,
+            '(cn=foo)',
+            SUBTREE,
+            None,
+            None
+        ))
+
+        # Order of attrlist is not relevant
+        self.assertEqual(key, communicator._cache_key(
+            'dc=my-domain,dc=com',
+            SUBTREE,
+            '(cn=foo)',
+            ['cn', 'sn'],
+            0,
+            None,
+            None
+        ))
+        self.assertEqual(
+            communicator._cache_key(
+                'dc=my-domain,dc=com',
+                SUBTREE,
+                '(cn=foo)',
+                None,
+                0,
+                None,
+                None
+            )[2],
+            ()
+        )
+
+        # Digest of key is used for external cache stores
+        communicator._cache_digest = True
+        digest = communicator._cache_key(
+            'dc=my-domain,dc=com',
+            SUBTREE,
+            '(cn=foo)',
+            ['sn', 'cn'],
+            0,
+            None,
+            None
+        )
+        self.assertEqual(digest, digest_key(key))
+        self.assertEqual(len(digest), 32)
+        self.assertNotEqual(digest, digest_key(key[:-1] + (b'cookie',)))
+
+    def test_sort_entries(self):
+        entries = [
+            ('cn=a', {'cn': [b'a'], 'sn': [b'Zulu']}),
+            ('cn=b', {'cn': [b'b'], 'SN': [b'alpha']}),
+            ('cn=c', {'cn': [b'c']}),
+            ('cn=d', {'cn': [b'd'], 'sn': [b'alpha', b'yankee']}),
+        ]
+        # Values are compared case insensitive, entries lacking sort attribute
+        # are sorted last
+        self.assertEqual(
+            [dn for dn, _ in sort_entries(entries, ['sn'])],
+            ['cn=b', 'cn=d', 'cn=a', 'cn=c']
+        )
+        # Descending order uses largest value of multi valued attributes and
+        # sorts entries lacking sort attribute first
+        self.assertEqual(
+            [dn for dn, _ in sort_entries(entries, ['-sn'])],
+            ['cn=c', 'cn=a', 'cn=d', 'cn=b']
+        )
+        # Multiple sort keys
+        self.assertEqual(
+            [dn for dn, _ in sort_entries(entries, ['sn', '-cn'])],
+            ['cn=d', 'cn=b', 'cn=a', 'cn=c']
+        )
+        # Ordering rules are ignored
+        self.assertEqual(
+            sort_entries(entries, ['sn:caseIgnoreOrderingMatch']),
+            sort_entries(entries, ['sn'])
+        )
+        # Given list is not modified
+        self.assertEqual(entries[0][0], 'cn=a')
+
+    def test_sorted_search(self):
+        props = LDAPProps(
+            uri=testing.SLAPDURIS,
+            user=testing.user,
+            password=testing.pwd,
+            cache=False
+        )
+        communicator = LDAPCommunicator(LDAPConnector(props=props))
+        communicator.baseDN = 'dc=my-domain,dc=com'
+
+        # Test server supports neither server side sorting nor virtual list
+        # view, thus results get sorted client side
+        sss = '1.2.840.113556.1.4.473'
+        vlv = '2.16.840.1.113730.3.4.9'
+        self.assertFalse(communicator.supports_control(sss))
+        self.assertFalse(communicator.supports_control(vlv))
+        # Paged results control is supported
+        self.assertTrue(communicator.supports_control('1.2.840.113556.1.4.319'))
+
+        def search(**kw):
+            return communicator.search(
+                '(objectClass=organizationalUnit)',
+                SUBTREE,
+                **kw
+            )
+
+        def ous(res):
+            return [attrs['ou'][0] for _, attrs in res]
+
+        res = search(attrlist=['ou'], sort_keys=['ou'])
+        self.assertEqual(ous(res), [
+            b'customer1',
+            b'customer2',
+            b'customers',
+            b'demo',
+            u'n\xe4sty\\, customer'.encode('utf-8')
+        ])
+        res = search(attrlist=['ou'], sort_keys=['-ou'])
+        self.assertEqual(ous(res)[0], u'n\xe4sty\\, customer'.encode('utf-8'))
+
+        # Result window
+        res = search(attrlist=['ou'], sort_keys=['ou'], offset=1, count=2)
+        self.assertEqual(ous(res), [b'customer2', b'customers'])
+        res = search(attrlist=['ou'], sort_keys=['ou'], offset=3)
+        self.assertEqual(
+            ous(res),
+            [b'demo', u'n\xe4sty\\, customer'.encode('utf-8')]
+        )
+        res = search(attrlist=['ou'], sort_keys=['ou'], offset=10, count=2)
+        self.assertEqual(res, [])
+        self.assertEqual(search(sort_keys=['ou'], count=0), [])
+
+        # Sort attributes not contained in attrlist are queried but not
+        # contained in result
+        res = search(attrlist=['description'], sort_keys=['ou'], count=1)
+        self.assertEqual(res, [(
+            'ou=customer1,ou=customers,dc=my-domain,dc=com',
+            {'description': [b'customer1']}
+        )])
+
+        # Paged sorted search returns the complete result as single page
+        res, cookie = search(attrlist=['ou'], sort_keys=['ou'], page_size=2)
+        self.assertEqual(len(res), 5)
+        self.assertEqual(cookie, '')
+        self.assertEqual(ous(res)[:2], [b'customer1', b'customer2'])
+
+        # Result window cannot be combined with paging
+        err = self.expectError(ValueError, search, count=2, page_size=2)
+        self.assertEqual(str(err), 'count cannot be combined with page_size')
+
+        # Server controls used if supported
+        _, _, ctrls = communicator._prepare_search(
+            None,
+            None,
+            None,
+            sort_keys=['ou'],
+            offset=5,
+            count=10
+        )
+        self.assertEqual([ctrl.controlType for ctrl in ctrls], [sss, vlv])
+        self.assertEqual(ctrls[0].ordering_rules, ['ou'])
+        self.assertEqual(ctrls[1].offset, 6)
+        self.assertEqual(ctrls[1].after_count, 9)
+
+        # Sorting and result window are part of cache key
+        key = communicator._cache_key(
+            'dc=my-domain,dc=com', SUBTREE, '(ou=*)', None, 0, None, None
+        )
+        self.assertEqual(len(key), 8)
+        key = communicator._cache_key(
+            'dc=my-domain,dc=com', SUBTREE, '(ou=*)', None, 0, None, None,
+            sort_keys=['ou'], offset=5, count=10
+        )
+        self.assertEqual(key[8:], (('ou',), 5, 10))
+
+    def test_cache_key_benchmark(self):
+        # Measure cost of building the cache key per search. ``legacy`` is the
+        # former key built with ``cache_key`` and ``md5digest``. Timings are
+        # reported only, they depend on the machine running the tests
+        props = LDAPProps(
+            uri=testing.SLAPDURIS,
+            user=testing.user,
+            password=testing.pwd,
+            cache=True
+        )
+        communicator = LDAPCommunicator(LDAPConnector(props=props))
+        args = (
+            'ou=customers,dc=my-domain,dc=com',
+            SUBTREE,
+            '(&(objectClass=person)(uid=foo))',
+            ['cn', 'sn', 'mail', 'uid'],
+            0,
+            None,
+            None
+        )
+        reordered = args[:3] + (['uid', 'mail', 'sn', 'cn'],) + args[4:]
+        other = args[:2] + ('(&(objectClass=person)(uid=bar))',) + args[3:]
+
+        # Equal searches get equal keys regardless of attrlist order,
+        # different searches get different keys
+        for digest in (False, True):
+            communicator._cache_digest = digest
+            key = communicator._cache_key(*args)
+            self.assertEqual(key, communicator._cache_key(*args))
+            self.assertEqual(key, communicator._cache_key(*reordered))
+            self.assertNotEqual(key, communicator._cache_key(*other))
+        communicator._cache_digest = False
+        self.assertTrue(isinstance(communicator._cache_key(*args), tuple))
+        communicator._cache_digest = True
+        self.assertEqual(len(communicator._cache_key(*args)), 32)
+
+        def legacy():
+            md5digest(cache_key([
+                testing.user,
+                args[0],
+                sorted(args[3]),
+                args[4],
+                args[2],
+                args[1],
+                args[5],
+                args[6]
+            ]))
+
+        def build_key():
+            communicator._cache_key(*args)
+
+        def measure(func, number=2000):
+            # best of 5 runs in seconds per key
+            return min(timeit.repeat(func, number=number, repeat=5)) / number
+
+        timings = dict()
+        timings['legacy'] = measure(legacy)
+        communicator._cache_digest = False
+        timings['tuple'] = measure(build_key)
+        communicator._cache_digest = True
+        timings['digest'] = measure(build_key)
+        logging.getLogger('node.ext.ldap').debug(
+            u"Cache key timings: {}".format(', '.join([
+                '{}: {:.2f}us'.format(name, timings[name] * 1e6)
+                for name in ('legacy', 'tuple', 'digest')
+            ]))
+        )
@@ -1,11 +1,33 @@
+from bda.cache import ICacheManager
 from bda.cache.memcached import Memcached
 from bda.cache.nullcache import NullCache
+from node.ext.ldap import BASE
+from node.ext.ldap import LDAPCommunicator
+from node.ext.ldap import LDAPConnector
+from node.ext.ldap import LDAPNode
+from node.ext.ldap import LDAPProps
+from node.ext.ldap import ONELEVEL
+from node.ext.ldap import SUBTREE
 from node.ext.ldap import testing
+from node.ext.ldap.cache import dn_path
+from node.ext.ldap.cache import LayeredCache
+from node.ext.ldap.cache import LayeredCacheProviderFactory
 from node.ext.ldap.cache import MemcachedProviderFactory
+from node.ext.ldap.cache import MemoryCache
+from node.ext.ldap.cache import MemoryCacheManager
+from node.ext.ldap.cache import MemoryCacheProviderFactory
+from node.ext.ldap.cache import NEGATIVE_RESULT
 from node.ext.ldap.cache import nullcacheProviderFactory
+from node.ext.ldap.cache import search_cache_index
+from node.ext.ldap.cache import SearchCacheIndex
 from node.ext.ldap.interfaces import ICacheProviderFactory
+from node.ext.ldap.testing import pwd
+from node.ext.ldap.testing import user
 from node.tests import NodeTestCase
+from zope.component import getGlobalSiteManager
 from zope.interface import registry
+import ldap
+import time
 
 
 class TestCache(NodeTestCase):
@@ -33,3 +55,444 @@ class TestCache(NodeTestCase):
         self.assertTrue(isinstance(cache, Memcached))
 
         components.unregisterUtility(cache_factory)
+
+    def test_memory_cache(self):
+        cache = MemoryCache(maxsize=2)
+        self.assertEqual(cache.keys(), [])
+        self.assertTrue(cache.get('a') is None)
+        self.assertEqual(cache.get('a', 'default'), 'default')
+        self.assertEqual(cache.misses, 2)
+
+        # Least recently used entries get evicted if maxsize exceeded
+        cache['a'] = 1
+        cache['b'] = 2
+        self.assertEqual(cache['a'], 1)
+        cache['c'] = 3
+        self.assertEqual(sorted(cache.keys()), ['a', 'c'])
+        self.assertEqual(sorted(cache.values()), [1, 3])
+        self.assertEqual(cache.stats(), {
+            'entries': 2,
+            'bytes': cache.size(),
+            'hits': 1,
+            'misses': 2,
+            'evictions': 1
+        })
+
+        # Entries expire after timeout
+        cache.set('a', 1, timeout=0.01)
+        time.sleep(0.02)
+        self.assertTrue(cache['a'] is None)
+        self.assertEqual(cache.keys(), ['c'])
+        del cache['c']
+        del cache['inexistent']
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.size(), 0)
+
+        # Default timeout applies to entries set without timeout
+        cache.timeout = 0.01
+        cache['a'] = 1
+        time.sleep(0.02)
+        self.assertTrue(cache['a'] is None)
+
+        # Size limit by approximate bytes
+        cache = MemoryCache(maxsize=None, maxbytes=1000)
+        cache['a'] = b'x' * 400
+        cache['b'] = b'x' * 400
+        cache['c'] = b'x' * 400
+        self.assertEqual(sorted(cache.keys()), ['b', 'c'])
+        self.assertTrue(cache.size() <= 1000)
+        self.assertEqual(cache.evictions, 1)
+
+        # Values larger than maxbytes are not cached at all
+        cache['d'] = b'x' * 2000
+        self.assertTrue(cache['d'] is None)
+        self.assertEqual(sorted(cache.keys()), ['b', 'c'])
+
+        cache.reset()
+        self.assertEqual(cache.keys(), [])
+        self.assertEqual(cache.size(), 0)
+
+        # Cache manager
+        manager = ICacheManager(cache)
+        self.assertTrue(isinstance(manager, MemoryCacheManager))
+        manager.setTimeout(60)
+        self.assertEqual(cache.timeout, 60)
+        self.assertEqual(manager.getData(lambda: 'value', 'key'), 'value')
+        self.assertEqual(manager.getData(lambda: 'other', 'key'), 'value')
+        self.assertTrue(manager.get('key', force_reload=True) is None)
+        self.assertTrue(manager.get('key') is None)
+        manager.set('key', 'value')
+        del manager['key']
+        self.assertTrue(manager.get('key') is None)
+
+        # Factory always returns the same cache instance
+        factory = MemoryCacheProviderFactory(maxsize=100, maxbytes=10000)
+        cache = factory()
+        self.assertTrue(cache is factory())
+        self.assertEqual(cache.maxsize, 100)
+        self.assertEqual(cache.maxbytes, 10000)
+
+        # Communicators share the cache
+        gsm = getGlobalSiteManager()
+        gsm.registerUtility(factory)
+        try:
+            props = LDAPProps(
+                uri=testing.SLAPDURIS,
+                user=user,
+                password=pwd,
+                cache=True
+            )
+            communicator = LDAPCommunicator(LDAPConnector(props=props))
+            communicator.baseDN = 'dc=my-domain,dc=com'
+            res = communicator.search('(objectClass=*)', SUBTREE)
+            self.assertEqual(len(res), 7)
+            self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+            communicator = LDAPCommunicator(LDAPConnector(props=props))
+            communicator.baseDN = 'dc=my-domain,dc=com'
+            self.assertEqual(
+                communicator.search('(objectClass=*)', SUBTREE),
+                res
+            )
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+            self.assertEqual(cache.timeout, props.timeout)
+        finally:
+            gsm.unregisterUtility(factory)
+
+    def test_search_cache_index(self):
+        self.assertEqual(
+            dn_path('CN=Foo, ou=customers,dc=my-domain,dc=com'),
+            ('cn=foo', 'ou=customers', 'dc=my-domain', 'dc=com')
+        )
+        self.assertEqual(dn_path(''), ())
+
+        index = SearchCacheIndex()
+        index.add('base', 'cn=foo,ou=customers,dc=my-domain,dc=com', BASE)
+        index.add('sibling', 'cn=bar,ou=customers,dc=my-domain,dc=com', BASE)
+        index.add('onelevel', 'ou=customers,dc=my-domain,dc=com', ONELEVEL)
+        index.add('root_onelevel', 'dc=my-domain,dc=com', ONELEVEL)
+        index.add('subtree', 'dc=my-domain,dc=com', SUBTREE)
+        index.add('rootdse', '', BASE)
+        self.assertEqual(len(index), 6)
+
+        # Write on entry affects base searches on entry, onelevel searches on
+        # parent and subtree searches on ancestors
+        affected = index.invalidate('cn=Foo, ou=customers,dc=MY-domain,dc=com')
+        self.assertEqual(sorted(affected), ['base', 'onelevel', 'subtree'])
+        self.assertEqual(len(index), 3)
+        self.assertEqual(
+            index.invalidate('cn=foo,ou=customers,dc=my-domain,dc=com'),
+            []
+        )
+
+        # Search bases which cannot be indexed must not be cached
+        self.assertEqual(index.add('invalid', 'invalid', BASE), ['invalid'])
+
+        # Expired keys are not reported
+        index.add('expired', 'dc=my-domain,dc=com', SUBTREE, timeout=0.01)
+        time.sleep(0.02)
+        self.assertEqual(
+            index.invalidate('ou=customers,dc=my-domain,dc=com'),
+            []
+        )
+
+        # Keys exceeding maxsize are dropped from index and must be removed
+        # from cache
+        index = SearchCacheIndex(maxsize=2)
+        self.assertEqual(index.add('a', 'dc=my-domain,dc=com', BASE), [])
+        self.assertEqual(index.add('b', 'dc=my-domain,dc=com', BASE), [])
+        self.assertEqual(index.add('c', 'dc=my-domain,dc=com', BASE), ['a'])
+        self.assertEqual(sorted(index.clear()), ['b', 'c'])
+        self.assertEqual(len(index), 0)
+
+        # Keys can be discarded explicitly
+        index.add('a', 'dc=my-domain,dc=com', BASE)
+        index.discard('a')
+        index.discard('unknown')
+        self.assertEqual(len(index), 0)
+
+        # Indexes are scoped per cache provider instance, layered caches use
+        # the index of their first level cache
+        cache = MemoryCache()
+        self.assertTrue(search_cache_index(cache) is search_cache_index(cache))
+        self.assertFalse(
+            search_cache_index(cache) is search_cache_index(MemoryCache())
+        )
+        self.assertTrue(
+            search_cache_index(LayeredCache(MemoryCache(), l1=cache))
+            is search_cache_index(cache)
+        )
+
+    def test_cache_invalidation(self):
+        factory = MemoryCacheProviderFactory()
+        cache = factory()
+        gsm = getGlobalSiteManager()
+        gsm.registerUtility(factory)
+        try:
+            props = LDAPProps(
+                uri=testing.SLAPDURIS,
+                user=user,
+                password=pwd,
+                cache=True
+            )
+            communicator = LDAPCommunicator(LDAPConnector(props=props))
+            index = search_cache_index(cache)
+            self.assertTrue(communicator._cache_index is index)
+            communicator.baseDN = 'dc=my-domain,dc=com'
+            parent = 'ou=customer1,ou=customers,dc=my-domain,dc=com'
+            dn = 'cn=foo,{}'.format(parent)
+
+            def searches():
+                return [
+                    communicator.search('(cn=foo)', SUBTREE),
+                    communicator.search('(objectClass=*)', ONELEVEL, parent),
+                    communicator.search('(objectClass=*)', BASE, parent),
+                ]
+
+            self.assertEqual(searches(), [[], [], [(parent, {
+                'objectClass': [b'top', b'organizationalUnit'],
+                'ou': [b'customer1'],
+                'description': [b'customer1'],
+                'businessCategory': [b'customers']
+            })]])
+            self.assertEqual(len(cache), 3)
+
+            # Adding an entry invalidates affected searches, search on parent
+            # entry is kept
+            communicator.add(dn, {
+                'cn': b'foo',
+                'sn': b'bar',
+                'objectclass': (b'person', b'top'),
+            })
+            self.assertEqual(len(cache), 1)
+            res = searches()
+            self.assertEqual([x[0] for x in res[0]], [dn])
+            self.assertEqual([x[0] for x in res[1]], [dn])
+
+            # Modification invalidates cached results
+            entry = communicator.search('(objectClass=*)', BASE, dn)
+            self.assertEqual(entry[0][1]['sn'], [b'bar'])
+            communicator.modify(dn, [(ldap.MOD_REPLACE, 'sn', b'baz')])
+            entry = communicator.search('(objectClass=*)', BASE, dn)
+            self.assertEqual(entry[0][1]['sn'], [b'baz'])
+
+            # So does deletion
+            communicator.delete(dn)
+            self.assertEqual(searches()[:2], [[], []])
+
+            # Keys of search results no longer cached get pruned from index
+            self.assertEqual(len(index), 3)
+            cache.reset()
+            for key in list(index._keys):
+                self.assertTrue(communicator._cache_get(key) is None)
+            self.assertEqual(len(index), 0)
+
+            # Results of pipelined searches get invalidated by their own search
+            # base and scope
+            other = 'ou=customer2,ou=customers,dc=my-domain,dc=com'
+            requests = [
+                dict(queryFilter='(objectClass=*)', scope=BASE, baseDN=parent),
+                dict(queryFilter='(objectClass=*)', scope=BASE, baseDN=other),
+            ]
+            res = communicator.multi_search(requests)
+            self.assertEqual([x[0][0] for x in res], [parent, other])
+            self.assertEqual(len(cache), 2)
+            communicator.modify(
+                parent,
+                [(ldap.MOD_REPLACE, 'description', b'changed')]
+            )
+            self.assertEqual(len(cache), 1)
+            res = communicator.multi_search(requests)
+            self.assertEqual(res[0][0][1]['description'], [b'changed'])
+            self.assertEqual(res[1][0][1]['description'], [b'customer2'])
+            communicator.modify(
+                parent,
+                [(ldap.MOD_REPLACE, 'description', b'customer1')]
+            )
+        finally:
+            gsm.unregisterUtility(factory)
+            cache.reset()
+
+    def test_layered_cache(self):
+        l2 = MemoryCache()
+        cache = LayeredCache(l2, l1_timeout=0.01)
+        self.assertTrue(isinstance(cache.l1, MemoryCache))
+        self.assertTrue(cache.negative_timeout is None)
+
+        # Cache manager sets timeout of second level cache
+        manager = ICacheManager(cache)
+        self.assertTrue(isinstance(manager, MemoryCacheManager))
+        manager.setTimeout(60)
+        self.assertEqual(l2.timeout, 60)
+        self.assertEqual(cache.timeout, 60)
+
+        # Values are written to both levels
+        cache['a'] = 1
+        self.assertEqual(cache.l1.keys(), ['a'])
+        self.assertEqual(l2.keys(), ['a'])
+        self.assertEqual(cache.keys(), ['a'])
+        self.assertEqual(cache.values(), [1])
+        self.assertEqual(cache.size(), cache.l1.size() + l2.size())
+
+        # First level entries expire after ``l1_timeout`` and get refilled from
+        # second level cache
+        time.sleep(0.02)
+        self.assertEqual(cache.l1.keys(), [])
+        self.assertEqual(cache['a'], 1)
+        self.assertEqual(cache.l1.keys(), ['a'])
+        self.assertEqual(cache.get('b', 'default'), 'default')
+
+        # Deletion removes entry from both levels
+        del cache['a']
+        self.assertTrue(cache['a'] is None)
+        self.assertEqual(l2.keys(), [])
+
+        # Negative results are not cached if negative caching is disabled
+        cache['n'] = NEGATIVE_RESULT
+        self.assertTrue(cache['n'] is None)
+
+        # Negative results are only cached in first level cache
+        cache.negative_timeout = 0.01
+        cache['n'] = NEGATIVE_RESULT
+        self.assertTrue(cache['n'] is NEGATIVE_RESULT)
+        self.assertEqual(l2.keys(), [])
+        time.sleep(0.02)
+        self.assertTrue(cache['n'] is None)
+
+        cache['a'] = 1
+        cache.reset()
+        self.assertEqual(cache.l1.keys(), [])
+        self.assertEqual(l2.keys(), [])
+
+        # Factory uses one first level cache for all created caches
+        factory = LayeredCacheProviderFactory(
+            l1_maxsize=100,
+            l1_timeout=10,
+            negative_timeout=5
+        )
+        cache = factory()
+        self.assertTrue(isinstance(cache, LayeredCache))
+        self.assertTrue(isinstance(cache.l2, Memcached))
+        self.assertTrue(cache.l1 is factory().l1)
+        self.assertEqual(cache.l1.maxsize, 100)
+        self.assertEqual(cache.l1_timeout, 10)
+        self.assertEqual(cache.negative_timeout, 5)
+
+    def test_negative_cache(self):
+        cache = LayeredCache(MemoryCache(), negative_timeout=60)
+
+        def factory():
+            return cache
+
+        gsm = getGlobalSiteManager()
+        gsm.registerUtility(factory, ICacheProviderFactory)
+        try:
+            props = LDAPProps(
+                uri=testing.SLAPDURIS,
+                user=user,
+                password=pwd,
+                cache=True
+            )
+            communicator = LDAPCommunicator(LDAPConnector(props=props))
+            self.assertEqual(communicator._negative_timeout, 60)
+            dn = 'cn=foo,ou=customer1,ou=customers,dc=my-domain,dc=com'
+
+            # NO_SUCH_OBJECT results get cached
+            self.expectError(
+                ldap.NO_SUCH_OBJECT,
+                communicator.search,
+                '(objectClass=*)',
+                BASE,
+                dn
+            )
+            self.assertEqual(cache.l1.values(), [NEGATIVE_RESULT])
+            self.assertEqual(cache.l2.keys(), [])
+            self.expectError(
+                ldap.NO_SUCH_OBJECT,
+                communicator.search,
+                '(objectClass=*)',
+                BASE,
+                dn
+            )
+            self.assertEqual(cache.l1.hits, 1)
+
+            # Negative results get invalidated if entry gets added
+            communicator.add(dn, {
+                'cn': b'foo',
+                'sn': b'bar',
+                'objectclass': (b'person', b'top'),
+            })
+            self.assertEqual(cache.l1.keys(), [])
+            res = communicator.search('(objectClass=*)', BASE, dn)
+            self.assertEqual(res[0][0], dn)
+            communicator.delete(dn)
+        finally:
+            gsm.unregisterUtility(factory, ICacheProviderFactory)
+
+    def test_negative_timeout(self):
+        factory = MemoryCacheProviderFactory()
+        cache = factory()
+        gsm = getGlobalSiteManager()
+        gsm.registerUtility(factory)
+        try:
+            props = LDAPProps(
+                uri=testing.SLAPDURIS,
+                user=user,
+                password=pwd,
+                cache=True,
+                negative_timeout=0.1
+            )
+            communicator = LDAPCommunicator(LDAPConnector(props=props))
+            self.assertEqual(communicator._negative_timeout, 0.1)
+
+            # Existence probes of ``LDAPStorage`` are served from cache
+            node = LDAPNode(
+                'ou=customer1,ou=customers,dc=my-domain,dc=com',
+                props
+            )
+            self.expectError(KeyError, node.__getitem__, 'cn=foo')
+            self.assertEqual(cache.values(), [NEGATIVE_RESULT])
+            misses = cache.misses
+            self.expectError(KeyError, node.__getitem__, 'cn=foo')
+            self.assertEqual(cache.misses, misses)
+
+            # Pipelined searches use the same cache keys
+            self.assertEqual(node.ldap_session.multi_search([dict(
+                baseDN='cn=foo,ou=customer1,ou=customers,dc=my-domain,dc=com',
+                attrlist=['']
+            )]), [[]])
+            self.assertEqual(cache.misses, misses)
+
+            # Negative results expire after ``negative_timeout``
+            time.sleep(0.2)
+            self.expectError(KeyError, node.__getitem__, 'cn=foo')
+            self.assertEqual(cache.misses, misses + 1)
+
+            # Adding the entry invalidates negative result
+            person = LDAPNode()
+            person.attrs['objectClass'] = ['top', 'person']
+            person.attrs['sn'] = 'Bar'
+            node['cn=foo'] = person
+            node()
+            self.assertFalse(NEGATIVE_RESULT in cache.values())
+            node = LDAPNode(
+                'ou=customer1,ou=customers,dc=my-domain,dc=com',
+                props
+            )
+            self.assertEqual(
+                node['cn=foo'].DN,
+                'cn=foo,ou=customer1,ou=customers,dc=my-domain,dc=com'
+            )
+            del node['cn=foo']
+            node()
+
+            # Negative caching requires cache provider supporting per entry
+            # timeouts
+            gsm.unregisterUtility(factory)
+            gsm.registerUtility(MemcachedProviderFactory())
+            communicator = LDAPCommunicator(LDAPConnector(props=props))
+            self.assertTrue(communicator._negative_timeout is None)
+            gsm.unregisterUtility(provided=ICacheProviderFactory)
+        finally:
+            gsm.unregisterUtility(factory)
+            cache.reset()
@@ -1,10 +1,19 @@
 # -*- coding: utf-8 -*-
 from node.base import AttributedNode
 from node.ext.ldap import testing
+from node.ext.ldap.filter import chunked_or_filters
 from node.ext.ldap.filter import dict_to_filter
+from node.ext.ldap.filter import equality_filter
+from node.ext.ldap.filter import FilterAnd
+from node.ext.ldap.filter import FilterItem
+from node.ext.ldap.filter import FilterNot
+from node.ext.ldap.filter import FilterOr
+from node.ext.ldap.filter import FilterText
 from node.ext.ldap.filter import LDAPDictFilter
 from node.ext.ldap.filter import LDAPFilter
 from node.ext.ldap.filter import LDAPRelationFilter
+from node.ext.ldap.filter import parse_filter
+from node.ext.ldap.filter import simplify_filter
 from node.tests import NodeTestCase
 from odict import odict
 
@@ -100,42 +109,65 @@ class TestFilter(NodeTestCase):
         )
         self.assertEqual(
             str(filter & other_filter),
-            '(&(|(cn=sepp)(sn=meierä))(&(homeDirectory=\\2fhome\\2f*)(mail=*@example.com)))'
+            '(&(|(cn=sepp)(sn=meierä))(homeDirectory=\\2fhome\\2f*)(mail=*@example.com))'
         )
         self.assertEqual(
             str(filter | other_filter),
-            '(|(|(cn=sepp)(sn=meierä))(&(homeDirectory=\\2fhome\\2f*)(mail=*@example.com)))'
+            '(|(cn=sepp)(sn=meierä)(&(homeDirectory=\\2fhome\\2f*)(mail=*@example.com)))'
         )
         self.assertEqual(
             str(filter & LDAPFilter('(objectClass=person)')),
             '(&(|(cn=sepp)(sn=meierä))(objectClass=person))'
         )
 
-        # fine-grained control with or_keys and or_values
+        # fine-grained control with or_keys and or_values. Nested
+        # conjunctions and disjunctions are flattened
         criteria = odict((('a', [1, 2]), ('b', [3, 4]), ('c', 5)))
         self.assertEqual(
             str(LDAPDictFilter(criteria)),
-            '(&(&(&(a=1)(a=2))(&(b=3)(b=4)))(c=5))'
+            '(&(a=1)(a=2)(b=3)(b=4)(c=5))'
         )
         self.assertEqual(
             str(LDAPDictFilter(criteria, or_keys=True)),
-            '(|(|(&(a=1)(a=2))(&(b=3)(b=4)))(c=5))'
+            '(|(&(a=1)(a=2))(&(b=3)(b=4))(c=5))'
         )
         self.assertEqual(
             str(LDAPDictFilter(criteria, or_values=True)),
-            '(&(&(|(a=1)(a=2))(|(b=3)(b=4)))(c=5))'
+            '(&(|(a=1)(a=2))(|(b=3)(b=4))(c=5))'
         )
         self.assertEqual(
             str(LDAPDictFilter(criteria, or_search=True)),
-            '(|(|(|(a=1)(a=2))(|(b=3)(b=4)))(c=5))'
+            '(|(a=1)(a=2)(b=3)(b=4)(c=5))'
         )
         self.assertEqual(
             str(LDAPDictFilter(criteria, or_search=True, or_keys=False)),
-            '(&(&(|(a=1)(a=2))(|(b=3)(b=4)))(c=5))'
+            '(&(|(a=1)(a=2))(|(b=3)(b=4))(c=5))'
         )
         self.assertEqual(
             str(LDAPDictFilter(criteria, or_search=True, or_values=False)),
-            '(|(|(&(a=1)(a=2))(&(b=3)(b=4)))(c=5))'
+            '(|(&(a=1)(a=2))(&(b=3)(b=4))(c=5))'
+        )
+
+    def test_chunked_or_filters(self):
+        # Values are split into OR filters of at most chunk_size values,
+        # duplicates are skipped
+        filters = chunked_or_filters('uid', ['a', 'b', 'a', 'c'], 2)
+        self.assertEqual(
+            [str(_) for _ in filters],
+            ['(|(uid=a)(uid=b))', '(uid=c)']
+        )
+        self.assertEqual(chunked_or_filters('uid', [], 2), [])
+        err = self.expectError(ValueError, chunked_or_filters, 'uid', ['a'], 0)
+        self.assertEqual(str(err), 'chunk_size must be greater than 0')
+
+        # Values are matched literally
+        self.assertEqual(
+            [str(_) for _ in chunked_or_filters('cn', ['*', 'a(b)\\'], 2)],
+            ['(|(cn=\\2a)(cn=a\\28b\\29\\5c))']
+        )
+        self.assertEqual(
+            str(equality_filter('member', 'cn=*,dc=my-domain,dc=com')),
+            '(member=cn=\\2a,dc=my-domain,dc=com)'
         )
 
     def test_LDAPRelationFilter(self):
@@ -193,3 +225,127 @@ class TestFilter(NodeTestCase):
             'someUid:otherUid|inexistent:inexistent'
         )
         self.assertEqual(str(rel_filter), '(otherUid=123ä)')
+
+    def test_parse_filter(self):
+        expression = parse_filter(
+            '(&(cn:dn:=foo)(!(uid>=1000))(|(sn~=a)(x<=b)))'
+        )
+        self.assertIsInstance(expression, FilterAnd)
+        item, neg, disjunction = expression.operands
+        self.assertIsInstance(item, FilterItem)
+        self.assertEqual(
+            (item.attr, item.op, item.value, item.attribute),
+            ('cn:dn', ':=', 'foo', 'cn')
+        )
+        self.assertIsInstance(neg, FilterNot)
+        self.assertEqual(
+            (neg.operand.attr, neg.operand.op, neg.operand.value),
+            ('uid', '>=', '1000')
+        )
+        self.assertIsInstance(disjunction, FilterOr)
+        self.assertEqual(
+            [(_.attr, _.op, _.value) for _ in disjunction.operands],
+            [('sn', '~=', 'a'), ('x', '<=', 'b')]
+        )
+        self.assertEqual(
+            str(expression),
+            '(&(cn:dn:=foo)(!(uid>=1000))(|(sn~=a)(x<=b)))'
+        )
+
+        # Values are kept escaped
+        self.assertEqual(
+            str(parse_filter('(cn=a\\28b\\29*)')),
+            '(cn=a\\28b\\29*)'
+        )
+
+        # Enclosing parentheses may be missing
+        self.assertEqual(str(parse_filter('cn=foo')), '(cn=foo)')
+
+        # Invalid filter strings
+        for text in ['(', '(&)', '(cn)', '(cn=a(b))', '(a=b))', '(a=b)(c=d)']:
+            self.expectError(ValueError, parse_filter, text)
+        err = self.expectError(ValueError, parse_filter, '(&)')
+        self.assertEqual(str(err), 'Invalid filter "(&)" at position 2')
+
+        # LDAPFilter keeps filter strings which can not be parsed as is
+        filter = LDAPFilter('(cn=a(b))')
+        self.assertIsInstance(filter.expression, FilterText)
+        self.assertEqual(str(filter), '(cn=a(b))')
+        self.assertTrue('cn' in filter)
+
+        # Filter strings missing enclosing parentheses get wrapped
+        self.assertEqual(str(LDAPFilter('cn=foo')), '(cn=foo)')
+
+        # BBB, ``_filter`` returns filter string
+        self.assertEqual(LDAPFilter('cn=foo')._filter, '(cn=foo)')
+        self.assertEqual(LDAPFilter()._filter, '')
+
+    def test_simplify_filter(self):
+        # Nested conjunctions and disjunctions get flattened
+        expression = FilterAnd([
+            FilterAnd([FilterItem('a', '=', '1'), FilterItem('b', '=', '2')]),
+            FilterOr([
+                FilterOr([FilterItem('c', '=', '3')]),
+                FilterItem('d', '=', '4')
+            ])
+        ])
+        self.assertEqual(
+            str(expression),
+            '(&(&(a=1)(b=2))(|(|(c=3))(d=4)))'
+        )
+        self.assertEqual(
+            str(simplify_filter(expression)),
+            '(&(a=1)(b=2)(|(c=3)(d=4)))'
+        )
+
+        # Duplicate operands are removed
+        self.assertEqual(
+            str(simplify_filter(parse_filter('(|(a=1)(b=2)(|(a=1)(b=2)))'))),
+            '(|(a=1)(b=2))'
+        )
+
+        # Match all filter gets dropped from conjunctions
+        self.assertEqual(
+            str(simplify_filter(parse_filter(
+                '(&(objectClass=*)(cn=foo)(!(&(objectclass=*)(sn=bar))))'
+            ))),
+            '(&(cn=foo)(!(sn=bar)))'
+        )
+        self.assertEqual(
+            str(simplify_filter(parse_filter(
+                '(&(objectClass=*)(objectClass=*))'
+            ))),
+            '(objectClass=*)'
+        )
+        self.assertEqual(
+            str(simplify_filter(parse_filter('(|(objectClass=*)(cn=foo))'))),
+            '(|(objectClass=*)(cn=foo))'
+        )
+
+        # LDAPFilter serializes canonical form, hence equivalent filters
+        # result in equal strings
+        filter = LDAPFilter('(objectClass=*)')
+        filter &= LDAPFilter('(cn=foo)')
+        filter &= '(&(sn=bar)(cn=foo))'
+        self.assertEqual(str(filter), '(&(cn=foo)(sn=bar))')
+        self.assertEqual(
+            str(filter),
+            str(LDAPFilter('(&(cn=foo)(sn=bar))'))
+        )
+
+        # Filter expressions are only serialized when converted to string,
+        # thus large filters are built cheap
+        member = '(member=uid=user{},dc=my-domain,dc=com)'
+        members = LDAPFilter(member.format(0))
+        for i in range(1, 5000):
+            members |= member.format(i)
+        filter = LDAPFilter('(objectClass=groupOfNames)')
+        filter &= members
+        res = str(filter)
+        self.assertTrue(res.startswith(
+            '(&(objectClass=groupOfNames)(|(member=uid=user0,dc=my-domain'
+        ))
+        self.assertEqual(res.count('(member='), 5000)
+        self.assertTrue('member' in filter)
+        self.assertTrue('Member' in filter)
+        self.assertFalse('uid' in filter)
@@ -31,6 +31,26 @@ import ldap
 import os
 
 
+def record_calls(testcase, obj, name, record):
+    """Wrap method ``name`` of ``obj`` to record its calls.
+
+    ``record`` gets called with the arguments of each call before the original
+    method is called. The original method is restored on cleanup of
+    ``testcase``.
+    """
+    method = getattr(obj, name)
+
+    def recording(*args, **kw):
+        record(*args, **kw)
+        return method(*args, **kw)
+
+    if name in vars(obj):
+        testcase.addCleanup(setattr, obj, name, method)
+    else:
+        testcase.addCleanup(delattr, obj, name)
+    setattr(obj, name, recording)
+
+
 class TestNode(NodeTestCase):
     layer = testing.LDIF_data
 
@@ -1178,6 +1198,255 @@ class TestNode(NodeTestCase):
         root()
         self.assertEqual(root.keys(), [u'ou=customers', u'ou=demo'])
 
+    def test_iter_search(self):
+        node = LDAPNode('dc=my-domain,dc=com', props)
+        node.search_scope = SUBTREE
+
+        # Results are the same as of search
+        self.assertEqual(
+            sorted(node.iter_search(page_size=2)),
+            sorted(node.search())
+        )
+        res = node.iter_search(
+            criteria={'objectClass': 'organizationalUnit'},
+            attrlist=['ou', 'rdn', 'dn'],
+            page_size=2
+        )
+        self.assertEqual(sorted(res, key=lambda x: x[0]), sorted(
+            node.search(
+                criteria={'objectClass': 'organizationalUnit'},
+                attrlist=['ou', 'rdn', 'dn']
+            ),
+            key=lambda x: x[0]
+        ))
+        res = node.iter_search(queryFilter='(ou=customer1)', attrlist=['ou'])
+        self.assertEqual(list(res), [(
+            u'ou=customer1,ou=customers,dc=my-domain,dc=com',
+            {u'ou': [u'customer1']}
+        )])
+
+        # Nodes instead of DN's
+        res = node.iter_search(queryFilter='(ou=customer*)', get_nodes=True)
+        self.assertEqual(sorted([repr(it) for it in res]), [
+            '<ou=customer1,ou=customers,dc=my-domain,dc=com:ou=customer1 - False>',
+            '<ou=customer2,ou=customers,dc=my-domain,dc=com:ou=customer2 - False>',
+            '<ou=customers,dc=my-domain,dc=com:ou=customers - False>'
+        ])
+        res = node.iter_search(
+            queryFilter='(ou=customer1)',
+            attrlist=['ou'],
+            get_nodes=True
+        )
+        self.assertEqual([(repr(n), a) for n, a in res], [(
+            '<ou=customer1,ou=customers,dc=my-domain,dc=com:ou=customer1 - False>',
+            {u'ou': [u'customer1']}
+        )])
+
+    def test_search_nodes(self):
+        node = LDAPNode('dc=my-domain,dc=com', props)
+        node.search_scope = SUBTREE
+
+        # Count searches performed by session
+        searches = list()
+        session = node.ldap_session
+        record_calls(
+            self,
+            session,
+            'search',
+            lambda *args, **kw: searches.append(kw.get('baseDN'))
+        )
+
+        # Nodes are created from search results without further searches
+        res = node.search(queryFilter='(ou=customer1)', get_nodes=True)
+        self.assertEqual(len(searches), 1)
+        self.assertEqual(
+            [repr(it) for it in res],
+            ['<ou=customer1,ou=customers,dc=my-domain,dc=com:ou=customer1 - False>']
+        )
+        customers = node.storage['ou=customers']
+        self.assertEqual(customers.DN, 'ou=customers,dc=my-domain,dc=com')
+        self.assertTrue(customers.storage['ou=customer1'] is res[0])
+
+        # Existing nodes are reused
+        del searches[:]
+        res = node.search(queryFilter='(ou=customer*)', get_nodes=True)
+        self.assertEqual(len(searches), 1)
+        self.assertTrue(any([it is customers for it in res]))
+        customer1 = customers.storage['ou=customer1']
+        self.assertTrue(any([it is customer1 for it in res]))
+        self.assertTrue(node['ou=customers'] is customers)
+        self.assertEqual(len(searches), 1)
+
+        # Attributes contained in search result are used for node attributes
+        del searches[:]
+        res = node.search(
+            queryFilter='(uid=binary)',
+            attrlist=['cn', 'sn'],
+            get_nodes=True
+        )
+        self.assertEqual(len(searches), 1)
+        binary = res[0][0]
+        self.assertEqual(res[0][1], {u'cn': [u'cn_binary'], u'sn': [u'sn_binary']})
+        self.assertEqual(binary.attrs['cn'], 'cn_binary')
+        self.assertEqual(binary.attrs['sn'], 'sn_binary')
+        self.assertEqual(len(searches), 1)
+        self.assertFalse(binary.changed)
+
+        # Remaining attributes get loaded lazily
+        self.assertEqual(binary.attrs['mail'], 'binary@groupOfNames.com')
+        self.assertEqual(len(searches), 2)
+
+        # Search results on base DN
+        res = node.search(queryFilter='(dc=my-domain)', get_nodes=True)
+        self.assertTrue(res[0] is node)
+
+    def test_search_sorted(self):
+        node = LDAPNode('ou=customers,dc=my-domain,dc=com', props)
+        criteria = {'objectClass': 'organizationalUnit'}
+        self.assertEqual(node.search(criteria=criteria, sort_keys=['-ou']), [
+            u'ou=n\xe4sty\\2C customer,ou=customers,dc=my-domain,dc=com',
+            u'ou=customer2,ou=customers,dc=my-domain,dc=com',
+            u'ou=customer1,ou=customers,dc=my-domain,dc=com'
+        ])
+        res = node.search(
+            criteria=criteria,
+            attrlist=['description'],
+            sort_keys=['ou'],
+            offset=1,
+            count=1,
+            get_nodes=True
+        )
+        self.assertEqual(len(res), 1)
+        self.assertEqual(res[0][0].name, u'ou=customer2')
+        self.assertEqual(res[0][1], {u'description': [u'customer2']})
+
+    def test_search_match_values(self):
+        node = LDAPNode('ou=customers,dc=my-domain,dc=com', props)
+
+        # Count pipelined searches performed by session
+        requests = list()
+        session = node.ldap_session
+        record_calls(
+            self,
+            session,
+            'multi_search',
+            lambda reqs, **kw: requests.extend(reqs)
+        )
+
+        # Values get split into chunks searched with OR filters, results are
+        # merged without duplicates
+        values = ['customer1', 'customer2', 'customer1', 'inexistent']
+        self.assertEqual(node.search(
+            match_attr='ou',
+            match_values=values,
+            chunk_size=2
+        ), [
+            u'ou=customer1,ou=customers,dc=my-domain,dc=com',
+            u'ou=customer2,ou=customers,dc=my-domain,dc=com'
+        ])
+        self.assertEqual(
+            [request['queryFilter'] for request in requests],
+            ['(|(ou=customer1)(ou=customer2))', '(ou=inexistent)']
+        )
+
+        # Match values combined with other search arguments
+        del requests[:]
+        res = node.search(
+            queryFilter='(objectClass=organizationalUnit)',
+            attrlist=['description'],
+            match_attr='ou',
+            match_values=values,
+            chunk_size=1,
+            sort_keys=['-ou'],
+            count=1
+        )
+        self.assertEqual(res, [(
+            u'ou=customer2,ou=customers,dc=my-domain,dc=com',
+            {u'description': [u'customer2']}
+        )])
+        self.assertEqual(len(requests), 3)
+        self.assertEqual(
+            requests[0]['queryFilter'],
+            '(&(objectClass=organizationalUnit)(ou=customer1))'
+        )
+
+        # Values are matched literally
+        self.assertEqual(
+            node.search(match_attr='ou', match_values=['customer*']),
+            []
+        )
+
+        # No values, no search
+        del requests[:]
+        self.assertEqual(node.search(match_attr='ou', match_values=[]), [])
+        self.assertEqual(requests, [])
+
+        # Cannot be combined with paging
+        err = self.expectError(
+            ValueError,
+            node.search,
+            match_attr='ou',
+            match_values=values,
+            page_size=10
+        )
+        self.assertEqual(
+            str(err),
+            'match_values cannot be combined with page_size'
+        )
+
+    def test_count(self):
+        customers = LDAPNode('ou=customers,dc=my-domain,dc=com', props)
+
+        # Count searches performed by session
+        searches = list()
+        session = customers.ldap_session
+        record_calls(
+            self,
+            session,
+            'search',
+            lambda *args, **kw: searches.append(kw.get('baseDN'))
+        )
+
+        # Count matching entries
+        self.assertEqual(customers.count(), 4)
+        self.assertEqual(
+            customers.count(criteria={'objectClass': 'organizationalUnit'}),
+            3
+        )
+        self.assertEqual(customers.count(queryFilter='(ou=customer*)'), 2)
+        self.assertEqual(customers.count(size_limit=2), 2)
+
+        # Length of node counts children without iterating them. The RDN
+        # attribute is used as sort key, which enables counting via virtual
+        # list view
+        counts = list()
+        record_calls(
+            self,
+            session,
+            'count',
+            lambda *args, **kw: counts.append(kw.get('sort_key'))
+        )
+        self.assertEqual(len(customers), 4)
+        self.assertEqual(searches, [])
+        self.assertEqual(counts, ['ou'])
+
+        # Added and deleted children are considered
+        node = LDAPNode()
+        node.attrs['objectClass'] = ['person']
+        node.attrs['sn'] = 'Foo'
+        customers['cn=foo'] = node
+        self.assertEqual(len(customers), 5)
+        del customers['ou=customer1']
+        self.assertEqual(len(customers), 4)
+        del customers['cn=foo']
+        self.assertEqual(len(customers), 3)
+        self.assertEqual(len(customers), len(customers.keys()))
+
+        # Unpersisted and detached nodes
+        self.assertEqual(len(LDAPNode()), 0)
+        customers['cn=bar'] = LDAPNode()
+        self.assertEqual(len(customers['cn=bar']), 0)
+
     def test_events(self):
         pushGlobalRegistry()
 
@@ -1287,3 +1556,239 @@ class TestNode(NodeTestCase):
         schema_info = root.schema_info
         self.assertTrue(isinstance(schema_info, LDAPSchemaInfo))
         self.assertTrue(root[u'ou=customers'].schema_info is schema_info)
+
+    def test_prefetch(self):
+        root = LDAPNode('ou=customers,dc=my-domain,dc=com', props)
+        self.assertFalse(root.prefetch)
+
+        # Count searches performed by session
+        searches = list()
+        session = root.ldap_session
+        record_calls(
+            self,
+            session,
+            'search',
+            lambda *args, **kw: searches.append(kw.get('baseDN'))
+        )
+
+        # Without prefetching, accessing children requires an existence check
+        # and loading the attributes requires another search per child
+        for key in root:
+            root[key].attrs
+        self.assertEqual(len(searches), 1 + 2 * 4)
+
+        # With prefetching, iteration creates the child nodes with attributes
+        root = LDAPNode('ou=customers,dc=my-domain,dc=com', props)
+        root._ldap_session = session
+        root.prefetch = True
+        del searches[:]
+        descriptions = list()
+        for key in root:
+            descriptions.append(root[key].attrs.get('description'))
+        self.assertEqual(len(searches), 1)
+        self.assertEqual(
+            descriptions,
+            [u'customer1', u'customer2', u'n\xe4sty', None]
+        )
+        self.assertEqual(root.keys(), [
+            u'ou=customer1',
+            u'ou=customer2',
+            u'ou=n\xe4sty\\, customer',
+            u'uid=binary'
+        ])
+        self.assertEqual(
+            root['ou=customer1'].DN,
+            'ou=customer1,ou=customers,dc=my-domain,dc=com'
+        )
+
+        # Children inherit prefetch flag
+        self.assertTrue(root['ou=customer1'].prefetch)
+
+        # Prefetched attributes are only used once, reloading fetches them
+        # from directory
+        del searches[:]
+        child = root['ou=customer1']
+        child.attrs.load()
+        self.assertEqual(
+            searches,
+            ['ou=customer1,ou=customers,dc=my-domain,dc=com']
+        )
+        self.assertEqual(child.attrs['ou'], 'customer1')
+
+        # Modification of prefetched children
+        child.attrs['description'] = 'changed'
+        root()
+        root = LDAPNode('ou=customers,dc=my-domain,dc=com', props)
+        self.assertEqual(
+            root['ou=customer1'].attrs['description'],
+            'changed'
+        )
+        root['ou=customer1'].attrs['description'] = 'customer1'
+        root()
+
+    def test_hydrated_children(self):
+        root = LDAPNode('ou=customers,dc=my-domain,dc=com', props)
+
+        # Count searches performed by session
+        searches = list()
+        session = root.ldap_session
+        record_calls(
+            self,
+            session,
+            'search',
+            lambda *args, **kw: searches.append(kw.get('attrlist'))
+        )
+
+        # Values are created with attributes from one search
+        values = root.values()
+        self.assertEqual(searches, [['*']])
+        self.assertEqual(
+            [node.attrs.get('description') for node in values],
+            [u'customer1', u'customer2', u'n\xe4sty', None]
+        )
+        self.assertEqual(len(searches), 1)
+
+        # Nodes already contained in storage are reused
+        del searches[:]
+        items = root.items()
+        self.assertEqual(len(searches), 1)
+        self.assertEqual([key for key, _ in items], root.keys())
+        self.assertTrue(items[0][1] is values[0])
+        self.assertTrue(list(root.itervalues())[0] is values[0])
+        self.assertTrue(next(root.iteritems())[1] is values[0])
+
+        # Limit loaded attributes
+        root = LDAPNode('ou=customers,dc=my-domain,dc=com', props)
+        root._ldap_session = session
+        del searches[:]
+        items = root.items(attrlist=['ou', 'description'])
+        self.assertEqual(searches, [['ou', 'description']])
+        key, node = items[0]
+        self.assertEqual(key, 'ou=customer1')
+        self.assertEqual(
+            sorted(node.attrs.storage.keys()),
+            ['description', 'ou']
+        )
+
+        # Attributes not loaded get loaded lazily
+        del searches[:]
+        self.assertEqual(node.attrs['businessCategory'], 'customers')
+        self.assertEqual(searches, [['businessCategory']])
+
+        # Modifying nodes loaded with limited attributes does not delete
+        # attributes not loaded
+        node.attrs['description'] = 'changed'
+        root()
+        root = LDAPNode('ou=customers,dc=my-domain,dc=com', props)
+        node = root['ou=customer1']
+        self.assertEqual(node.attrs['description'], 'changed')
+        self.assertEqual(node.attrs['businessCategory'], 'customers')
+        self.assertEqual(
+            node.attrs['objectClass'],
+            ['top', 'organizationalUnit']
+        )
+
+        # Loaded attributes can still be deleted
+        root = LDAPNode('ou=customers,dc=my-domain,dc=com', props)
+        node = root.values(attrlist=['description'])[0]
+        del node.attrs['description']
+        root()
+        root = LDAPNode('ou=customers,dc=my-domain,dc=com', props)
+        node = root['ou=customer1']
+        self.assertFalse('description' in node.attrs)
+        self.assertEqual(node.attrs['businessCategory'], 'customers')
+        node.attrs['description'] = 'customer1'
+        root()
+
+        # Nodes without name have no children
+        self.assertEqual(LDAPNode().values(), [])
+
+    def test_lazy_attributes(self):
+        root = LDAPNode('ou=customers,dc=my-domain,dc=com', props)
+        self.assertTrue(root._eager_attributes is None)
+
+        # Count searches performed by session
+        searches = list()
+        session = root.ldap_session
+        record_calls(
+            self,
+            session,
+            'search',
+            lambda *args, **kw: searches.append(kw.get('attrlist'))
+        )
+
+        # All attributes are loaded by default
+        node = root['uid=binary']
+        del searches[:]
+        self.assertEqual(node.attrs['uid'], 'binary')
+        self.assertEqual(searches, [['*']])
+        self.assertTrue(node.attrs._loaded is None)
+
+        # Load eager attributes only, others get loaded on access
+        root._eager_attributes = ['uid', 'objectClass']
+        node = root['uid=binary']
+        node.attrs.load()
+        del searches[:]
+        self.assertEqual(node.attrs['uid'], 'binary')
+        self.assertEqual(searches, [])
+        self.assertEqual(
+            sorted(node.attrs.storage.keys()),
+            ['objectClass', 'uid']
+        )
+        self.assertFalse(node.changed)
+
+        self.assertTrue(node.attrs['userPassword'] is not None)
+        self.assertEqual(searches, [['userPassword']])
+
+        # Inexistent attributes are only queried once
+        del searches[:]
+        self.assertFalse('description' in node.attrs)
+        self.assertFalse('description' in node.attrs)
+        self.assertEqual(searches, [['description']])
+        self.assertEqual(
+            node.attrs._loaded,
+            set(['uid', 'objectclass', 'userpassword', 'description'])
+        )
+
+        # Iteration loads remaining attributes
+        del searches[:]
+        self.assertEqual(
+            sorted(node.attrs.keys()),
+            ['cn', 'jpegPhoto', 'mail', 'objectClass', 'sn', 'uid',
+             'userPassword']
+        )
+        self.assertEqual(searches, [['*']])
+        self.assertTrue(node.attrs._loaded is None)
+        self.assertFalse(node.changed)
+
+        # Explicitly load attributes
+        node.attrs.load()
+        del searches[:]
+        node.attrs.load_attrs(['uid', 'jpegPhoto'])
+        self.assertEqual(searches, [['jpegPhoto']])
+        node.attrs.load_attrs(['uid', 'jpegPhoto'])
+        self.assertEqual(searches, [['jpegPhoto']])
+
+        # Set and deleted attributes are not overwritten by lazy loading
+        node.attrs.load()
+        node.attrs['userPassword'] = 'secret'
+        del node.attrs['jpegPhoto']
+        self.assertTrue(node.changed)
+        self.assertEqual(
+            sorted(node.attrs.keys()),
+            ['cn', 'mail', 'objectClass', 'sn', 'uid', 'userPassword']
+        )
+        self.assertEqual(node.attrs['userPassword'], 'secret')
+        node.attrs.load()
+        self.assertFalse(node.changed)
+        self.assertTrue('jpegPhoto' in node.attrs)
+
+        # Modifying lazy loaded node
+        node.attrs['description'] = 'binary'
+        node()
+        root = LDAPNode('ou=customers,dc=my-domain,dc=com', props)
+        node = root['uid=binary']
+        self.assertEqual(node.attrs['description'], 'binary')
+        self.assertTrue('jpegPhoto' in node.attrs)
+        del node.attrs['description']
+        node()
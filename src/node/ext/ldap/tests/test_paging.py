@@ -0,0 +1,130 @@
+from node.ext.ldap import LDAPNode
+from node.ext.ldap import LDAPProps
+from node.ext.ldap import testing
+from node.ext.ldap.paging import iter_pages
+from node.ext.ldap.testing import pwd
+from node.ext.ldap.testing import user
+from node.tests import NodeTestCase
+import threading
+
+
+class TestPaging(NodeTestCase):
+    layer = testing.LDIF_data
+
+    def test_iter_pages(self):
+        pages = {
+            '': ([1, 2], 'a'),
+            'a': ([3, 4], 'b'),
+            'b': ([5], ''),
+        }
+        requested = list()
+
+        def search_page(cookie):
+            requested.append(cookie)
+            return pages[cookie]
+
+        # Without read-ahead
+        self.assertEqual(list(iter_pages(search_page)), [[1, 2], [3, 4], [5]])
+        self.assertEqual(requested, ['', 'a', 'b'])
+
+        # With read-ahead
+        del requested[:]
+        res = list(iter_pages(search_page, read_ahead=2))
+        self.assertEqual(res, [[1, 2], [3, 4], [5]])
+        self.assertEqual(requested, ['', 'a', 'b'])
+
+        # Non paged result
+        self.assertEqual(list(iter_pages(lambda cookie: [1])), [[1]])
+        self.assertEqual(list(iter_pages(lambda cookie: [1], 1)), [[1]])
+
+        # Next page gets read while current page is consumed
+        read = dict([(cookie, threading.Event()) for cookie in pages])
+
+        def signaling_search_page(cookie):
+            read[cookie].set()
+            return pages[cookie]
+
+        consumed = list()
+        for page in iter_pages(signaling_search_page, read_ahead=1):
+            if not consumed:
+                # blocks until reader fetched second page. timeout only
+                # prevents a hanging test if read-ahead is broken
+                self.assertTrue(read['a'].wait(timeout=5))
+            consumed.append(page)
+        self.assertEqual(consumed, [[1, 2], [3, 4], [5]])
+
+        # Errors get raised in consuming thread
+        def failing_search_page(cookie):
+            if cookie == 'a':
+                raise ValueError('Page failed')
+            return pages[cookie]
+
+        res = iter_pages(failing_search_page, read_ahead=1)
+        self.assertEqual(next(res), [1, 2])
+        err = self.expectError(ValueError, next, res)
+        self.assertEqual(str(err), 'Page failed')
+
+        # Reader stops if generator gets closed
+        def readers():
+            return [
+                thread for thread in threading.enumerate()
+                if thread.name == 'ldap-page-reader'
+            ]
+
+        res = iter_pages(search_page, read_ahead=1)
+        self.assertEqual(next(res), [1, 2])
+        running = readers()
+        res.close()
+        for thread in running:
+            thread.join(timeout=5)
+        self.assertEqual(readers(), [])
+
+        # Unfinished paged search gets released if generator gets closed
+        released = list()
+        res = iter_pages(search_page, release=released.append)
+        self.assertEqual(next(res), [1, 2])
+        res.close()
+        self.assertEqual(released, ['a'])
+
+        del released[:]
+        res = iter_pages(search_page, read_ahead=1, release=released.append)
+        self.assertEqual(next(res), [1, 2])
+        running = readers()
+        res.close()
+        for thread in running:
+            thread.join(timeout=5)
+        # depends on how many pages the reader fetched meanwhile
+        self.assertEqual(len(released), 1)
+        self.assertTrue(released[0] in ('a', 'b'))
+
+        # Nothing gets released if all pages have been read
+        del released[:]
+        list(iter_pages(search_page, release=released.append))
+        list(iter_pages(search_page, read_ahead=1, release=released.append))
+        self.assertEqual(released, [])
+
+    def test_page_read_ahead(self):
+        props = LDAPProps(
+            uri=testing.SLAPDURIS,
+            user=user,
+            password=pwd,
+            cache=False,
+            page_size=1,
+            page_read_ahead=2
+        )
+        node = LDAPNode('ou=customers,dc=my-domain,dc=com', props)
+        self.assertEqual(node._page_read_ahead, 2)
+        self.assertEqual(sorted(node.keys()), [
+            'ou=customer1',
+            'ou=customer2',
+            u'ou=n\xe4sty\\, customer',
+            'uid=binary'
+        ])
+        self.assertEqual(
+            sorted([key for key, _ in node.items(attrlist=['ou'])]),
+            sorted(node.keys())
+        )
+        self.assertEqual(
+            sorted(node.batched_search(page_size=1)),
+            sorted(node.search())
+        )
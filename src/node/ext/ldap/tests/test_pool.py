@@ -0,0 +1,401 @@
+from node.ext.ldap import BASE
+from node.ext.ldap import LDAPCommunicator
+from node.ext.ldap import LDAPConnector
+from node.ext.ldap import LDAPNode
+from node.ext.ldap import LDAPProps
+from node.ext.ldap import ONELEVEL
+from node.ext.ldap import SUBTREE
+from node.ext.ldap import testing
+from node.ext.ldap.pool import LDAPConnectionPool
+from node.ext.ldap.pool import LDAPPoolExhausted
+from node.ext.ldap.testing import pwd
+from node.ext.ldap.testing import user
+from node.tests import NodeTestCase
+import ldap
+import threading
+import time
+
+
+class DummyConnection(object):
+
+    def __init__(self, alive=True, rebind_fails=False):
+        self.alive = alive
+        self.rebind_fails = rebind_fails
+        self.unbound = False
+
+    def search_ext_s(self, *args):
+        if not self.alive:
+            raise ldap.SERVER_DOWN({'desc': "Can't contact LDAP server"})
+
+    def simple_bind_s(self, who, cred):
+        if not who and self.rebind_fails:
+            raise ldap.SERVER_DOWN({'desc': "Can't contact LDAP server"})
+
+    def unbind_s(self):
+        self.unbound = True
+
+
+class TestPool(NodeTestCase):
+    layer = testing.LDIF_data
+
+    def test_pool(self):
+        created = list()
+
+        def factory():
+            con = DummyConnection()
+            created.append(con)
+            return con
+
+        err = self.expectError(ValueError, LDAPConnectionPool, factory, size=0)
+        self.assertEqual(str(err), 'Pool size must be >= 1')
+
+        pool = LDAPConnectionPool(factory, size=2, checkout_timeout=0.1)
+        self.assertEqual((pool.idle, pool.used), (0, 0))
+
+        # Connections are created lazily
+        con1 = pool.checkout()
+        con2 = pool.checkout()
+        self.assertEqual(len(created), 2)
+        self.assertEqual((pool.idle, pool.used), (0, 2))
+
+        # Pool size exceeded
+        err = self.expectError(LDAPPoolExhausted, pool.checkout)
+        self.assertEqual(
+            str(err),
+            'No LDAP connection available within 0.1 seconds'
+        )
+
+        # Checked in connections get reused
+        pool.checkin(con1)
+        self.assertEqual((pool.idle, pool.used), (1, 1))
+        self.assertTrue(pool.checkout() is con1)
+        pool.checkin(con1)
+
+        # Discarded connections get closed
+        pool.checkin(con2, discard=True)
+        self.assertTrue(con2.unbound)
+        self.assertEqual((pool.idle, pool.used), (1, 0))
+
+        # Waiting checkout gets connection as soon as one is checked in
+        con1 = pool.checkout()
+        con2 = pool.checkout()
+        timer = threading.Timer(0.05, pool.checkin, args=(con2,))
+        timer.start()
+        self.assertTrue(pool.checkout(timeout=1) is con2)
+        timer.join()
+        pool.checkin(con1)
+        pool.checkin(con2)
+
+        # Context manager
+        with pool.connection() as con:
+            self.assertTrue(con in (con1, con2))
+            self.assertEqual(pool.used, 1)
+        self.assertEqual(pool.used, 0)
+
+        # Connections are discarded if server is down
+        def fail():
+            with pool.connection():
+                raise ldap.SERVER_DOWN({'desc': "Can't contact LDAP server"})
+
+        self.expectError(ldap.SERVER_DOWN, fail)
+        self.assertEqual((pool.idle, pool.used), (1, 0))
+
+        # Idle connections failing health check get replaced
+        pool.check_interval = 0
+        dead = pool._idle[-1][0]
+        dead.alive = False
+        con = pool.checkout()
+        self.assertFalse(con is dead)
+        self.assertTrue(dead.unbound)
+        pool.checkin(con)
+
+        # Expired idle connections get evicted, but ``min_size`` connections
+        # are kept
+        pool.check_interval = None
+        pool.checkin(pool.checkout())
+        con1 = pool.checkout()
+        con2 = pool.checkout()
+        pool.checkin(con1)
+        pool.checkin(con2)
+        self.assertEqual(pool.idle, 2)
+        pool.idle_timeout = 0.01
+        pool.min_size = 1
+        time.sleep(0.02)
+        con = pool.checkout()
+        self.assertTrue(con1.unbound)
+        self.assertTrue(con is con2)
+        pool.checkin(con)
+
+        # Clear closes idle connections
+        pool.clear()
+        self.assertTrue(con2.unbound)
+        self.assertEqual(pool.idle, 0)
+
+        # Detached connections do not count against pool size
+        con1 = pool.checkout()
+        con2 = pool.checkout()
+        pool.detach(con1)
+        self.assertEqual((pool.idle, pool.used), (0, 1))
+        con3 = pool.checkout()
+        self.assertEqual((pool.idle, pool.used), (0, 2))
+
+        # Attached connections get closed if pool is full, otherwise they are
+        # kept as idle connections
+        pool.attach(con1)
+        self.assertTrue(con1.unbound)
+        pool.checkin(con2)
+        pool.detach(con3)
+        pool.attach(con3)
+        self.assertFalse(con3.unbound)
+        self.assertEqual((pool.idle, pool.used), (2, 0))
+        pool.clear()
+
+    def test_pooled_communicator(self):
+        props = LDAPProps(
+            uri=testing.SLAPDURIS,
+            user=user,
+            password=pwd,
+            cache=False,
+            pool_size=2,
+            pool_min_size=1,
+        )
+        connector = LDAPConnector(props=props)
+        pool = connector.pool
+        self.assertTrue(isinstance(pool, LDAPConnectionPool))
+        self.assertEqual(pool.size, 2)
+        self.assertEqual(pool.min_size, 1)
+
+        # Communicator draws connections from pool transparently
+        communicator = LDAPCommunicator(connector)
+        communicator.baseDN = 'dc=my-domain,dc=com'
+        res = communicator.search('(objectClass=*)', SUBTREE)
+        self.assertEqual(len(res), 7)
+        self.assertEqual((pool.idle, pool.used), (1, 0))
+        self.assertTrue(communicator._con is None)
+
+        entry = {
+            'cn': b'foo',
+            'sn': b'bar',
+            'objectclass': (b'person', b'top'),
+        }
+        dn = 'cn=foo,ou=customer1,ou=customers,dc=my-domain,dc=com'
+        communicator.add(dn, entry)
+        communicator.modify(dn, [(ldap.MOD_REPLACE, 'sn', b'baz')])
+        res = communicator.search('(cn=foo)', SUBTREE, attrlist=['sn'])
+        self.assertEqual(res, [(dn, {'sn': [b'baz']})])
+        communicator.delete(dn)
+        self.assertEqual(communicator.search('(cn=foo)', SUBTREE), [])
+        self.assertEqual((pool.idle, pool.used), (1, 0))
+
+        # Paged searches keep the connection they have been started on until
+        # the last page is fetched
+        res, cookie = communicator.search(
+            '(objectClass=*)',
+            SUBTREE,
+            page_size=4
+        )
+        self.assertEqual(len(res), 4)
+        pinned = communicator._paged[cookie][0]
+
+        # Pinned connection is detached from the pool, thus it does not block
+        # other consumers
+        self.assertEqual((pool.idle, pool.used), (0, 0))
+
+        # Pinned connection is not handed out to other consumers
+        other = pool.checkout()
+        self.assertFalse(other is pinned)
+
+        used = list()
+        search_ext = pinned.search_ext
+
+        def recording_search_ext(*args, **kw):
+            used.append(pinned)
+            return search_ext(*args, **kw)
+
+        pinned.search_ext = recording_search_ext
+        res, cookie = communicator.search(
+            '(objectClass=*)',
+            SUBTREE,
+            page_size=4,
+            cookie=cookie
+        )
+        del pinned.search_ext
+        pool.checkin(other)
+        self.assertEqual(len(res), 3)
+        self.assertEqual(cookie, b'')
+        self.assertEqual(used, [pinned])
+        self.assertEqual(communicator._paged, {})
+        self.assertEqual((pool.idle, pool.used), (2, 0))
+
+        # Connections of unfinished paged searches get handed back to the
+        # pool if released, which also happens on unbind
+        res, cookie = communicator.search(
+            '(objectClass=*)',
+            SUBTREE,
+            page_size=4
+        )
+        pinned = communicator._paged[cookie][0]
+        self.assertEqual((pool.idle, pool.used), (1, 0))
+        communicator.release_paged(cookie)
+        self.assertEqual(communicator._paged, {})
+        self.assertEqual((pool.idle, pool.used), (2, 0))
+        self.assertTrue(pool._idle[-1][0] is pinned)
+
+        # Connections of paged searches not continued within idle timeout get
+        # discarded by subsequent operations
+        res, cookie = communicator.search(
+            '(objectClass=*)',
+            SUBTREE,
+            page_size=4
+        )
+        pinned = communicator._paged[cookie][0]
+        pool.idle_timeout = 0
+        self.assertEqual(len(communicator.search('(objectClass=*)', BASE)), 1)
+        pool.idle_timeout = 300
+        self.assertEqual(communicator._paged, {})
+        self.assertFalse(pinned in [con for con, _ in pool._idle])
+
+        # Pool is used concurrently
+        results = list()
+
+        def search():
+            results.append(len(communicator.search('(objectClass=*)', SUBTREE)))
+
+        threads = [threading.Thread(target=search) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [7] * 10)
+        self.assertTrue(pool.idle <= 2)
+        self.assertEqual(pool.used, 0)
+
+        # Unbind closes idle connections
+        communicator.unbind()
+        self.assertEqual(pool.idle, 0)
+
+        # Pooling is disabled by default
+        connector = LDAPConnector(props=testing.props)
+        self.assertTrue(connector.pool is None)
+
+    def test_pooled_nested_access(self):
+        props = LDAPProps(
+            uri=testing.SLAPDURIS,
+            user=user,
+            password=pwd,
+            cache=False,
+            page_size=2,
+            pool_size=1,
+            pool_timeout=5,
+        )
+        node = LDAPNode('ou=customers,dc=my-domain,dc=com', props)
+        session = node.ldap_session
+        communicator = session._communicator
+        pool = communicator._connector.pool
+        keys = [
+            'ou=customer1',
+            'ou=customer2',
+            u'ou=n\xe4sty\\, customer',
+            'uid=binary'
+        ]
+
+        # Children are accessed while paged iteration is running. The
+        # connection pinned to the paged search does not occupy the only pool
+        # slot, otherwise ``LDAPPoolExhausted`` would be raised
+        iterated = list()
+        for key in node:
+            iterated.append(key)
+            self.assertEqual(node[key].name, key)
+        self.assertEqual(sorted(iterated), keys)
+        self.assertEqual(communicator._paged, {})
+        self.assertEqual(pool.used, 0)
+
+        # Nested paged iteration
+        for key in node:
+            self.assertEqual(sorted(node.keys()), keys)
+        self.assertEqual(communicator._paged, {})
+
+        # Stopping iteration early releases the pinned connection
+        for key in node:
+            break
+        self.assertEqual(communicator._paged, {})
+        self.assertEqual(pool.used, 0)
+        self.assertEqual(pool.idle, 1)
+
+        # Searches performed while streaming search results
+        found = list()
+        for dn, _ in session.iter_search(
+            scope=ONELEVEL,
+            baseDN=node.DN,
+            page_size=2
+        ):
+            found += session.search(scope=BASE, baseDN=dn)
+        self.assertEqual(len(found), 4)
+        self.assertEqual(pool.used, 0)
+
+        session.unbind()
+        self.assertEqual(pool.idle, 0)
+
+    def test_pooled_authentication(self):
+        props = LDAPProps(
+            uri=testing.SLAPDURIS,
+            user=user,
+            password=pwd,
+            cache=False,
+            auth_pool_size=2,
+            auth_pool_timeout=5,
+        )
+        connector = LDAPConnector(props=props)
+        auth_pool = connector.auth_pool
+        self.assertTrue(isinstance(auth_pool, LDAPConnectionPool))
+        self.assertEqual(auth_pool.size, 2)
+        self.assertEqual(auth_pool.checkout_timeout, 5)
+
+        # Credential checks reuse pooled bind-check connections
+        dn = 'uid=binary,ou=customers,dc=my-domain,dc=com'
+        self.assertTrue(connector.authenticate(dn, 'secret0'))
+        self.assertEqual((auth_pool.idle, auth_pool.used), (1, 0))
+        con = auth_pool._idle[-1][0]
+        self.assertFalse(
+            isinstance(con, ldap.ldapobject.ReconnectLDAPObject)
+        )
+        # Connection has been reset to anonymous
+        self.assertEqual(con.whoami_s(), '')
+
+        self.assertFalse(connector.authenticate(dn, 'invalid'))
+        self.assertEqual((auth_pool.idle, auth_pool.used), (1, 0))
+        self.assertTrue(auth_pool._idle[-1][0] is con)
+
+        # Connector itself is not bound by credential checks
+        self.assertTrue(connector._con is None)
+
+        # Concurrent credential checks are limited by pool size
+        results = list()
+
+        def authenticate():
+            results.append(connector.authenticate(dn, 'secret0'))
+
+        threads = [threading.Thread(target=authenticate) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [True] * 10)
+        self.assertTrue(auth_pool.idle <= 2)
+
+        connector.unbind()
+        self.assertEqual(auth_pool.idle, 0)
+
+        # Connections failing to reset to anonymous get discarded, the result
+        # of the credential check is returned anyway
+        failing = DummyConnection(rebind_fails=True)
+        auth_pool.factory = lambda: failing
+        self.assertTrue(connector.authenticate(dn, 'secret0'))
+        self.assertTrue(failing.unbound)
+        self.assertEqual((auth_pool.idle, auth_pool.used), (0, 0))
+
+        # Without auth pool, a new connection is used and closed per check
+        connector = LDAPConnector(props=testing.props)
+        self.assertTrue(connector.auth_pool is None)
+        self.assertTrue(connector.authenticate(dn, 'secret0'))
+        self.assertFalse(connector.authenticate(dn, 'invalid'))
@@ -55,3 +55,13 @@ class TestProperties(NodeTestCase):
         self.assertEqual(props.multivalued_attributes, MULTIVALUED_DEFAULTS)
         self.assertEqual(props.binary_attributes, BINARY_DEFAULTS)
         self.assertEqual(props.page_size, 1000)
+        self.assertEqual(props.pool_size, 0)
+        self.assertEqual(props.pool_min_size, 0)
+        self.assertEqual(props.pool_idle_timeout, 300)
+        self.assertEqual(props.pool_timeout, None)
+        self.assertEqual(props.pool_check_interval, 60)
+        self.assertEqual(props.auth_pool_size, 0)
+        self.assertEqual(props.auth_pool_timeout, None)
+        self.assertEqual(props.negative_timeout, None)
+        self.assertEqual(props.eager_attributes, None)
+        self.assertEqual(props.page_read_ahead, 0)
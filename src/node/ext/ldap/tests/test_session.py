@@ -1,10 +1,14 @@
 from ldap import MOD_REPLACE
+from node.ext.ldap import AsyncLDAPSession
 from node.ext.ldap import LDAPProps
 from node.ext.ldap import LDAPSession
 from node.ext.ldap import SUBTREE
 from node.ext.ldap import testing
 from node.ext.ldap.testing import props
 from node.tests import NodeTestCase
+import asyncio
+import ldap
+import types
 
 
 class TestSession(NodeTestCase):
@@ -100,3 +104,264 @@ class TestSession(NodeTestCase):
             'ctrls': [],
             'info': 'Transport endpoint is not connected'
         })
+
+    def test_multi_search(self):
+        session = LDAPSession(props)
+        session.baseDN = 'dc=my-domain,dc=com'
+        res = session.multi_search([
+            dict(baseDN='ou=customer1,ou=customers,dc=my-domain,dc=com'),
+            dict(
+                baseDN='ou=inexistent,dc=my-domain,dc=com',
+                attrlist=['ou']
+            ),
+            dict(
+                queryFilter='(|(ou=customer1)(ou=customer2))',
+                scope=SUBTREE,
+                attrlist=['ou']
+            ),
+            dict(baseDN='uid=binary,ou=customers,dc=my-domain,dc=com',
+                 attrlist=['cn'],
+                 attrsonly=True),
+        ])
+        self.assertEqual(len(res), 4)
+        self.assertEqual(res[0], [(
+            'ou=customer1,ou=customers,dc=my-domain,dc=com',
+            {
+                'objectClass': [b'top', b'organizationalUnit'],
+                'ou': [b'customer1'],
+                'description': [b'customer1'],
+                'businessCategory': [b'customers']
+            }
+        )])
+        self.assertEqual(res[1], [])
+        self.assertEqual(sorted(res[2]), [
+            ('ou=customer1,ou=customers,dc=my-domain,dc=com',
+             {'ou': [b'customer1']}),
+            ('ou=customer2,ou=customers,dc=my-domain,dc=com',
+             {'ou': [b'customer2']}),
+        ])
+        self.assertEqual(res[3], [(
+            'uid=binary,ou=customers,dc=my-domain,dc=com',
+            {'cn': []}
+        )])
+
+        # Pipeline window smaller than number of requests
+        requests = [
+            dict(baseDN='ou=customer{},ou=customers,dc=my-domain,dc=com'.format(
+                i % 3
+            ), attrlist=['ou'])
+            for i in range(10)
+        ]
+        res = session.multi_search(requests, window=2)
+        self.assertEqual([len(_) for _ in res], [0, 1, 1] * 3 + [0])
+        self.assertEqual(session.multi_search([]), [])
+        session.unbind()
+
+    def test_iter_search(self):
+        session = LDAPSession(props)
+        session.baseDN = 'dc=my-domain,dc=com'
+
+        # Results are yielded as they arrive
+        res = session.iter_search('(objectClass=*)', SUBTREE, attrlist=['ou'])
+        self.assertTrue(isinstance(res, types.GeneratorType))
+        res = sorted(res)
+        self.assertEqual(len(res), 7)
+        self.assertEqual(res, sorted(session.search(
+            '(objectClass=*)',
+            SUBTREE,
+            attrlist=['ou']
+        )))
+
+        # Pages are requested transparently
+        res = sorted(session.iter_search(scope=SUBTREE, page_size=2))
+        self.assertEqual(len(res), 7)
+
+        # Closing the generator abandons running search
+        res = session.iter_search(scope=SUBTREE, page_size=2)
+        next(res)
+        res.close()
+        self.assertEqual(len(session.search(scope=SUBTREE)), 7)
+
+        # Search on inexistent base
+        res = session.iter_search(baseDN='ou=inexistent,dc=my-domain,dc=com')
+        self.expectError(ldap.NO_SUCH_OBJECT, list, res)
+        session.unbind()
+
+    def test_count(self):
+        session = LDAPSession(props)
+        session.baseDN = 'dc=my-domain,dc=com'
+        self.assertEqual(session.count(scope=SUBTREE), 7)
+        self.assertEqual(
+            session.count('(objectClass=organizationalUnit)', SUBTREE),
+            5
+        )
+
+        # Counting stops at size limit
+        self.assertEqual(session.count(scope=SUBTREE, size_limit=3), 3)
+        self.assertEqual(session.count(scope=SUBTREE, size_limit=10), 7)
+        self.assertEqual(session.count(scope=SUBTREE, size_limit=0), 0)
+
+        # Test server does not support virtual list view, entries get counted
+        # client side
+        self.assertEqual(session.count(scope=SUBTREE, sort_key='cn'), 7)
+
+        # Failing virtual list view search falls back to client side counting
+        communicator = session._communicator
+        communicator._server_sorting = lambda *args: True
+        self.assertEqual(session.count(scope=SUBTREE, sort_key='cn'), 7)
+        del communicator._server_sorting
+
+        # Paged counting
+        self.assertEqual(
+            communicator.count('(objectClass=*)', SUBTREE, page_size=2),
+            7
+        )
+
+        # Count on inexistent base
+        self.expectError(
+            ldap.NO_SUCH_OBJECT,
+            session.count,
+            baseDN='ou=inexistent,dc=my-domain,dc=com'
+        )
+        session.unbind()
+
+    def test_async_session(self):
+        session = AsyncLDAPSession(props)
+        self.assertEqual(session.checkServerProperties(), (True, 'OK'))
+        session.baseDN = 'dc=my-domain,dc=com'
+
+        async def run():
+            # Search
+            res = await session.search('(objectClass=*)', SUBTREE)
+            self.assertEqual(len(res), 7)
+
+            # Paged search
+            res, cookie = await session.search(
+                '(objectClass=*)',
+                SUBTREE,
+                page_size=4
+            )
+            self.assertEqual(len(res), 4)
+            res, cookie = await session.search(
+                '(objectClass=*)',
+                SUBTREE,
+                page_size=4,
+                cookie=cookie
+            )
+            self.assertEqual(len(res), 3)
+            self.assertEqual(cookie, b'')
+
+            # Many searches in flight at once
+            res = await asyncio.gather(*[
+                session.search('(objectClass=*)', SUBTREE) for _ in range(50)
+            ])
+            self.assertEqual([len(_) for _ in res], [7] * 50)
+
+            # Add, modify and delete
+            dn = 'cn=foo,ou=customer1,ou=customers,dc=my-domain,dc=com'
+            await session.add(dn, {
+                'cn': b'foo',
+                'sn': b'bar',
+                'objectclass': (b'person', b'top'),
+            })
+            await session.modify(dn, [(MOD_REPLACE, 'sn', b'baz')])
+            res = await session.search(
+                '(cn=foo)',
+                SUBTREE,
+                attrlist=['sn']
+            )
+            self.assertEqual(res, [(dn, {'sn': [b'baz']})])
+
+            # Errors are raised
+            with self.assertRaises(ldap.ALREADY_EXISTS):
+                await session.add(dn, {
+                    'cn': b'foo',
+                    'sn': b'bar',
+                    'objectclass': (b'person', b'top'),
+                })
+
+            await session.delete(dn)
+            res = await session.search('(cn=foo)', SUBTREE)
+            self.assertEqual(res, [])
+
+            with self.assertRaises(ldap.NO_SUCH_OBJECT):
+                await session.delete(dn)
+
+            # Authenticate
+            dn = 'uid=binary,ou=customers,dc=my-domain,dc=com'
+            self.assertTrue(await session.authenticate(dn, 'secret0'))
+            self.assertFalse(await session.authenticate(dn, 'invalid'))
+
+            # Change password
+            await session.passwd(dn, 'secret0', 'secret1')
+            self.assertTrue(await session.authenticate(dn, 'secret1'))
+            await session.passwd(dn, 'secret1', 'secret0')
+
+        asyncio.run(run())
+        session.unbind()
+
+        # Authenticate with pooled bind-check connections
+        session = AsyncLDAPSession(LDAPProps(
+            uri=props.uri,
+            user=props.user,
+            password=props.password,
+            cache=False,
+            auth_pool_size=2
+        ))
+        dn = 'uid=binary,ou=customers,dc=my-domain,dc=com'
+
+        async def authenticate():
+            return await asyncio.gather(*[
+                session.authenticate(dn, 'secret0') for _ in range(10)
+            ])
+
+        self.assertEqual(asyncio.run(authenticate()), [True] * 10)
+        auth_pool = session._communicator._connector.auth_pool
+        self.assertEqual(auth_pool.used, 0)
+        self.assertTrue(auth_pool.idle <= 2)
+        session.unbind()
+
+        # Operations use pooled connections if pooling is enabled
+        session = AsyncLDAPSession(LDAPProps(
+            uri=props.uri,
+            user=props.user,
+            password=props.password,
+            cache=False,
+            pool_size=2
+        ))
+        session.baseDN = 'dc=my-domain,dc=com'
+        communicator = session._communicator
+        pool = communicator._connector.pool
+
+        async def pooled():
+            res = await asyncio.gather(*[
+                session.search('(objectClass=*)', SUBTREE) for _ in range(10)
+            ])
+            self.assertEqual([len(_) for _ in res], [7] * 10)
+            self.assertEqual(pool.used, 0)
+
+            # Paged searches keep their pooled connection
+            res, cookie = await session.search(
+                '(objectClass=*)',
+                SUBTREE,
+                page_size=4
+            )
+            self.assertEqual(len(res), 4)
+            pinned = communicator._paged[cookie][0]
+            other = pool.checkout()
+            self.assertFalse(other is pinned)
+            res, cookie = await session.search(
+                '(objectClass=*)',
+                SUBTREE,
+                page_size=4,
+                cookie=cookie
+            )
+            self.assertEqual(len(res), 3)
+            self.assertEqual(communicator._paged, {})
+            self.assertTrue(pool._idle[-1][0] is pinned)
+            pool.checkin(other)
+
+        asyncio.run(pooled())
+        self.assertTrue(communicator._con is None)
+        session.unbind()
+        self.assertEqual(pool.idle, 0)
@@ -5,6 +5,8 @@ from node.ext.ldap.ugm import Ugm
 from node.ext.ldap.ugm import User
 from node.ext.ldap.ugm import Users
 from node.ext.ldap.ugm._api import PrincipalAliasedAttributes
+from node.ext.ldap.ugm.membership import MembershipIndex
+from node.ext.ldap.ugm.nesting import GroupGraph
 from node.tests import NodeTestCase
 import ldap
 
@@ -387,6 +389,74 @@ class TestUGMGroupOfNames(NodeTestCase):
               <class 'node.ext.ldap.ugm._api.User'>: uid2
         """, ugm.treerepr())
 
+    @group_of_names_ugm
+    def test_membership_index(self, ugm):
+        # Memberships resolved by searching the directory
+        self.assertIsNone(ugm.groups.membership_index)
+        users = ugm.users
+        groups = ugm.groups
+        group_ids = dict([(uid, users[uid].group_ids) for uid in users])
+        member_ids = dict([(gid, groups[gid].member_ids) for gid in groups])
+
+        # Enable membership index
+        ugm.gcfg.membershipIndex = True
+        try:
+            ugm = create_ugm()
+            users = ugm.users
+            groups = ugm.groups
+            index = groups.membership_index
+            self.assertTrue(isinstance(index, MembershipIndex))
+
+            # Index is shared within the process
+            self.assertTrue(create_ugm().groups.membership_index is index)
+
+            # Record scans of groups container
+            scans = list()
+            scan = index._scan
+
+            def recording_scan(queryFilter=None):
+                scans.append(queryFilter)
+                scan(queryFilter)
+
+            index._scan = recording_scan
+
+            # Memberships are resolved from index, which gets built once
+            for uid in users:
+                self.assertEqual(users[uid].group_ids, group_ids[uid])
+            for gid in groups:
+                self.assertEqual(groups[gid].member_ids, member_ids[gid])
+            self.assertEqual(scans, [None])
+
+            # Index is not consulted while groups contain unpersisted changes
+            group = groups['group0']
+            group.add('uid0')
+            self.assertEqual(users['uid0'].group_ids, group_ids['uid0'])
+            self.assertEqual(len(scans), 1)
+
+            # Persisting changes refreshes index on next access with entries
+            # changed since last scan
+            group()
+            self.assertEqual(
+                users['uid0'].group_ids,
+                group_ids['uid0'] + [u'group0']
+            )
+            self.assertEqual(len(scans), 2)
+            self.assertTrue(scans[1].startswith('(modifyTimestamp>='))
+            self.assertTrue(u'uid0' in groups['group0'].member_ids)
+
+            del group['uid0']
+            self.assertEqual(users['uid0'].group_ids, group_ids['uid0'])
+            self.assertFalse(u'uid0' in groups['group0'].member_ids)
+
+            # Index gets rebuilt if entries were removed by other clients
+            index._members[u'removed'] = [u'cn=foo']
+            index.refresh()
+            self.assertTrue(scans[-2].startswith('(modifyTimestamp>='))
+            self.assertEqual(scans[-1], None)
+            self.assertFalse(u'removed' in index._members)
+        finally:
+            ugm.gcfg.membershipIndex = False
+
     @group_of_names_ugm
     def test_member_of_support(self, ugm):
         users = ugm.users
@@ -443,3 +513,96 @@ class TestUGMGroupOfNames(NodeTestCase):
 
         ugm.ucfg.memberOfSupport = False
         ugm.gcfg.memberOfSupport = False
+
+    @group_of_names_ugm
+    def test_nested_groups(self, ugm):
+        groups = ugm.groups
+        self.assertTrue(groups.group_graph is None)
+
+        # Nest groups with a cycle. group0 contains group1, group1 contains
+        # group2 and group2 contains group0
+        nesting = [
+            ('group0', 'group1'),
+            ('group1', 'group2'),
+            ('group2', 'group0')
+        ]
+        for gid, nested_gid in nesting:
+            context = groups[gid].context
+            context.attrs['member'] = context.attrs['member'] + [
+                groups[nested_gid].context.DN
+            ]
+            context()
+
+        ugm.gcfg.nestedGroups = True
+        try:
+            ugm = create_ugm()
+            users = ugm.users
+            groups = ugm.groups
+            graph = groups.group_graph
+            self.assertTrue(isinstance(graph, GroupGraph))
+
+            # Groups are resolved transitively ordered by nesting level
+            self.assertEqual(
+                users['uid2'].group_ids,
+                [u'group2', u'group1', u'group0']
+            )
+            self.assertEqual(
+                users['uid1'].group_ids,
+                [u'group1', u'group2', u'group0']
+            )
+            self.assertEqual(groups['group0'].member_ids, [u'uid1', u'uid2'])
+            self.assertTrue(u'uid2' in groups['group0'])
+            self.assertTrue(users['uid2'] is groups['group0']['uid2'])
+
+            # Members of nested groups cannot be removed
+            self.expectError(KeyError, groups['group0'].__delitem__, 'uid2')
+
+            # Expansion stops at depth limit
+            graph.max_depth = 1
+            self.assertEqual(users['uid2'].group_ids, [u'group2'])
+            self.assertEqual(groups['group0'].member_ids, [])
+            self.assertFalse(u'uid2' in groups['group0'])
+            graph.max_depth = 10
+
+            # Graph gets invalidated on group modification
+            self.assertTrue(len(graph._parents) > 0)
+            group = groups['group0']
+            group.add('uid0')
+            self.assertEqual(graph._parents, {})
+            self.assertEqual(graph._groups, {})
+            group()
+            self.assertEqual(
+                users['uid0'].group_ids,
+                [u'group0', u'group2', u'group1']
+            )
+            del group['uid0']
+            self.assertEqual(users['uid0'].group_ids, [])
+
+            # Cached memberships expire after interval
+            self.assertEqual(graph.interval, 30)
+            self.assertTrue(len(graph._parents) > 0)
+            uid0 = graph.normalize(users['uid0'].context.DN)
+            self.assertTrue(uid0 in graph._parents)
+            graph._stamp -= 30
+            self.assertEqual(
+                users['uid1'].group_ids,
+                [u'group1', u'group2', u'group0']
+            )
+            self.assertFalse(uid0 in graph._parents)
+
+            # With interval 0 memberships are cached only during a lookup
+            graph.interval = 0
+            self.assertEqual(groups['group0'].member_ids, [u'uid1', u'uid2'])
+            self.assertEqual(users['uid0'].group_ids, [])
+            self.assertEqual(graph._groups, {})
+        finally:
+            ugm.gcfg.nestedGroups = False
+            groups = create_ugm().groups
+            for gid, nested_gid in nesting:
+                context = groups[gid].context
+                nested_dn = groups[nested_gid].context.DN
+                context.attrs['member'] = [
+                    member for member in context.attrs['member']
+                    if member != nested_dn
+                ]
+                context()
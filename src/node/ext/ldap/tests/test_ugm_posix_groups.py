@@ -518,6 +518,12 @@ class TestUGMPosixGroups(NodeTestCase):
         group = ugm.groups['group0']
         self.assertEqual(group.keys(), ['uid0'])
 
+        # Membership is checked against member attribute and existence
+        # of the principal
+        self.assertTrue('uid0' in group)
+        self.assertFalse('uid1' in group)
+        self.assertFalse('inexistent' in group)
+
         node.attrs['memberUid'] = ['uid0']
         node()
 
@@ -91,6 +91,21 @@ class TestUGMPrincipals(NodeTestCase):
             "'cN=inexistent, ou=customers,dc=MY-domain,dc= com'"
         )
 
+        # Principals ids_by_dns. Inexistent DNs are skipped
+        self.assertEqual(users.ids_by_dns([
+            'cn=user3,ou=customers,dc=my-domain,dc=com',
+            'cN=inexistent, ou=customers,dc=MY-domain,dc= com',
+            'cn=user1,dc=my-domain,dc=com',
+            'cN=user2, ou=customers,dc=MY-domain,dc= com',
+        ]), [u'Schmidt', u'Meier', u'Müller'])
+        self.assertEqual(users.ids_by_dns([]), [])
+        self.assertEqual(users.ids_by_dns([
+            'cn=user3,ou=customers,dc=my-domain,dc=com',
+            'cn=user1,dc=my-domain,dc=com',
+            'cn=user2,ou=customers,dc=my-domain,dc=com',
+            'invalid',
+        ], chunk_size=1), [u'Schmidt', u'Meier', u'Müller'])
+
         # Get a user by id (utf-8 or unicode)
         mueller = users[u'Müller']
         self.assertTrue(isinstance(mueller, User))
@@ -347,6 +362,41 @@ class TestUGMPrincipals(NodeTestCase):
         self.assertEqual(results, [u'Umhauer'])
         self.assertEqual(cookie, b'')
 
+        # Search results can be sorted and windowed. Sort keys refer to aliased
+        # attribute names, ``-`` prefix requests descending order
+        self.assertEqual(
+            users.search(sort_keys=['-login']),
+            [u'Schmidt', u'Müller', u'Meier', u'Umhauer']
+        )
+        self.assertEqual(
+            users.search(sort_keys=['-login'], offset=1, count=2),
+            [u'Müller', u'Meier']
+        )
+        self.assertEqual(
+            users.search(attrlist=['login'], sort_keys=['login'], count=1),
+            [(u'Umhauer', {'login': [u'nästy, User']})]
+        )
+        self.assertEqual(
+            users.raw_search(sort_keys=['login'], offset=3),
+            [u'Schmidt']
+        )
+
+        # Large value sets are searched in chunks
+        self.assertEqual(
+            users.raw_search(
+                match_attr='login',
+                match_values=['user1', 'user3', 'user3', 'inexistent'],
+                chunk_size=1
+            ),
+            [u'Meier', u'Schmidt']
+        )
+
+        # Count principals without fetching them
+        self.assertEqual(users.count(), 4)
+        self.assertEqual(users.count(criteria=dict(login='user*')), 3)
+        self.assertEqual(users.count(size_limit=2), 2)
+        self.assertEqual(len(users), 4)
+
         # Only attributes defined in attrmap can be queried
         self.expectError(
             KeyError,
@@ -632,7 +682,23 @@ class TestUGMPrincipals(NodeTestCase):
         # Add and remove user from group
         group = ugm.groups['group1']
         self.assertEqual(group.member_ids, [u'Schmidt', u'Müller'])
+
+        # Members are validated by searching the candidate ids only
+        self.assertEqual(
+            ugm.users.existing_ids([u'Schmidt', u'Umhauer', u'inexistent']),
+            set([u'Schmidt', u'Umhauer'])
+        )
+        self.assertEqual(
+            group.existing_members([u'Müller', u'inexistent']),
+            set([u'Müller'])
+        )
+
+        # Membership is checked by translating the key to the member DN
+        self.assertTrue(u'Schmidt' in group)
+        self.assertFalse(u'Umhauer' in group)
+        self.assertFalse(u'inexistent' in group)
         self.assertEqual(
+            group.translate_key('Umhauer'),
             group.translate_key('Umhauer'),
             u'cn=nästy\\, User,ou=customers,dc=my-domain,dc=com'
         )
@@ -750,6 +816,10 @@ class TestUGMPrincipals(NodeTestCase):
         # Query roles for principal via ugm object.
         self.assertEqual(ugm.roles(user), ['viewer'])
 
+        # Roles are searched by member attribute if roles are unchanged.
+        self.assertEqual(roles.ids_by_member(user.context.DN), [u'viewer'])
+        self.assertEqual(roles.ids_by_member('cn=*,dc=my-domain,dc=com'), [])
+
         # Query roles for principal directly.
         self.assertEqual(user.roles, ['viewer'])
 
@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 from datetime import datetime
+from ldap.dn import dn2str
 from ldap.dn import explode_dn
+from ldap.dn import str2dn
+from ldap.filter import escape_filter_chars
 from node.behaviors import Alias
 from node.behaviors import Attributes
 from node.behaviors import DefaultInit
@@ -12,8 +15,11 @@ from node.behaviors import OdictStorage
 from node.behaviors.alias import DictAliaser
 from node.ext.ldap._node import LDAPNode
 from node.ext.ldap.base import ensure_text
+from node.ext.ldap.base import normalize_dn
+from node.ext.ldap.filter import equality_filter
 from node.ext.ldap.interfaces import ILDAPGroupsConfig as IGroupsConfig
 from node.ext.ldap.interfaces import ILDAPUsersConfig as IUsersConfig
+from node.ext.ldap.paging import iter_pages
 from node.ext.ldap.scope import BASE
 from node.ext.ldap.scope import ONELEVEL
 from node.ext.ldap.ugm.defaults import creation_defaults
@@ -21,6 +27,11 @@ from node.ext.ldap.ugm.expires import AccountExpiration
 from node.ext.ldap.ugm.expires import EXPIRATION_DAYS
 from node.ext.ldap.ugm.expires import EXPIRATION_SECONDS  # noqa
 from node.ext.ldap.ugm.expires import account_expiration
+from node.ext.ldap.ugm.membership import FORMAT_DN
+from node.ext.ldap.ugm.membership import FORMAT_UID
+from node.ext.ldap.ugm.membership import get_membership_index
+from node.ext.ldap.ugm.membership import normalize_member
+from node.ext.ldap.ugm.nesting import GroupGraph
 from node.ext.ldap.ugm.samba import sambaLMPassword
 from node.ext.ldap.ugm.samba import sambaNTPassword
 from node.ext.ugm import Group as UgmGroup
@@ -45,10 +56,6 @@ import time
 
 logger = logging.getLogger('node.ext.ldap')
 
-# group member format
-FORMAT_DN = 0
-FORMAT_UID = 1
-
 # mapping from object-class to properties
 MEMBER_LOOKUP_BY_CLASS = {
     'groupOfNames': {
@@ -85,7 +92,13 @@ class PrincipalsConfig(object):
         recursiveGroups=False,
         memberOfExternalGroupDNs=[],
         expiresAttr=None,
-        expiresUnit=EXPIRATION_DAYS
+        expiresUnit=EXPIRATION_DAYS,
+        membershipIndex=False,
+        membershipIndexInterval=30,
+        membershipIndexAttr='modifyTimestamp',
+        nestedGroups=False,
+        nestedGroupsDepth=10,
+        nestedGroupsInterval=30
     ):
         self.baseDN = baseDN
         self.attrmap = attrmap
@@ -105,6 +118,18 @@ class PrincipalsConfig(object):
         self.expiresAttr = expiresAttr
         self.expiresUnit = expiresUnit
 
+        # Membership index related settings only get considered for groups
+        # and roles
+        self.membershipIndex = membershipIndex
+        self.membershipIndexInterval = membershipIndexInterval
+        self.membershipIndexAttr = membershipIndexAttr
+
+        # Nested groups related settings only get considered for groups and
+        # roles
+        self.nestedGroups = nestedGroups
+        self.nestedGroupsDepth = nestedGroupsDepth
+        self.nestedGroupsInterval = nestedGroupsInterval
+
 
 @implementer(IUsersConfig)
 class UsersConfig(PrincipalsConfig):
@@ -266,14 +291,22 @@ class LDAPUser(LDAPPrincipal, UgmUser):
         else:
             member_format = groups._member_format
             attribute = groups._member_attribute
+            if member_format == FORMAT_DN:
+                member = self.context.DN
+            elif member_format == FORMAT_UID:
+                member = self.context.attrs['uid']
+            recursive = self.parent.parent.ucfg.recursiveGroups
+            graph = groups.group_graph
+            if graph is not None and not recursive and not groups.changed:
+                return graph.group_ids(member)
+            index = groups.membership_index
+            if index is not None and not recursive and not groups.changed:
+                return index.group_ids(member)
             # Support LDAP_MATCHING_RULE_IN_CHAIN (recursive/nested groups)
             # See https://msdn.microsoft.com/en-us/library/aa746475(v=vs.85).aspx
-            if self.parent.parent.ucfg.recursiveGroups:
+            if recursive:
                 attribute += ':1.2.840.113556.1.4.1941:'
-            if member_format == FORMAT_DN:
-                criteria = {attribute: self.context.DN}
-            elif member_format == FORMAT_UID:
-                criteria = {attribute: self.context.attrs['uid']}
+            criteria = {attribute: member}
             attrlist = [groups._key_attr]
             # if roles configuration points to child of groups container, and
             # group configuration has search scope SUBTREE, and groups are
@@ -338,13 +371,10 @@ class LDAPGroupMapping(Behavior):
             val = self.related_principals(key)[key].context.DN
         elif self._member_format == FORMAT_UID:
             val = key
-        # self.context.attrs[self._member_attribute].remove won't work here
-        # issue in LDAPNodeAttributes, does not recognize changed this way.
-        members = self.context.attrs[self._member_attribute]
-        members.remove(val)
-        self.context.attrs[self._member_attribute] = members
+        self._remove_member(key, val)
         # XXX: call here immediately?
         self.context()
+        self._memberships_changed()
 
     @override
     def __iter__(self):
@@ -352,54 +382,123 @@ class LDAPGroupMapping(Behavior):
 
     @override
     def __contains__(self, key):
-        key = ensure_text(key)
-        for uid in self:
-            if uid == key:
-                return True
-        return False
+        return self._is_member(key, self._nested_member_values)
 
     @default
     @locktree
     def add(self, key):
         key = ensure_text(key)
-        if key not in self.member_ids:
+        if not self._is_member(key, self._member_values):
             val = self.translate_key(key)
             # self.context.attrs[self._member_attribute].append won't work here
             # issue in LDAPNodeAttributes, does not recognize changed this way.
             old = self.context.attrs.get(self._member_attribute, list())
             self.context.attrs[self._member_attribute] = old + [val]
+            self._memberships_changed()
             # XXX: call here immediately?
             # self.context()
 
+    @default
+    def _is_member(self, key, member_values):
+        # check whether key is contained in member values
+        key = ensure_text(key)
+        if self._member_of_support:
+            return key in set(self.member_ids)
+        members = set([
+            normalize_member(member, self._member_format)
+            for member in member_values
+        ])
+        if self._member_format == FORMAT_DN:
+            try:
+                val = self.translate_key(key)
+            except KeyError:
+                return False
+            return normalize_member(val, FORMAT_DN) in members
+        if key not in members:
+            return False
+        return key in self.existing_members([key])
+
+    @default
+    def _remove_member(self, key, val):
+        # remove member value from member attribute. Members of nested groups
+        # are not contained and cannot be removed.
+        # self.context.attrs[self._member_attribute].remove won't work here
+        # issue in LDAPNodeAttributes, does not recognize changed this way.
+        members = self.context.attrs[self._member_attribute]
+        val = normalize_member(val, self._member_format)
+        remaining = [
+            member for member in members
+            if normalize_member(member, self._member_format) != val
+        ]
+        if len(remaining) == len(members):
+            raise KeyError(key)
+        self.context.attrs[self._member_attribute] = remaining
+
+    @plumb
+    def __call__(_next, self):
+        _next(self)
+        self._memberships_changed()
+
     @default
     @property
     def member_ids(self):
-        ugm = self.parent.parent
-        if ugm:
-            # XXX: roles with memberOf use rcfg!
-            gcfg = ugm.gcfg
-            if gcfg and gcfg.memberOfSupport:
-                users = ugm.users
-                criteria = {'memberOf': self.context.DN}
-                attrlist = [users._key_attr]
-                matches_generator = users.context.batched_search(
-                    criteria=criteria,
-                    attrlist=attrlist
-                )
-                return [
-                    att[users._key_attr][0] for _, att in matches_generator
-                ]
+        if self._member_of_support:
+            users = self.parent.parent.users
+            criteria = {'memberOf': self.context.DN}
+            attrlist = [users._key_attr]
+            matches_generator = users.context.batched_search(
+                criteria=criteria,
+                attrlist=attrlist
+            )
+            return [
+                att[users._key_attr][0] for _, att in matches_generator
+            ]
         ret = list()
-        members = self.context.attrs.get(self._member_attribute, list())
-        for member in members:
+        for member in self._nested_member_values:
             if member in ['nobody', 'cn=nobody']:
                 continue
             ret.append(member)
         ret = self.translate_ids(ret)
-        keys = self.existing_member_ids
-        ret = [uid for uid in ret if uid in keys]
+        existing = self.existing_members(ret)
+        ret = [uid for uid in ret if uid in existing]
         return ret
 
+    @default
+    @property
+    def _member_of_support(self):
+        ugm = self.parent.parent
+        # XXX: roles with memberOf use rcfg!
+        return bool(ugm and ugm.gcfg and ugm.gcfg.memberOfSupport)
+
+    @default
+    @property
+    def _member_values(self):
+        # raw member attribute values, taken from membership index if
+        # groups are unchanged
+        groups = self.parent
+        index = groups.membership_index if groups is not None else None
+        if index is not None and not groups.changed:
+            try:
+                return index.members(self.name)
+            except KeyError:
+                pass
+        return self.context.attrs.get(self._member_attribute, list())
+
+    @default
+    @property
+    def _nested_member_values(self):
+        # member values including members of nested groups if nested groups
+        # are enabled and groups are unchanged
+        groups = self.parent
+        graph = groups.group_graph if groups is not None else None
+        if graph is None or groups.changed:
+            return self._member_values
+        if self._member_format == FORMAT_DN:
+            group = self.context.DN
+        else:
+            group = self.name
+        return graph.members(group, self._member_values)
+
     @default
     @property
     def _member_format(self):
@@ -410,6 +509,12 @@ class LDAPGroupMapping(Behavior):
     def _member_attribute(self):
         return self.parent._member_attribute
 
+    @default
+    def _memberships_changed(self):
+        principals = self.parent
+        if principals is not None:
+            principals._memberships_changed()
+
 
 class LDAPGroup(LDAPGroupMapping, LDAPPrincipal, UgmGroup):
 
@@ -427,19 +532,15 @@ class LDAPGroup(LDAPGroupMapping, LDAPPrincipal, UgmGroup):
     def existing_member_ids(self):
         return self.related_principals().keys()
 
+    @default
+    def existing_members(self, ids):
+        return self.related_principals().existing_ids(ids)
+
     @default
     def translate_ids(self, members):
         if self._member_format != FORMAT_DN:
             return members
-        principals = self.related_principals()
-        translated = list()
-        for dn in members:
-            try:
-                translated.append(principals.idbydn(dn))
-            except KeyError:
-                # inexistent DN
-                pass
-        return translated
+        return self.related_principals().ids_by_dns(members)
 
     @default
     def translate_key(self, key):
@@ -523,6 +624,110 @@ class LDAPPrincipals(OdictStorage):
         except ldap.NO_SUCH_OBJECT:
             raise KeyError(dn)
 
+    @default
+    def ids_by_dns(self, dns, chunk_size=100):
+        """Return principal ids for given DNs.
+
+        Principals already loaded are looked up in storage. Remaining DNs
+        get grouped by parent DN and RDN attribute and are resolved with
+        pipelined ``ONELEVEL`` searches using chunked OR filters on the RDN
+        attribute. DNs which not exist or do not contain the key attribute
+        are skipped.
+
+        :param dns: List of principal DNs.
+        :param chunk_size: Maximum number of RDN values per search filter.
+        :return: List of principal ids in order of ``dns``.
+        """
+        resolved = dict()
+        for key, principal in self.storage.items():
+            resolved[normalize_dn(principal.context.DN)] = key
+        normalized = list()
+        containers = dict()
+        requests = list()
+        for dn in dns:
+            try:
+                ndn = normalize_dn(dn)
+                rdns = str2dn(dn)
+            except ldap.DECODING_ERROR:
+                continue
+            normalized.append(ndn)
+            if ndn in resolved or not rdns:
+                continue
+            if len(rdns[0]) > 1:
+                # multi valued RDN, lookup entry directly
+                requests.append(dict(baseDN=dn, attrlist=[self._key_attr]))
+                continue
+            attr, value, _ = rdns[0][0]
+            container = (normalize_dn(dn2str(rdns[1:])), attr.lower())
+            if container not in containers:
+                containers[container] = (dn2str(rdns[1:]), attr, list())
+            values = containers[container][2]
+            if value not in values:
+                values.append(value)
+        for parent, attr, values in containers.values():
+            for i in range(0, len(values), chunk_size):
+                query = '(|{})'.format(''.join([
+                    '({}={})'.format(attr, escape_filter_chars(value))
+                    for value in values[i:i + chunk_size]
+                ]))
+                requests.append(dict(
+                    baseDN=parent,
+                    queryFilter=query,
+                    scope=ONELEVEL,
+                    attrlist=[self._key_attr]
+                ))
+        if requests:
+            session = self.context.ldap_session
+            for res in session.multi_search(requests):
+                for dn, attrs in res:
+                    try:
+                        key = ensure_text(attrs[self._key_attr][0])
+                    except (IndexError, KeyError):
+                        continue
+                    resolved[normalize_dn(dn)] = key
+        return [resolved[ndn] for ndn in normalized if ndn in resolved]
+
+    @default
+    def existing_ids(self, ids, chunk_size=100):
+        """Return the set of principal ids which exist out of given ids.
+
+        Principals already loaded are looked up in storage, remaining ids are
+        checked with chunked searches on the key attribute, thus principals
+        not contained in ``ids`` are never fetched.
+
+        :param ids: Iterable of principal ids.
+        :param chunk_size: Maximum number of ids per search filter.
+        :return: Set of existing principal ids.
+        """
+        existing = set()
+        remaining = list()
+        for key in ids:
+            key = ensure_text(key)
+            if key in self.storage:
+                existing.add(key)
+            else:
+                remaining.append(key)
+        if not remaining:
+            return existing
+        requested = set(remaining)
+        context = self.context
+        matches = context.search(
+            attrlist=['rdn', self._key_attr],
+            match_attr=self._key_attr,
+            match_values=remaining,
+            chunk_size=chunk_size
+        )
+        for _, attrs in matches:
+            if attrs['rdn'] in context._deleted_children:
+                continue
+            try:
+                key = ensure_text(attrs[self._key_attr][0])
+            except (IndexError, KeyError):
+                continue
+            if key in requested:
+                existing.add(key)
+        return existing
+
     @override
     @property
     def ids(self):
@@ -651,13 +856,31 @@ class LDAPPrincipals(OdictStorage):
             [(unalias(key), val) for key, val in six.iteritems(dct)])
         return unaliased_dct
 
+    @default
+    def _unalias_sort_keys(self, sort_keys):
+        # unalias attribute names of sort keys, keep order prefix and
+        # ordering rule
+        if not sort_keys:
+            return None
+        unalias = self.principal_attraliaser.unalias
+        unaliased = list()
+        for sort_key in sort_keys:
+            prefix = u'-' if sort_key.startswith('-') else u''
+            attr, sep, rule = sort_key.lstrip('-').partition(':')
+            unaliased.append(prefix + unalias(attr) + sep + rule)
+        return unaliased
+
     @default
     def raw_search(self, criteria=None, attrlist=None,
                    exact_match=False, or_search=False, or_keys=None,
-                   or_values=None, page_size=None, cookie=None):
+                   or_values=None, page_size=None, cookie=None,
+                   sort_keys=None, offset=0, count=None, match_attr=None,
+                   match_values=None, chunk_size=100):
         search_attrlist = [self._key_attr]
         if attrlist is not None and self._key_attr not in attrlist:
             search_attrlist += attrlist
+        if match_attr is not None:
+            match_attr = self.principal_attraliaser.unalias(match_attr)
         try:
             results = self.context.search(
                 criteria=self._unalias_dict(criteria),
@@ -667,7 +890,13 @@ class LDAPPrincipals(OdictStorage):
                 or_keys=or_keys,
                 or_values=or_values,
                 page_size=page_size,
-                cookie=cookie
+                cookie=cookie,
+                sort_keys=self._unalias_sort_keys(sort_keys),
+                offset=offset,
+                count=count,
+                match_attr=match_attr,
+                match_values=match_values,
+                chunk_size=chunk_size
             )
         except ldap.NO_SUCH_OBJECT:  # pragma: no cover
             logger.debug("LDAPPrincipals.raw_search: ldap.NO_SUCH_OBJECT")
@@ -695,23 +924,69 @@ class LDAPPrincipals(OdictStorage):
 
     @default
     def search(self, criteria=None, attrlist=None,
-               exact_match=False, or_search=False):
-        result = []
-        cookie = ''
-        while True:
-            chunk, cookie = self.raw_search(
+               exact_match=False, or_search=False, sort_keys=None,
+               offset=0, count=None):
+        # result window is requested at once
+        if offset or count is not None:
+            return self.raw_search(
                 criteria=criteria,
                 attrlist=attrlist,
                 exact_match=exact_match,
                 or_search=or_search,
-                page_size=self.context.ldap_session._props.page_size,
-                cookie=cookie
+                sort_keys=sort_keys,
+                offset=offset,
+                count=count
             )
+        props = self.context.ldap_session._props
+
+        def search_page(cookie):
+            return self.raw_search(
+                criteria=criteria,
+                attrlist=attrlist,
+                exact_match=exact_match,
+                or_search=or_search,
+                page_size=props.page_size,
+                cookie=cookie,
+                sort_keys=sort_keys
+            )
+
+        result = []
+        read_ahead = getattr(props, 'page_read_ahead', 0)
+        pages = iter_pages(
+            search_page,
+            read_ahead,
+            release=self.context.ldap_session.release_paged
+        )
+        for chunk in pages:
             result += chunk
-            if not cookie:
-                break
         return result
 
+    @default
+    def count(self, criteria=None, or_search=False, size_limit=None):
+        """Return number of principals matching criteria.
+
+        :param criteria: Dict of aliased attribute names and values.
+        :param or_search: Flag whether criteria should be OR-ed.
+        :param size_limit: Maximum number to count.
+        """
+        try:
+            return self.context.count(
+                criteria=self._unalias_dict(criteria),
+                or_search=or_search,
+                sort_key=self._key_attr,
+                size_limit=size_limit
+            )
+        except ldap.NO_SUCH_OBJECT:  # pragma: no cover
+            logger.debug("LDAPPrincipals.count: ldap.NO_SUCH_OBJECT")
+            return 0
+
+    @override
+    def __len__(self):
+        context = self.context
+        return self.count() \
+            - len(context._deleted_children) \
+            + len(context._added_children)
+
     @default
     @locktree
     def create(self, pid, **kw):
@@ -873,6 +1148,8 @@ def member_attribute(object_classes):
 
 
 class LDAPGroupsMapping(LDAPPrincipals, UgmGroups):
+    membership_index = default(None)
+    group_graph = default(None)
 
     @default
     @property
@@ -889,6 +1166,22 @@ class LDAPGroupsMapping(LDAPPrincipals, UgmGroups):
         mem_attr = member_attribute(cfg.objectClasses)
         cfg.attrmap[mem_attr] = mem_attr
         _next(self, props, cfg)
+        self.membership_index = get_membership_index(
+            props,
+            cfg,
+            self._key_attr,
+            mem_attr,
+            member_format(cfg.objectClasses)
+        )
+        if getattr(cfg, 'nestedGroups', False):
+            self.group_graph = GroupGraph(
+                self.context,
+                self._key_attr,
+                mem_attr,
+                member_format(cfg.objectClasses),
+                max_depth=getattr(cfg, 'nestedGroupsDepth', 10),
+                interval=getattr(cfg, 'nestedGroupsInterval', 30)
+            )
 
     @plumb
     def __setitem__(_next, self, key, value):
@@ -901,6 +1194,50 @@ class LDAPGroupsMapping(LDAPPrincipals, UgmGroups):
         else:
             value.attrs[self._member_attribute].insert(0, 'cn=nobody')
         _next(self, key, value)
+        self._memberships_changed()
+
+    @plumb
+    def __call__(_next, self):
+        _next(self)
+        self._memberships_changed()
+
+    @plumb
+    def invalidate(_next, self, key=None):
+        _next(self, key=key)
+        self._memberships_changed()
+
+    @default
+    def ids_by_member(self, member):
+        """Return ids of principals containing member.
+
+        If nested groups are enabled, ids of principals containing member via
+        nested principals are included and looked up in the group graph.
+        Otherwise ids are looked up in the membership index if enabled, or
+        searched by member attribute. Searches are not cached here, repeated
+        lookups are served by the search cache of the LDAP session if caching
+        is enabled.
+
+        :param member: Member value, either DN or uid depending on member
+            format.
+        """
+        if self.group_graph is not None:
+            return self.group_graph.group_ids(member)
+        if self.membership_index is not None:
+            return self.membership_index.group_ids(member)
+        return [
+            ensure_text(att[self._key_attr][0])
+            for _, att in self.context.batched_search(
+                queryFilter=equality_filter(self._member_attribute, member),
+                attrlist=[self._key_attr]
+            )
+        ]
+
+    @default
+    def _memberships_changed(self):
+        if self.membership_index is not None:
+            self.membership_index.invalidate()
+        if self.group_graph is not None:
+            self.group_graph.invalidate()
 
 
 class LDAPGroups(LDAPGroupsMapping):
@@ -918,6 +1255,7 @@ class LDAPGroups(LDAPGroupsMapping):
         context = group.context
         del context.parent[context.name]
         del self.storage[key]
+        self._memberships_changed()
 
 
 @plumbing(
@@ -950,24 +1288,30 @@ class LDAPRole(LDAPGroupMapping, AliasedPrincipal):
             ret.append('group:{}'.format(key))
         return ret
 
+    @default
+    def existing_members(self, ids):
+        ugm = self.parent.parent
+        user_ids = list()
+        group_ids = list()
+        for key in ids:
+            if key.startswith('group:'):
+                group_ids.append(key[6:])
+            else:
+                user_ids.append(key)
+        ret = ugm.users.existing_ids(user_ids)
+        for key in ugm.groups.existing_ids(group_ids):
+            ret.add('group:{}'.format(key))
+        return ret
+
     @default
     def translate_ids(self, members):
         if self._member_format == FORMAT_DN:
             ugm = self.parent.parent
-            users = ugm.users
-            groups = ugm.groups
-            user_members = list()
-            for dn in members:
-                try:
-                    user_members.append(users.idbydn(dn, True))
-                except KeyError:
-                    pass
-            group_members = list()
-            for dn in members:
-                try:
-                    group_members.append('group:{}'.format(groups.idbydn(dn, True)))
-                except KeyError:
-                    pass
+            user_members = ugm.users.ids_by_dns(members)
+            group_members = [
+                'group:{}'.format(gid)
+                for gid in ugm.groups.ids_by_dns(members)
+            ]
             members = user_members + group_members
         return members
 
@@ -1012,13 +1356,10 @@ class LDAPRole(LDAPGroupMapping, AliasedPrincipal):
             val = principals[real_key].context.DN
         elif self._member_format == FORMAT_UID:
             val = key
-        # self.context.attrs[self._member_attribute].remove won't work here
-        # issue in LDAPNodeAttributes, does not recognize changed this way.
-        members = self.context.attrs[self._member_attribute]
-        members.remove(val)
-        self.context.attrs[self._member_attribute] = members
+        self._remove_member(key, val)
         # XXX: call here immediately?
         self.context()
+        self._memberships_changed()
 
 
 @plumbing(
@@ -1123,28 +1464,16 @@ class LDAPUgm(UgmBase):
         if roles is None:
             # XXX: logging
             return ret
+        if not roles.changed:
+            # query roles containing principal if roles are unchanged
+            if roles._member_format == FORMAT_DN:
+                return roles.ids_by_member(principal.context.DN)
+            return roles.ids_by_member(uid)
         for role in roles.values():
             if uid in role.member_ids:
                 ret.append(role.name)
         return ret
 
-# XXX: Below is the logic for querying roles from LDAP via query. Integrate
-#      to use this logic whenever roles are queried and the roles node is
-#      unchanged.
-#        attribute = roles._member_attribute
-#        format = roles._member_format
-#        if format == FORMAT_DN:
-#            criteria = { attribute: principal.context.DN }
-#        elif format == FORMAT_UID:
-#            # XXX: this is hacky. we really need member relations!!!
-#            if isinstance(principal, Group):
-#                attrkey = principal.parent.context._rdn_attr
-#                value = 'group:%s' % principal.context.attrs[attrkey]
-#            else:
-#                value = principal.context.attrs['uid']
-#            criteria = { attribute: value }
-#        return roles.context.search(criteria=criteria)
-
     @default
     @locktree
     def add_role(self, rolename, principal):
@@ -1155,7 +1484,7 @@ class LDAPUgm(UgmBase):
         role = roles.get(rolename)
         if role is None:
             role = roles.create(rolename)
-        if uid in role.member_ids:
+        if uid in role:
             raise ValueError(u"Principal already has role '{}'".format(rolename))
         role.add(uid)
 
@@ -1169,7 +1498,7 @@ class LDAPUgm(UgmBase):
         role = roles.get(rolename)
         if role is None:
             raise ValueError(u"Role not exists '{}'".format(rolename))
-        if uid not in role.member_ids:
+        if uid not in role:
             raise ValueError(u"Principal does not has role '{}'".format(rolename))
         del role[uid]
         if not role.member_ids:
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+from ldap.filter import escape_filter_chars
+from node.ext.ldap._node import LDAPNode
+from node.ext.ldap.base import ensure_text
+from node.ext.ldap.base import normalize_dn
+import ldap
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger('node.ext.ldap')
+
+# group member format
+FORMAT_DN = 0
+FORMAT_UID = 1
+
+
+def normalize_member(member, member_format):
+    """Return member value suitable for comparison.
+
+    DNs get normalized if ``member_format`` is ``FORMAT_DN``. Values which
+    are no valid DNs are returned unchanged.
+    """
+    member = ensure_text(member)
+    if member_format == FORMAT_DN:
+        try:
+            return normalize_dn(member)
+        except ldap.DECODING_ERROR:
+            pass
+    return member
+
+
+class MembershipIndex(object):
+    """In-process reverse membership index of a groups or roles container.
+
+    The index maps member values to the ids of the groups containing them.
+    Member values are either normalized DNs or uids, depending on the member
+    format of the container.
+
+    The index is built from one paged scan of the container. Afterwards it is
+    refreshed at most every ``interval`` seconds by searching the entries
+    changed since the latest seen value of ``stamp_attr``, which must be an
+    operational attribute with ordering matching rule like
+    ``modifyTimestamp`` or ``entryCSN``. Entries removed by other clients
+    are detected by comparing the number of entries in the container with
+    the number of indexed groups, in which case the index gets rebuilt. If
+    entries provide no ``stamp_attr``, each refresh rebuilds the index.
+    """
+
+    def __init__(self, props, baseDN, scope, queryFilter, key_attr,
+                 member_attr, member_format, interval=30,
+                 stamp_attr='modifyTimestamp'):
+        """Create membership index.
+
+        :param props: ``LDAPProps`` instance.
+        :param baseDN: Base DN of the container.
+        :param scope: Search scope for entries in the container.
+        :param queryFilter: Search filter for entries in the container.
+        :param key_attr: Attribute containing the entry id.
+        :param member_attr: Attribute containing the members.
+        :param member_format: Either ``FORMAT_DN`` or ``FORMAT_UID``.
+        :param interval: Minimum number of seconds between refreshes.
+        :param stamp_attr: Attribute used to detect changed entries.
+        """
+        context = LDAPNode(name=baseDN, props=props)
+        context.search_filter = queryFilter
+        context.search_scope = int(scope)
+        self.context = context
+        self.key_attr = key_attr
+        self.member_attr = member_attr
+        self.member_format = member_format
+        self.interval = interval
+        self.stamp_attr = stamp_attr
+        self._lock = threading.RLock()
+        self._members = None
+        self._groups = dict()
+        self._stamp = None
+        self._checked = 0
+
+    def group_ids(self, member):
+        """Return ids of groups containing member.
+
+        :param member: Member value, either DN or uid depending on member
+            format.
+        """
+        member = self.normalize(member)
+        with self._lock:
+            self._refresh_if_expired()
+            return list(self._groups.get(member, ()))
+
+    def members(self, group_id):
+        """Return normalized member values of group.
+
+        Raise ``KeyError`` if group is not contained in the index.
+
+        :param group_id: Id of the group.
+        """
+        with self._lock:
+            self._refresh_if_expired()
+            return list(self._members[group_id])
+
+    def invalidate(self):
+        """Refresh index on next access.
+        """
+        with self._lock:
+            self._checked = 0
+
+    def normalize(self, member):
+        """Return member value as used in the index.
+        """
+        return normalize_member(member, self.member_format)
+
+    def rebuild(self):
+        """Build index from scratch.
+        """
+        with self._lock:
+            self._members = dict()
+            self._groups = dict()
+            self._stamp = None
+            self._scan()
+            self._checked = time.time()
+
+    def refresh(self):
+        """Update index with entries changed since last refresh.
+        """
+        with self._lock:
+            if self._members is None or self._stamp is None:
+                self.rebuild()
+                return
+            queryFilter = '({}>={})'.format(
+                self.stamp_attr,
+                escape_filter_chars(self._stamp)
+            )
+            self._scan(queryFilter)
+            try:
+                count = self.context.count()
+            except ldap.NO_SUCH_OBJECT:
+                count = 0
+            if count != len(self._members):
+                logger.debug('Membership index outdated, rebuild')
+                self.rebuild()
+                return
+            self._checked = time.time()
+
+    def _refresh_if_expired(self):
+        if time.time() - self._checked >= self.interval:
+            self.refresh()
+
+    def _scan(self, queryFilter=None):
+        # index entries matching query filter
+        attrlist = [self.key_attr, self.member_attr, self.stamp_attr]
+        results = self.context.iter_search(
+            queryFilter=queryFilter,
+            attrlist=attrlist
+        )
+        try:
+            for _, attrs in results:
+                self._index_entry(attrs)
+        except ldap.NO_SUCH_OBJECT:
+            logger.debug('Membership index container does not exist')
+
+    def _index_entry(self, attrs):
+        # index search result entry
+        try:
+            group_id = ensure_text(attrs[self.key_attr][0])
+        except (IndexError, KeyError):
+            return
+        self._index(
+            group_id,
+            [self.normalize(m) for m in attrs.get(self.member_attr, [])]
+        )
+        stamp = attrs.get(self.stamp_attr)
+        if stamp:
+            stamp = ensure_text(stamp[0])
+            if self._stamp is None or stamp > self._stamp:
+                self._stamp = stamp
+
+    def _index(self, group_id, members):
+        # replace members of group in index
+        for member in self._members.get(group_id, ()):
+            group_ids = self._groups.get(member)
+            if group_ids is not None:
+                group_ids.pop(group_id, None)
+                if not group_ids:
+                    del self._groups[member]
+        self._members[group_id] = members
+        for member in members:
+            self._groups.setdefault(member, dict())[group_id] = None
+
+
+_indexes = dict()
+_indexes_lock = threading.Lock()
+
+
+def get_membership_index(props, cfg, key_attr, member_attr, member_format):
+    """Return membership index for a groups or roles configuration.
+
+    Indices are shared within the process for equal configurations. Return
+    ``None`` if membership index is not enabled in configuration.
+
+    :param props: ``LDAPProps`` instance.
+    :param cfg: ``GroupsConfig`` or ``RolesConfig`` instance.
+    :param key_attr: Attribute containing the group id.
+    :param member_attr: Attribute containing the members.
+    :param member_format: Either ``FORMAT_DN`` or ``FORMAT_UID``.
+    """
+    if not getattr(cfg, 'membershipIndex', False):
+        return None
+    interval = getattr(cfg, 'membershipIndexInterval', 30)
+    stamp_attr = getattr(cfg, 'membershipIndexAttr', 'modifyTimestamp')
+    key = (
+        props.uri,
+        props.user,
+        cfg.baseDN,
+        int(cfg.scope),
+        str(cfg.queryFilter),
+        key_attr,
+        member_attr,
+        stamp_attr
+    )
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = MembershipIndex(
+                props,
+                cfg.baseDN,
+                cfg.scope,
+                cfg.queryFilter,
+                key_attr,
+                member_attr,
+                member_format,
+                interval=interval,
+                stamp_attr=stamp_attr
+            )
+        index.interval = interval
+        return index
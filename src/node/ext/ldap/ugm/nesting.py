@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+from ldap.dn import dn2str
+from ldap.dn import str2dn
+from node.ext.ldap.base import ensure_text
+from node.ext.ldap.base import normalize_dn
+from node.ext.ldap.filter import chunked_or_filters
+from node.ext.ldap.filter import equality_filter
+from node.ext.ldap.scope import BASE
+from node.ext.ldap.scope import ONELEVEL
+from node.ext.ldap.ugm.membership import FORMAT_DN
+from node.ext.ldap.ugm.membership import normalize_member
+import ldap
+import threading
+import time
+
+
+class GroupGraph(object):
+    """Graph of nested groups in a groups or roles container.
+
+    Groups and their members are identified by normalized member values,
+    which are DNs or ids depending on the member format. Memberships are
+    expanded breadth first with one pipelined search per level and cached
+    for ``interval`` seconds or until the graph gets invalidated. Cycles are
+    detected and expansion stops after ``max_depth`` levels, direct
+    memberships being the first level.
+
+    Nested groups are expected to be contained in the same container. With
+    member format ``FORMAT_UID`` as used by ``posixGroup``, member values
+    equal to a group id are considered nested groups.
+    """
+
+    def __init__(self, context, key_attr, member_attr, member_format,
+                 max_depth=10, chunk_size=100, interval=30):
+        """Create group graph.
+
+        :param context: ``LDAPNode`` of the container.
+        :param key_attr: Attribute containing the group id.
+        :param member_attr: Attribute containing the members.
+        :param member_format: Either ``FORMAT_DN`` or ``FORMAT_UID``.
+        :param max_depth: Maximum number of levels to expand.
+        :param chunk_size: Maximum number of values per search filter.
+        :param interval: Number of seconds memberships are cached. ``0``
+            caches memberships only while expanding them.
+        """
+        self.context = context
+        self.key_attr = key_attr
+        self.member_attr = member_attr
+        self.member_format = member_format
+        self.max_depth = max_depth
+        self.chunk_size = chunk_size
+        self.interval = interval
+        self._lock = threading.RLock()
+        # member value -> list of (group id, group member value)
+        self._parents = dict()
+        # group member value -> (group id, member values) or None
+        self._groups = dict()
+        # time the cached memberships have been started to be collected
+        self._stamp = time.time()
+
+    def group_ids(self, member):
+        """Return ids of groups containing member directly or via nested
+        groups, ordered by level.
+
+        :param member: Member value, either DN or uid depending on member
+            format.
+        """
+        value = self.normalize(member)
+        ret = list()
+        with self._lock:
+            self._expire()
+            visited = set([value])
+            level = [value]
+            depth = 0
+            while level and depth < self.max_depth:
+                self._fetch_parents([
+                    v for v in level if v not in self._parents
+                ])
+                parents = list()
+                for value in level:
+                    for group_id, group_value in self._parents[value]:
+                        if group_value in visited:
+                            continue
+                        visited.add(group_value)
+                        ret.append(group_id)
+                        parents.append(group_value)
+                level = parents
+                depth += 1
+        return ret
+
+    def members(self, group, members):
+        """Return members of group including members of nested groups,
+        ordered by level.
+
+        Nested groups are contained in the result themselves.
+
+        :param group: Member value of the group, either DN or id depending
+            on member format.
+        :param members: Direct member values of the group.
+        :return: List of normalized member values.
+        """
+        ret = list()
+        with self._lock:
+            self._expire()
+            visited = set([self.normalize(group)])
+            level = [self.normalize(member) for member in members]
+            depth = 1
+            while level:
+                expand = list()
+                for value in level:
+                    if value in visited:
+                        continue
+                    visited.add(value)
+                    ret.append(value)
+                    expand.append(value)
+                if depth >= self.max_depth:
+                    break
+                self._fetch_groups([
+                    v for v in expand if v not in self._groups
+                ])
+                level = list()
+                for value in expand:
+                    nested = self._groups[value]
+                    if nested is not None:
+                        level.extend(nested[1])
+                depth += 1
+        return ret
+
+    def invalidate(self):
+        """Drop cached memberships.
+        """
+        with self._lock:
+            self._parents.clear()
+            self._groups.clear()
+            self._stamp = time.time()
+
+    def normalize(self, member):
+        """Return member value as used in the graph.
+        """
+        return normalize_member(member, self.member_format)
+
+    def _expire(self):
+        # drop cached memberships older than interval
+        if time.time() - self._stamp >= self.interval:
+            self.invalidate()
+
+    def _fetch_parents(self, values):
+        # search groups directly containing values
+        if not values:
+            return
+        context = self.context
+        requests = [dict(
+            queryFilter=str(context._search_filter(
+                queryFilter=equality_filter(self.member_attr, value)
+            )),
+            scope=context.search_scope,
+            baseDN=context.DN,
+            force_reload=context._reload,
+            attrlist=[self.key_attr]
+        ) for value in values]
+        results = context.ldap_session.multi_search(requests)
+        for value, res in zip(values, results):
+            parents = list()
+            for dn, attrs in res:
+                try:
+                    group_id = ensure_text(attrs[self.key_attr][0])
+                except (IndexError, KeyError):
+                    continue
+                if self.member_format == FORMAT_DN:
+                    parents.append((group_id, self.normalize(dn)))
+                else:
+                    parents.append((group_id, group_id))
+            self._parents[value] = parents
+
+    def _fetch_groups(self, values):
+        # lookup which values are groups and fetch their members
+        if not values:
+            return
+        context = self.context
+        attrlist = [self.key_attr, self.member_attr]
+        for value in values:
+            self._groups[value] = None
+        if self.member_format == FORMAT_DN:
+            query = str(context._search_filter())
+            candidates = [v for v in values if self._in_container(v)]
+            if not candidates:
+                return
+            requests = [dict(
+                queryFilter=query,
+                scope=BASE,
+                baseDN=value,
+                force_reload=context._reload,
+                attrlist=attrlist
+            ) for value in candidates]
+            results = context.ldap_session.multi_search(requests)
+            for value, res in zip(candidates, results):
+                for _, attrs in res:
+                    self._groups[value] = self._group(attrs)
+            return
+        requests = [dict(
+            queryFilter=str(context._search_filter() & chunk_filter),
+            scope=context.search_scope,
+            baseDN=context.DN,
+            force_reload=context._reload,
+            attrlist=attrlist
+        ) for chunk_filter in chunked_or_filters(
+            self.key_attr,
+            values,
+            self.chunk_size
+        )]
+        for res in context.ldap_session.multi_search(requests):
+            for _, attrs in res:
+                group = self._group(attrs)
+                if group is not None and group[0] in self._groups:
+                    self._groups[group[0]] = group
+
+    def _group(self, attrs):
+        # group id and normalized members from search result attributes
+        try:
+            group_id = ensure_text(attrs[self.key_attr][0])
+        except (IndexError, KeyError):
+            return None
+        return (
+            group_id,
+            [self.normalize(m) for m in attrs.get(self.member_attr, [])]
+        )
+
+    def _in_container(self, dn):
+        # check whether normalized DN is located in the container
+        try:
+            rdns = str2dn(dn)
+            base = str2dn(normalize_dn(self.context.DN))
+        except ldap.DECODING_ERROR:
+            return False
+        if len(rdns) <= len(base):
+            return False
+        if dn2str(rdns[len(rdns) - len(base):]) != dn2str(base):
+            return False
+        if self.context.search_scope == ONELEVEL:
+            return len(rdns) == len(base) + 1
+        return self.context.search_scope != BASE